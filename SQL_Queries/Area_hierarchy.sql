@@ -0,0 +1,5 @@
+-- Parent mapping of every region, used to roll children up into their parents
+SELECT DISTINCT ASGSCode, RegionType, Parent
+    FROM dbo.AreasAsgs
+    WHERE RegionType IN ('FA', 'SA2', 'SA3', 'SA4')
+        AND /* region_scope: ASGSCode */ 1 = 1
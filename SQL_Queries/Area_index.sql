@@ -0,0 +1,3 @@
+-- Every region of every ASGS edition with its type, parent and name, loaded into the hierarchy index (see hierarchy.py)
+SELECT ASGSCode, ASGS, RegionType, Parent, Name
+    FROM dbo.AreasAsgs
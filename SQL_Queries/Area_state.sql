@@ -0,0 +1,9 @@
+-- Cheap summary of AreasAsgs, the saved hierarchy index (see hierarchy.py) is rebuilt when it changes.
+-- parent_links weights every Parent by its code so a region moved to another parent changes it even
+-- if the sums stay the same, name_checksum does the same for the type and name of every region.
+SELECT COUNT(*) AS row_count, MAX(ASGSCode) AS max_code,
+        SUM(CAST(ASGSCode AS FLOAT)) AS code_checksum, SUM(CAST(Parent AS FLOAT)) AS parent_checksum,
+        CAST(SUM((CAST(ASGSCode AS BIGINT) * CAST(Parent AS BIGINT)) % 1000003) AS BIGINT) AS parent_links,
+        CAST(SUM(CAST(BINARY_CHECKSUM(RegionType, Name) AS BIGINT) * (CAST(ASGSCode AS BIGINT) % 1009)) AS BIGINT)
+            AS name_checksum
+    FROM dbo.AreasAsgs
@@ -1,3 +1,4 @@
 SELECT distinct ASGSCode, RegionType
     FROM [forecasts].[dbo].[AreasAsgs]
+    where /* region_scope: ASGSCode */ 1 = 1
     order by ASGSCode
\ No newline at end of file
@@ -0,0 +1,6 @@
+-- Yearly births of every FA and SA2, loaded into the Births forecast matrix (see forecast_matrix.py)
+SELECT b.ASGSCode, b.Year, SUM(b.Number) AS Total
+    FROM dbo.Births b
+    WHERE b.ASGSCode IN (SELECT ASGSCode FROM dbo.AreasAsgs WHERE RegionType IN ('FA', 'SA2'))
+        AND /* region_scope: b.ASGSCode */ 1 = 1
+    GROUP BY b.ASGSCode, b.Year
@@ -0,0 +1,6 @@
+-- Yearly deaths of every FA and SA2, loaded into the Deaths forecast matrix (see forecast_matrix.py)
+SELECT d.ASGSCode, d.Year, SUM(d.Number) AS Total
+    FROM dbo.Deaths d
+    WHERE d.ASGSCode IN (SELECT ASGSCode FROM dbo.AreasAsgs WHERE RegionType IN ('FA', 'SA2'))
+        AND /* region_scope: d.ASGSCode */ 1 = 1
+    GROUP BY d.ASGSCode, d.Year
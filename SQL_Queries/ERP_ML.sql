@@ -8,5 +8,6 @@ FROM
 LEFT JOIN [forecasts].[dbo].[AreasAsgs] as a ON e.ASGS_2016 = a.ASGSCode
 WHERE 
     a.RegionType IN ('FA','SA2') and a.ASGS = 2021 -- selecting the latest census 2021
+    and /* region_scope: e.ASGS_2016 */ 1 = 1
 GROUP BY 
 a.RegionType, e.ERPYear,e.ASGS_2016
\ No newline at end of file
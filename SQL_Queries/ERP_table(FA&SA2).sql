@@ -2,5 +2,6 @@ SELECT ASGS_2016, SUM([Number]) as ERP, ERPYear
     FROM [forecasts].[dbo].[ERP] e
     left join [forecasts].[dbo].[AreasAsgs] a
     on e.ASGS_2016 = a.ASGSCode
-    where a.[RegionType] = 'FA' or a.[RegionType] = 'SA2'
+    where (a.[RegionType] = 'FA' or a.[RegionType] = 'SA2')
+        and /* region_scope: e.ASGS_2016 */ 1 = 1
     group by ASGS_2016, ERPYear
\ No newline at end of file
@@ -0,0 +1,8 @@
+-- Years with FA or SA2 ERP per ASGS edition, so every partition of a partitioned run (see partitioned.py) gets the year rows of a full run
+SELECT DISTINCT e.ERPYear, a.ASGS
+    FROM [forecasts].[dbo].[ERP] e
+    left join [forecasts].[dbo].[AreasAsgs] a
+    on e.ASGS_2016 = a.ASGSCode
+    where (a.[RegionType] = 'FA' or a.[RegionType] = 'SA2')
+        and e.[Number] IS NOT NULL
+        and /* region_scope: e.ASGS_2016 */ 1 = 1
@@ -0,0 +1,27 @@
+-- Granular drill-down of the Deaths sum check, FA vs SA2
+-- Sparse (SA2, sex, age, year) cube of deaths: every FA cell is rolled up into its parent SA2 and every SA2
+-- cell is kept as is, with one grouped join, and only the cells where the two differ by more than the
+-- tolerance (the parameter) are returned. SA2s without FAs in the hierarchy are not compared.
+WITH Links AS (
+    SELECT DISTINCT ASGSCode, Parent AS SA2, 'FA' AS Level
+        FROM dbo.AreasAsgs
+        WHERE RegionType = 'FA'
+    UNION
+    SELECT DISTINCT Parent, Parent, 'SA2'
+        FROM dbo.AreasAsgs
+        WHERE RegionType = 'FA'
+)
+SELECT
+    l.SA2,
+    d.SexKey AS SexKey,
+    d.AgeKey AS AgeKey,
+    d.Year AS Year,
+    SUM(CASE WHEN l.Level = 'SA2' THEN d.Number ELSE 0 END) AS SA2Total,
+    SUM(CASE WHEN l.Level = 'FA' THEN d.Number ELSE 0 END) AS FATotal
+FROM dbo.Deaths AS d
+INNER JOIN Links AS l
+    ON d.ASGSCode = l.ASGSCode
+WHERE /* region_scope: d.ASGSCode */ 1 = 1
+GROUP BY l.SA2, d.SexKey, d.AgeKey, d.Year
+HAVING ABS(SUM(CASE WHEN l.Level = 'SA2' THEN d.Number ELSE 0 END)
+           - SUM(CASE WHEN l.Level = 'FA' THEN d.Number ELSE 0 END)) > ?
@@ -0,0 +1,8 @@
+-- Yearly number of households (HhKey 19, every household) of every FA and SA2, loaded into the
+-- Households forecast matrix (see forecast_matrix.py)
+SELECT h.ASGSCode, h.ERPYear AS Year, SUM(h.Number) AS Total
+    FROM dbo.Households h
+    WHERE h.HhKey = 19
+        AND h.ASGSCode IN (SELECT ASGSCode FROM dbo.AreasAsgs WHERE RegionType IN ('FA', 'SA2'))
+        AND /* region_scope: h.ASGSCode */ 1 = 1
+    GROUP BY h.ASGSCode, h.ERPYear
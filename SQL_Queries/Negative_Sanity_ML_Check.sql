@@ -7,7 +7,6 @@
                 WHEN a.SexKey = 2 THEN 'Female' 
             END AS Sex,
             a.Year, b.RegionType, b.Parent,
-            p.Name AS ParentName, 
             SUM(a.Number) AS Total,
             'Births' AS DataType
         FROM 
@@ -15,15 +14,13 @@
         LEFT JOIN 
             AreasAsgs AS b 
             ON a.ASGSCode = b.ASGSCode
-        LEFT JOIN 
-            AreasAsgs AS p
-            ON b.Parent = p.ASGSCode 
         WHERE 
             a.Number <= 0
             AND b.RegionType IN ('FA', 'SA2')
+            AND /* region_scope: a.ASGSCode */ 1 = 1
         GROUP BY 
             a.ASGSCode, a.SexKey, a.Year, b.RegionType, 
-            b.Parent, p.Name
+            b.Parent
 
         UNION ALL
         
@@ -35,7 +32,6 @@
                 WHEN a.SexKey = 2 THEN 'Female' 
             END AS Sex,
             a.Year, b.RegionType, b.Parent,
-            p.Name AS ParentName, 
             SUM(a.Number) AS Total,
             'Deaths' AS DataType
         FROM 
@@ -43,15 +39,13 @@
         LEFT JOIN 
             AreasAsgs AS b 
             ON a.ASGSCode = b.ASGSCode
-        LEFT JOIN 
-            AreasAsgs AS p
-            ON b.Parent = p.ASGSCode -- Self-join to get parent region name
         WHERE 
             a.Number <= 0
             AND b.RegionType IN ('FA', 'SA2')
+            AND /* region_scope: a.ASGSCode */ 1 = 1
         GROUP BY 
             a.ASGSCode, a.SexKey, a.Year,
-            b.RegionType, b.Parent, p.Name
+            b.RegionType, b.Parent
 
         UNION ALL
         
@@ -64,7 +58,6 @@
             END AS Sex,
             a.ERPYear AS Year,
             b.RegionType, b.Parent,
-            p.Name AS ParentName, -- Get the name of the parent region
             SUM(a.Number) AS Total,
             'ERP' AS DataType
         FROM 
@@ -72,16 +65,15 @@
         LEFT JOIN 
             [forecasts].[dbo].[AreasAsgs] AS b
             ON a.ASGS_2016 = b.ASGSCode
-        LEFT JOIN 
-            [forecasts].[dbo].[AreasAsgs] AS p
-            ON b.Parent = p.ASGSCode -- Self-join to get parent region name
         WHERE 
             b.RegionType IN ('SA2', 'FA')
+            AND /* region_scope: a.ASGS_2016 */ 1 = 1
         GROUP BY 
             a.ASGS_2016, a.ERPYear, b.RegionType, 
-            b.Parent, p.Name, a.SexKey
+            b.Parent, a.SexKey
     )
 
     SELECT * 
     FROM CombinedData
+    WHERE /* filter */ 1 = 1
     ORDER BY DataType, Year, Total;
\ No newline at end of file
@@ -0,0 +1,36 @@
+-- Fingerprint of the data of every region in every source table, compared between runs to find
+-- the regions whose data changed. WeightedTotal weights each number by its keys so moving a
+-- number between years, sexes or ages changes the fingerprint even if the total stays the same.
+SELECT ASGSCode, 'Births' AS SourceTable, COUNT(*) AS RowCount,
+       SUM(CAST(Number AS FLOAT)) AS Total,
+       SUM(CAST(Number AS FLOAT) * (Year * 1000 + SexKey * 100 + AgeKey)) AS WeightedTotal
+    FROM dbo.Births
+    WHERE /* region_scope: ASGSCode */ 1 = 1
+    GROUP BY ASGSCode
+
+UNION ALL
+
+SELECT ASGSCode, 'Deaths' AS SourceTable, COUNT(*) AS RowCount,
+       SUM(CAST(Number AS FLOAT)) AS Total,
+       SUM(CAST(Number AS FLOAT) * (Year * 1000 + SexKey * 100 + AgeKey)) AS WeightedTotal
+    FROM dbo.Deaths
+    WHERE /* region_scope: ASGSCode */ 1 = 1
+    GROUP BY ASGSCode
+
+UNION ALL
+
+SELECT ASGS_2016 AS ASGSCode, 'ERP' AS SourceTable, COUNT(*) AS RowCount,
+       SUM(CAST(Number AS FLOAT)) AS Total,
+       SUM(CAST(Number AS FLOAT) * (ERPYear * 1000 + SexKey * 100 + AgeKey)) AS WeightedTotal
+    FROM dbo.ERP
+    WHERE /* region_scope: ASGS_2016 */ 1 = 1
+    GROUP BY ASGS_2016
+
+UNION ALL
+
+SELECT ASGSCode, 'Households' AS SourceTable, COUNT(*) AS RowCount,
+       SUM(CAST(Number AS FLOAT)) AS Total,
+       SUM(CAST(Number AS FLOAT) * (ERPYear * 1000 + HhKey)) AS WeightedTotal
+    FROM dbo.Households
+    WHERE /* region_scope: ASGSCode */ 1 = 1
+    GROUP BY ASGSCode
@@ -0,0 +1,26 @@
+-- Total of every metric per region code, rolled up in Python for the region level sum checks
+SELECT ASGSCode, 'Births' AS DataType, SUM(Number) AS Total
+    FROM dbo.Births
+    WHERE /* region_scope: ASGSCode */ 1 = 1
+    GROUP BY ASGSCode
+
+UNION ALL
+
+SELECT ASGSCode, 'Deaths' AS DataType, SUM(Number) AS Total
+    FROM dbo.Deaths
+    WHERE /* region_scope: ASGSCode */ 1 = 1
+    GROUP BY ASGSCode
+
+UNION ALL
+
+SELECT ASGSCode, 'Households' AS DataType, SUM(Number) AS Total
+    FROM dbo.Households
+    WHERE HhKey = 19 AND /* region_scope: ASGSCode */ 1 = 1
+    GROUP BY ASGSCode
+
+UNION ALL
+
+SELECT ASGS_2016 AS ASGSCode, 'Population' AS DataType, SUM(Number) AS Total
+    FROM dbo.ERP
+    WHERE /* region_scope: ASGS_2016 */ 1 = 1
+    GROUP BY ASGS_2016
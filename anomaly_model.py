@@ -0,0 +1,202 @@
+"""
+This file contains the machine learning anomaly engine used by the ML anomaly check.
+Every FA and SA2 is described by one row of features computed from its ERP time series (growth
+rates, volatility and its share of the parent region), and an IsolationForest per region type
+scores all regions at once. Fitted models are saved per region type and forecast vintage, so a
+later run on the same vintage only scores, and the models of older vintages are deleted.
+"""
+import glob
+import hashlib
+import logging
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+MODEL_DIR = "models"
+
+FEATURES = ['growth_mean', 'growth_min', 'growth_max', 'volatility',
+            'share_mean', 'share_change', 'share_volatility']
+
+
+def _safe_ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = numerator / denominator
+    ratio[~np.isfinite(ratio)] = np.nan
+    return ratio
+
+
+def _edge_values(values):
+    """
+    output: the first and the last non-NaN value of every row (NaN for rows without any)
+    """
+    valid = ~np.isnan(values)
+    rows = np.arange(len(values))
+    first = values[rows, valid.argmax(axis=1)]
+    last = values[rows, values.shape[1] - 1 - valid[:, ::-1].argmax(axis=1)]
+    empty = ~valid.any(axis=1)
+    first[empty] = np.nan
+    last[empty] = np.nan
+    return first, last
+
+
+def region_features(erp, hierarchy, years=None):
+    """
+    The purpose of this function is to build the feature matrix of the ML check, one row per region
+
+    input: ERP DataFrame (ASGSCode | ERPYear | RegionType | Total),
+           hierarchy DataFrame (ASGSCode | RegionType | Parent),
+           optional list of every year of the run (for a partition of the regions, see partitioned.py)
+    output: DataFrame indexed by ASGSCode with a RegionType column and the FEATURES columns
+    """
+    wide = erp.pivot_table(index='ASGSCode', columns='ERPYear', values='Total', aggfunc='sum', observed=True)
+    if years is not None:
+        wide = wide.reindex(columns=years)
+    values = wide.to_numpy(dtype='float64')
+    if values.shape[1] < 2:
+        # one year gives no growth rate, pad so every feature is still defined (as 0)
+        values = np.hstack([values, values])
+
+    growth = _safe_ratio(values[:, 1:], values[:, :-1]) - 1
+
+    # share of the parent region: the region over the sum of the regions with the same parent
+    parents = hierarchy.drop_duplicates('ASGSCode').set_index('ASGSCode')['Parent']
+    parent_of = pd.Series(wide.index.map(parents), index=wide.index).astype('float64').to_numpy()
+    sibling_total = pd.DataFrame(values).groupby(parent_of, dropna=False).transform('sum').to_numpy()
+    share = _safe_ratio(values, sibling_total)
+    share[np.isnan(parent_of)] = np.nan
+    first_share, last_share = _edge_values(share)
+
+    # regions without any usable value give all-NaN rows, their features are set to 0 below
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        features = pd.DataFrame({
+            'growth_mean': np.nanmean(growth, axis=1),
+            'growth_min': np.nanmin(growth, axis=1),
+            'growth_max': np.nanmax(growth, axis=1),
+            'volatility': np.nanstd(growth, axis=1),
+            'share_mean': np.nanmean(share, axis=1),
+            'share_change': last_share - first_share,
+            'share_volatility': np.nanstd(np.diff(share, axis=1), axis=1),
+        }, index=wide.index)
+    region_types = erp.drop_duplicates('ASGSCode').set_index('ASGSCode')['RegionType'].astype(str).str.strip()
+    features.insert(0, 'RegionType', region_types.reindex(features.index).to_numpy())
+    return features.fillna({feature: 0.0 for feature in FEATURES})
+
+
+def row_hashes(erp):
+    """
+    output: DataFrame (ASGSCode | ERPYear | Hash) with the hash of every ERP row
+    """
+    rows = erp[['ASGSCode', 'ERPYear', 'Total']]
+    return pd.DataFrame({'ASGSCode': rows['ASGSCode'].to_numpy(), 'ERPYear': rows['ERPYear'].to_numpy(),
+                         'Hash': pd.util.hash_pandas_object(rows, index=False).to_numpy()})
+
+
+def data_vintage(erp, hashes=None):
+    """
+    output: a short hash of the ERP data, used as the vintage when none is given. It only depends
+            on the row hashes in code and year order, so it can also be computed from the
+            row_hashes of the partitions of the data (hashes)
+    """
+    hashes = row_hashes(erp) if hashes is None else hashes
+    ordered = hashes.sort_values(['ASGSCode', 'ERPYear'])
+    digest = hashlib.sha1(ordered['Hash'].to_numpy().tobytes())
+    return digest.hexdigest()[:12]
+
+
+def model_path(model_dir, region_type, vintage, contamination):
+    return os.path.join(model_dir, f"isolation_forest_{region_type}_{vintage}_{contamination:g}.joblib")
+
+
+def remove_old_models(model_dir, region_type, vintage):
+    """
+    The purpose of this function is to delete the saved models of a region type fitted on other
+    vintages, so the model directory does not grow with every forecast
+
+    input: model directory, region type, vintage of the model that was just saved
+    """
+    current = os.path.basename(model_path(model_dir, region_type, vintage, 0)).rsplit('_', 1)[0] + '_'
+    for path in glob.glob(os.path.join(glob.escape(model_dir), f"isolation_forest_{region_type}_*.joblib")):
+        if not os.path.basename(path).startswith(current):
+            try:
+                os.remove(path)
+                logging.info(f"Removed old ML model {path}")
+            except OSError as e:
+                logging.error(f"Old ML model {path} could not be removed: {e}")
+
+
+def fitted_model(features, region_type, vintage, contamination, model_dir=MODEL_DIR, n_jobs=-1):
+    """
+    The purpose of this function is to load the model of a region type and vintage, fitting and
+    saving it first if there is none yet
+
+    input: feature DataFrame of the regions of this type, region type, vintage, contamination,
+           model directory (None to never save), number of parallel jobs
+    output: fitted IsolationForest
+    """
+    import joblib
+    from sklearn.ensemble import IsolationForest
+
+    path = model_path(model_dir, region_type, vintage, contamination) if model_dir else None
+    if path and os.path.exists(path):
+        saved = joblib.load(path)
+        if saved['features'] == FEATURES:
+            logging.info(f"Loaded ML model {path}")
+            saved['model'].set_params(n_jobs=n_jobs)
+            return saved['model']
+
+    model = IsolationForest(contamination=contamination, random_state=42, n_jobs=n_jobs)
+    model.fit(features[FEATURES].to_numpy())
+    if path:
+        os.makedirs(model_dir, exist_ok=True)
+        joblib.dump({'model': model, 'features': FEATURES}, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        logging.info(f"Saved ML model {path}")
+        remove_old_models(model_dir, region_type, vintage)
+    return model
+
+
+def detect_anomalies(erp, hierarchy, contamination, vintage=None, model_dir=MODEL_DIR, n_jobs=-1):
+    """
+    The purpose of this function is to score every FA and SA2 and return the anomalous ones.
+    A region with a negative ERP total is always anomalous.
+
+    input: ERP DataFrame (ASGSCode | ERPYear | RegionType | Total), hierarchy DataFrame,
+           contamination, forecast vintage (default: a hash of the ERP data), model directory
+           (None to never save models), number of parallel jobs
+    output: DataFrame (ASGSCode | RegionType | Score), lower scores are more anomalous
+    """
+    if erp.empty:
+        return pd.DataFrame(columns=['ASGSCode', 'RegionType', 'Score'])
+    vintage = data_vintage(erp) if vintage is None else vintage
+    features = region_features(erp, hierarchy)
+    negative = erp.loc[erp['Total'] < 0, 'ASGSCode'].unique()
+    return score_regions(features, negative, contamination, vintage, model_dir, n_jobs)
+
+
+def score_regions(features, negative, contamination, vintage, model_dir=MODEL_DIR, n_jobs=-1):
+    """
+    The purpose of this function is to score the feature rows of every FA and SA2 and return the
+    anomalous ones (see detect_anomalies)
+
+    input: feature DataFrame of region_features (sorted by code), codes of the regions with a
+           negative ERP total, contamination, forecast vintage, model directory, number of parallel jobs
+    output: DataFrame (ASGSCode | RegionType | Score)
+    """
+    flagged = []
+    for region_type in ['FA', 'SA2']:
+        region_features_ = features[features['RegionType'] == region_type]
+        if region_features_.empty:
+            continue
+        model = fitted_model(region_features_, region_type, vintage, contamination, model_dir, n_jobs)
+        matrix = region_features_[FEATURES].to_numpy()
+        scores = model.decision_function(matrix)
+        mask = (scores < 0) | region_features_.index.isin(negative)
+        flagged.append(pd.DataFrame({'ASGSCode': region_features_.index[mask], 'RegionType': region_type,
+                                     'Score': scores[mask]}))
+    if not flagged:
+        return pd.DataFrame(columns=['ASGSCode', 'RegionType', 'Score'])
+    return pd.concat(flagged, ignore_index=True)
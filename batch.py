@@ -0,0 +1,155 @@
+"""
+This file contains the headless batch mode, which runs the checks for many SA4 regions at once
+without the parameter window (tkinter is never imported).
+Parameters come from parameters.txt and/or the command line. Every dataset is fetched once and the
+rollup of the region level sum checks is computed once for every region; its mismatches are split
+by SA4 and the sum checks of each SA4 run as one job in a worker process on its own mismatches
+only. The national checks run once, and everything is written to one combined csv file.
+
+usage: python batch.py --sa4 all
+       python batch.py --sa4 401 402 403 --workers 4 --output batch_output.csv
+"""
+import argparse
+import logging
+import time
+
+import pandas as pd
+
+from main import connect_to_database, write_output
+from metrics import RunMetrics
+from parameters import DEFAULT_PARAMETERS, parse_parameter, read_parameters
+from partitioned import PARTITION_LEVELS
+from registry import CHECKS, build_tasks
+
+
+# checks that are run separately for every SA4 of the batch
+SA4_CHECKS = ["births check", "deaths check", "household check", "population check"]
+
+
+def list_sa4_codes(session):
+    """
+    output: sorted list of every SA4 code in the region hierarchy
+    """
+    hierarchy = session.fetch("Area_hierarchy.sql")
+    sa4 = hierarchy.loc[hierarchy['RegionType'].astype(str).str.strip() == 'SA4', 'ASGSCode']
+    return sorted(int(code) for code in sa4.unique())
+
+
+def run_sa4_checks(session, sa4_code, checks):
+    """
+    The purpose of this function is to run the SA4-scoped checks of one SA4, it runs in a worker
+    process on a session holding the rollup mismatches of that SA4
+
+    input: DataSession, SA4 code, list of (check name, check function)
+    output: merged output of the checks with a Check column naming the check of every flag,
+            None if nothing was flagged
+    """
+    outputs = []
+    for name, func in checks:
+        output = func(session, sa4_code=sa4_code)
+        if output is None:
+            logging.error(f"{name} failed for SA4 {sa4_code}")
+        else:
+            outputs.append(output.assign(Check=name))
+    outputs = [output for output in outputs if not output.empty]
+    return pd.concat(outputs, ignore_index=True) if outputs else None
+
+
+def build_batch_tasks(parameters, sa4_codes, selected=None, partition_level=None):
+    """
+    The purpose of this function is to replace the SA4-scoped checks of a normal run with one
+    task per SA4 of the batch
+
+    input: dictionary of parameters, list of SA4 codes, list of check keys (default: every check),
+           optional level the national ERP checks are partitioned by (see partitioned.py)
+    output: list of CheckTask
+    """
+    from data_session import ROLLUP_SUMS
+    from scheduler import CheckTask
+
+    tasks = build_tasks(dict(parameters, sa4_code=None), selected, partition_level)
+    sa4_tasks = [task for task in tasks if task.name in SA4_CHECKS]
+    checks = [(task.name, task.func) for task in sa4_tasks]
+    batch_tasks = [task for task in tasks if task.name not in SA4_CHECKS]
+    for sa4_code in sa4_codes if checks else []:
+        # the rollup of every region is computed once in this process and split by SA4, a worker
+        # is only sent the mismatches of its SA4
+        batch_tasks.append(CheckTask(f"SA4 {sa4_code} checks", run_sa4_checks, [(ROLLUP_SUMS, (int(sa4_code),))],
+                                     kind='cpu', sa4_code=sa4_code, checks=checks))
+    return batch_tasks
+
+
+def run_batch(parameters, sa4_codes, output='final_output.csv', workers=None, selected=None, metrics=None,
+              partition_level=None):
+    """
+    The purpose of this function is to run the checks for a list of SA4 codes and write one
+    combined output
+
+    input: dictionary of parameters, list of SA4 codes or 'all', path of the csv file, number of
+           worker processes (default: one per CPU), list of check keys (default: every check),
+           optional RunMetrics recording every query and check, optional partition level of the
+           national ERP checks
+    output: merged DataFrame of every flagged region
+    """
+    from checks import execute_sql_query
+    from data_session import DataSession
+    from region_scope import RegionScope
+    from scheduler import run_checks
+
+    conn = connect_to_database()
+    # a batch over some SA4s only reads the rows of those SA4s
+    session = DataSession(conn, execute_sql_query, None if sa4_codes == 'all' else RegionScope(sa4_codes), metrics)
+    try:
+        if sa4_codes == 'all':
+            sa4_codes = list_sa4_codes(session)
+        logging.info(f"Batch run for {len(sa4_codes)} SA4 regions")
+        tasks = build_batch_tasks(parameters, sa4_codes, selected, partition_level)
+        results = run_checks(tasks, session, max_connections=conn.pool_size, max_processes=workers)
+    finally:
+        conn.close()
+    return write_output(results, output)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Run the forecast checks for many SA4 regions without the parameter window")
+    parser.add_argument('--sa4', nargs='+', required=True, help="SA4 codes to check, or 'all'")
+    parser.add_argument('--params', default='parameters.txt', help="parameter file (default: parameters.txt)")
+    parser.add_argument('--output', default='final_output.csv', help="combined csv output (default: final_output.csv)")
+    parser.add_argument('--checks', nargs='+', default=None,
+                        help="checks to run (default: every check): " + ", ".join(CHECKS))
+    parser.add_argument('--metrics-dir', default="metrics",
+                        help="directory of the JSON-lines metrics file of the run (default: metrics)")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument('--partition-level', choices=PARTITION_LEVELS, default=None,
+                        help="run the spike, shape, pattern and ML checks one partition of this level at a time")
+    for name in DEFAULT_PARAMETERS:
+        if name != 'sa4_code':
+            parser.add_argument(f"--{name.replace('_', '-')}", dest=name, type=str if name == 'vintage' else float,
+                                default=None,
+                                help=f"overrides {name} of the parameter file")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    logging.basicConfig(filename='app.log', filemode='w', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    start_time = time.time()
+
+    parameters = read_parameters(args.params)
+    for name in DEFAULT_PARAMETERS:
+        if getattr(args, name, None) is not None:
+            parameters[name] = getattr(args, name)
+    parameters.pop('sa4_code')
+    if [code.lower() for code in args.sa4] == ['all']:
+        sa4_codes = 'all'
+    else:
+        sa4_codes = [parse_parameter('sa4_code', code) for code in args.sa4]
+
+    metrics = RunMetrics(args.metrics_dir)
+    merged_df = run_batch(parameters, sa4_codes, args.output, args.workers, args.checks, metrics, args.partition_level)
+    running_time = time.time() - start_time
+    print(f'The number of unique abnormal region are: {len(merged_df["Code"].unique())}')
+    print(f"Running time: {running_time:.6f} seconds")
+    metrics.record('run', 'batch', wall_s=round(running_time, 4), rows=len(merged_df))
+    metrics.report()
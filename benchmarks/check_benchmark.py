@@ -0,0 +1,160 @@
+"""
+This file contains the check benchmark suite.
+For every size (number of SA4s) a synthetic forecasts database is generated once (see
+synthetic_data.py) and cached in benchmarks/data. Every query is timed when it is first fetched
+and every check is then timed on the warm data session, so query and compute time are reported
+separately. Times are compared against the stored baselines, and the flags of every check are
+compared against the anomalies injected into the data.
+
+usage: python benchmarks/check_benchmark.py
+       python benchmarks/check_benchmark.py --sizes 1 8 32 --repeat 5
+       python benchmarks/check_benchmark.py --save-baselines
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.chdir(REPO_DIR)
+
+from checks import execute_sql_query  # noqa: E402
+from data_session import DataSession  # noqa: E402
+from db_backend import SQLiteBackend  # noqa: E402
+from metrics import RunMetrics, measure_check  # noqa: E402
+from parameters import DEFAULT_PARAMETERS  # noqa: E402
+from registry import CHECKS, build_tasks  # noqa: E402
+from synthetic_data import generate_database, read_anomalies  # noqa: E402
+
+
+DATA_DIR = os.path.join(REPO_DIR, "benchmarks", "data")
+BASELINE_FILE = os.path.join(REPO_DIR, "benchmarks", "baselines.json")
+DEFAULT_SIZES = [1, 4, 16]
+
+# every region is checked, the parameter file SA4 would limit the sum checks to one SA4
+PARAMETERS = dict(DEFAULT_PARAMETERS, sa4_code=None)
+
+
+def synthetic_database(n_sa4, seed=0):
+    """
+    output: path of the synthetic database with n_sa4 SA4s, generated if it is not cached yet
+    """
+    path = os.path.join(DATA_DIR, f"synthetic_{n_sa4}sa4_seed{seed}.db")
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        start_time = time.perf_counter()
+        generate_database(path + ".tmp", n_sa4, seed=seed)
+        os.replace(path + ".tmp", path)
+        print(f"Generated {path} in {time.perf_counter() - start_time:.1f} seconds")
+    return path
+
+
+def score_flags(outputs, anomalies):
+    """
+    The purpose of this function is to compare the flags of every check with the injected anomalies.
+    Only a flag on an injected region (of any check) is expected, regions are matched by exact code.
+
+    input: dictionary of check key -> check output, DataFrame of injected anomalies
+    output: DataFrame (Check | Injected | Found | Missed | Unexpected)
+    """
+    explained = set(anomalies['Code'].astype('int64'))
+    rows = []
+    for key, output in outputs.items():
+        expected = set(anomalies.loc[anomalies['Check'] == key, 'Code'].astype('int64'))
+        flagged = set() if output is None else set(pd.to_numeric(output['Code'], errors='coerce').dropna().astype('int64'))
+        rows.append({'Check': key, 'Injected': len(expected), 'Found': len(expected & flagged),
+                     'Missed': sorted(expected - flagged), 'Unexpected': len(flagged - explained)})
+    return pd.DataFrame(rows)
+
+
+def benchmark_size(n_sa4, repeat=3, seed=0):
+    """
+    The purpose of this function is to time every query and check on one synthetic database
+
+    input: number of SA4s, number of timed runs of each check (the fastest is kept), random seed
+    output: DataFrame of timings (Size | Stage | Name | Seconds | Rows), DataFrame of flag scores
+    """
+    path = synthetic_database(n_sa4, seed)
+    backend = SQLiteBackend(path)
+    metrics = RunMetrics(None)
+    session = DataSession(backend, execute_sql_query, metrics=metrics)
+    # the index of the synthetic database is not saved over the one of the repository
+    session.index_dir = None
+    timings = []
+    outputs = {}
+    try:
+        for key in CHECKS:
+            task = build_tasks(PARAMETERS, [key])[0]
+            for dataset in task.datasets:
+                sql_file, params = dataset if isinstance(dataset, tuple) else (dataset, ())
+                session.fetch(sql_file, params)
+            # the ML check is timed fitting its model, not loading a saved one
+            kwargs = dict(task.kwargs, model_dir=None) if key == 'ml' else task.kwargs
+            runs = [measure_check(task.func, session, **kwargs) for _ in range(repeat)]
+            outputs[key] = runs[0][0]
+            timings.append({'Stage': 'check', 'Name': key, 'Seconds': min(run[1]['wall_s'] for run in runs),
+                            'Rows': runs[0][1]['rows']})
+    finally:
+        backend.close()
+    for record in metrics.records:
+        timings.append({'Stage': 'query', 'Name': record['name'], 'Seconds': record['wall_s'], 'Rows': record['rows']})
+    timing_df = pd.DataFrame(timings).assign(Size=n_sa4)
+    return timing_df[['Size', 'Stage', 'Name', 'Seconds', 'Rows']], score_flags(outputs, read_anomalies(path))
+
+
+def compare_baselines(timing_df, baselines, tolerance):
+    """
+    The purpose of this function is to add the baseline of every timing and flag regressions
+
+    input: DataFrame of timings, dictionary of "size/stage/name" -> seconds, allowed slowdown factor
+    output: DataFrame of timings with Baseline, Ratio and Regression columns
+    """
+    keys = timing_df['Size'].astype(str) + "/" + timing_df['Stage'] + "/" + timing_df['Name']
+    compared = timing_df.assign(Baseline=keys.map(baselines))
+    compared['Ratio'] = (compared['Seconds'] / compared['Baseline']).round(2)
+    # very short timings are mostly noise, only flag regressions of at least 10ms
+    compared['Regression'] = (compared['Ratio'] > tolerance) & (compared['Seconds'] - compared['Baseline'] > 0.01)
+    return compared
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time every check on synthetic data and compare with the baselines")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="numbers of SA4s to benchmark")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs of each check, the fastest is kept")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=1.5, help="slowdown factor reported as a regression")
+    parser.add_argument('--save-baselines', action='store_true', help="store these timings as the new baselines")
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r') as file:
+            baselines = json.load(file)
+
+    timing_frames, failures = [], 0
+    for n_sa4 in args.sizes:
+        timing_df, score_df = benchmark_size(n_sa4, args.repeat, args.seed)
+        timing_frames.append(timing_df)
+        print(f"\nFlags on {n_sa4} SA4s:")
+        print(score_df.to_string(index=False))
+        failures += int((score_df['Found'] < score_df['Injected']).sum())
+
+    result = compare_baselines(pd.concat(timing_frames, ignore_index=True), baselines, args.tolerance)
+    print("\nTimings:")
+    print(result.to_string(index=False, na_rep='-'))
+    failures += int(result['Regression'].sum())
+
+    if args.save_baselines:
+        # the baselines of the sizes run are replaced, so checks and queries that no longer exist are dropped
+        sizes = {str(n_sa4) for n_sa4 in args.sizes}
+        baselines = {key: seconds for key, seconds in baselines.items() if key.split('/')[0] not in sizes}
+        for row in result.itertuples(index=False):
+            baselines[f"{row.Size}/{row.Stage}/{row.Name}"] = row.Seconds
+        with open(BASELINE_FILE, 'w') as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print(f"Baselines saved to {BASELINE_FILE}")
+    sys.exit(1 if failures and not args.save_baselines else 0)
@@ -0,0 +1,87 @@
+"""
+This file contains the startup benchmark.
+Each scenario is run in a fresh interpreter with `python -X importtime`, which reports the import
+cost of every module; the benchmark prints the total startup time of each scenario with its most
+expensive modules and can append the per-module cost to a csv file to compare runs over time.
+
+usage: python benchmarks/import_time.py
+       python benchmarks/import_time.py --top 15 --output benchmarks/import_time.csv
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# scenario -> code run at startup
+SCENARIOS = {
+    'births only': "from registry import build_tasks; from parameters import DEFAULT_PARAMETERS; "
+                   "build_tasks(DEFAULT_PARAMETERS, ['births'])",
+    'sum checks': "from registry import build_tasks; from parameters import DEFAULT_PARAMETERS; "
+                  "build_tasks(DEFAULT_PARAMETERS, ['births', 'deaths', 'households', 'population'])",
+    'every check': "from registry import build_tasks; from parameters import DEFAULT_PARAMETERS; "
+                   "build_tasks(DEFAULT_PARAMETERS)",
+    'batch mode': "import batch",
+}
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def parse_importtime(stderr):
+    """
+    The purpose of this function is to read the output of python -X importtime
+
+    input: stderr of the interpreter
+    output: DataFrame (Module | Self (ms) | Cumulative (ms) | Depth), one row per imported module
+    """
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append({'Module': module, 'Self (ms)': int(self_us) / 1000,
+                         'Cumulative (ms)': int(cumulative_us) / 1000, 'Depth': len(indent) // 2})
+    return pd.DataFrame(rows, columns=['Module', 'Self (ms)', 'Cumulative (ms)', 'Depth'])
+
+
+def run_scenario(code):
+    """
+    The purpose of this function is to time one startup scenario in a fresh interpreter
+
+    input: python code of the scenario
+    output: wall time in seconds, DataFrame of the import cost of every module
+    """
+    start_time = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=REPO_DIR,
+                             capture_output=True, text=True)
+    wall_time = time.perf_counter() - start_time
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    return wall_time, parse_importtime(process.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure the startup and import cost of the checks")
+    parser.add_argument('--top', type=int, default=10, help="number of modules listed per scenario")
+    parser.add_argument('--output', default=None, help="csv file the per-module cost is appended to")
+    args = parser.parse_args()
+
+    records = []
+    for scenario, code in SCENARIOS.items():
+        wall_time, modules = run_scenario(code)
+        top_level = modules[modules['Depth'] == 0]
+        print(f"\n{scenario}: {wall_time:.3f} s wall, {top_level['Cumulative (ms)'].sum():.0f} ms importing "
+              f"{len(modules)} modules")
+        print(top_level.nlargest(args.top, 'Cumulative (ms)')[['Module', 'Self (ms)', 'Cumulative (ms)']]
+              .to_string(index=False))
+        records.append(modules.assign(Scenario=scenario, **{'Wall (s)': wall_time}))
+
+    if args.output:
+        result = pd.concat(records, ignore_index=True).assign(Date=time.strftime('%Y-%m-%d %H:%M:%S'))
+        result.to_csv(args.output, mode='a', header=not os.path.exists(args.output), index=False)
@@ -1,448 +1,686 @@
 """
 This file contains checks in the form of one function each that calls one SQL script
 """
-# from matplotlib import pyplot as plt
-import seaborn as sns
 import pandas as pd
-import os
 import logging
-import re
 import numpy as np
-import platform
-from sklearn.ensemble import IsolationForest
+import time
 import warnings
+from data_session import DataSession, QUERY_SCHEMAS, apply_filter, read_sql_file
+from forecast_matrix import build_matrix
+from hierarchy import load_hierarchy
+from ratios import RATIO_CHECKS, describe, evaluate_ratios, metrics_of
+from db_backend import DatabaseBackend, read_query
+from metrics import add_query_time
 
 # Ignore SettingWithCopyWarning
 warnings.simplefilter(action='ignore', category=pd.errors.SettingWithCopyWarning)
 
 
-def execute_sql_query(conn, sql_query, params=()):
+def execute_sql_query(conn, sql_query, params=(), schema=None):
+    """
+    The purpose of this function is to run a query and return the result as a DataFrame.
+    Its time is added to the query time of the thread (see metrics.py).
+
+    input: DatabaseBackend (or a plain DB-API connection), SQL text with '?' placeholders, query parameters,
+           optional dictionary of column -> dtype applied while the rows are streamed in
+    output: DataFrame with the query result, None if the query failed
+    """
+    start_time = time.perf_counter()
     try:
-        current_system = platform.system()
-        if current_system == "Darwin":
-            # execute queries
-            cursor = conn.cursor()
-            cursor.execute(sql_query)
-            data = cursor.fetchall()
-            df = pd.DataFrame(data)
-        elif current_system == "Windows":
-            df = pd.read_sql_query(con=conn, sql= sql_query, params=params)
-        logging.info("sql execute done")
+        if isinstance(conn, DatabaseBackend):
+            df = conn.read_query(sql_query, params, schema=schema)
+        else:
+            df = read_query(conn, sql_query, params, schema=schema)
+        logging.info(f"sql execute done: {len(df)} rows, {df.memory_usage(deep=True).sum() / 1024 ** 2:.1f} MB")
         return df
     except Exception as e:
         logging.error(e)
+    finally:
+        add_query_time(time.perf_counter() - start_time)
+
+def fetch_dataset(conn, sql_file, params=(), where=None):
+    """
+    The purpose of this function is to get the result of an SQL script from the SQL_Queries folder.
+    When conn is a DataSession the result is shared with every other check in the run,
+    otherwise the query is executed directly on the connection.
+
+    input: connection or DataSession, file name of the SQL script, query parameters,
+           optional SQL condition replacing the filter marker of the file
+    output: DataFrame with the query result
+    """
+    if isinstance(conn, DataSession):
+        return conn.fetch(sql_file, params, where=where)
+    return execute_sql_query(conn=conn, sql_query=apply_filter(read_sql_file(sql_file), where), params=params,
+                             schema=QUERY_SCHEMAS.get(sql_file))
+
+def hierarchy_index(conn):
+    """
+    The purpose of this function is to get the ASGS hierarchy index (see hierarchy.py).
+    When conn is a DataSession the index is shared with every other check in the run,
+    otherwise the saved index is loaded (or built) with the connection.
+
+    input: connection or DataSession
+    output: HierarchyIndex
+    """
+    if isinstance(conn, DataSession):
+        index = conn.hierarchy_index()
+        if index is None:
+            raise RuntimeError("The hierarchy index could not be built")
+        return index
+    return load_hierarchy(lambda sql_file: fetch_dataset(conn, sql_file))
+
+def forecast_matrix(conn, metric, sa4_code=None):
+    """
+    The purpose of this function is to get the region x year forecast matrix of a metric (see
+    forecast_matrix.py). When conn is a DataSession the matrix is built once and shared with every
+    other check in the run, otherwise it is built from a query on the connection.
+
+    input: connection or DataSession, metric ('ERP', 'Births', 'Deaths' or 'Households'),
+           optional SA4 code to only read the regions of that SA4
+    output: ForecastMatrix
+    """
+    if sa4_code is not None and not isinstance(conn, DataSession):
+        conn = DataSession(conn, execute_sql_query)
+    if isinstance(conn, DataSession):
+        matrix = conn.forecast_matrix(metric, sa4_code=sa4_code)
+        if matrix is None:
+            raise RuntimeError(f"The {metric} forecast matrix could not be built")
+        return matrix
+    return build_matrix(lambda sql_file: fetch_dataset(conn, sql_file), metric)
+
+def ratio_flags(conn, ratios, bounds=None, sa4_code=None, codes=None, magnitude='Peak'):
+    """
+    The purpose of this function is to run the ratio engine (see ratios.py) on the forecast
+    matrices of the metrics the ratios read and describe the flags as check output
 
-def household_check(conn, ratio_upper, ratio_lower, sa4_code:int):
+    input: connection or DataSession, list of ratio keys, optional dictionary of ratio key ->
+           (upper, lower) bounds, SA4 code (None for every SA4), optional list of region codes,
+           column of the ratio engine used as Magnitude ('Peak' or 'Excess')
+    output: DataFrame of [Code, Region Type, Description, Year, Magnitude, Detail (ratio key)]
+    """
+    matrices = {metric: forecast_matrix(conn, metric, sa4_code) for metric in metrics_of(ratios)}
+    index = hierarchy_index(conn)
+    flags = evaluate_ratios(matrices, ratios, bounds, codes, index, sa4_code)
+    output = pd.DataFrame({'Code': flags['Code'], 'Region Type': index.region_types(flags['Code'])})
+    output['Description'] = describe(flags)
+    output['Year'] = flags['Year']
+    output['Magnitude'] = flags[magnitude]
+    output['Detail'] = flags['Ratio']
+    return output
+
+def household_check(conn, ratio_upper, ratio_lower, sa4_code:int=None, codes=None):
     """
     The purpose of this function is to identify abnormal spikes/drops in population forecasts
     in a timeseries format by checking the ratio of population to household count.
-    input: connection
-    output: list of lists containing [ASGSCode, Region Type, Description (earliest year an outlier appears)]
+    The ratio is the household_size ratio of ratios.py, computed from the ERP and Households matrices.
+    input: connection, ratio bounds, SA4 code (None for every SA4), optional list of region codes to limit the check to
+    output: DataFrame of [Code, Region Type, Description (earliest abnormal year, number of abnormal years, peak ratio),
+            Year (earliest abnormal year), Magnitude (peak ratio)]
     """
     try:
-        # Read the SQL query from the file
-        ratio_sql = open(os.path.abspath("SQL_Queries/household_size.sql"), 'r').read()
-        # Execute the SQL query and get the merged dataframe
-        merged_df = execute_sql_query(conn=conn, sql_query=ratio_sql)
-        logging.info("Data returned")
-        outliers_df = merged_df[(merged_df['ratio'] >= ratio_upper) | (merged_df['ratio'] <= ratio_lower)]
+        output = ratio_flags(conn, ['household_size'], {'household_size': (float(ratio_upper), float(ratio_lower))},
+                             sa4_code, codes).drop(columns='Detail')
         logging.info("Outlier dataframe found")
-        earliest_outliers_df = outliers_df.groupby('ASGSCode').apply(
-            lambda x: x.loc[x['Year'].idxmin()]
-        ).reset_index(drop=True)
-        logging.info("earliest_year")
-        output = earliest_outliers_df[['ASGSCode', 'region_type']].copy()
-        output['Description'] = "Found abnormal ERP/household ratio, Earliest abnormal year is: " + earliest_outliers_df['Year'].astype(str)
-        output = output.rename(columns={'region_type': 'Region Type', 'ASGSCode': 'Code'})
         return output
     except Exception as e:
         logging.error(f"Error occurred: {e}")
         return None
 
-def births_region_level_sum_check(conn, sa4_code:int):
+def ratio_check(conn, sa4_code:int=None, codes=None, ratios=RATIO_CHECKS, bounds=None):
+    """
+    The purpose of this function is to check the ratios between forecast metrics other than the
+    household size (crude birth and death rates, household growth against population growth) in one pass.
+    input: connection, SA4 code (None for every SA4), optional list of region codes to limit the check to,
+           ratio keys, optional dictionary of ratio key -> (upper, lower) replacing the default bounds
+    output: DataFrame of [Code, Region Type, Description (ratio, earliest abnormal year, number of abnormal
+            years, peak ratio), Year (earliest abnormal year), Magnitude (peak ratio as a multiple of the
+            bound it crosses, comparable between ratios), Detail (ratio key)], one row per ratio and
+            abnormal region
     """
-    The purpose of this function is to call an SQL script which sums the births of all FAs in a particular SA2 and checks
-    if this value matches the total births of the SA2
+    try:
+        output = ratio_flags(conn, ratios, bounds, sa4_code, codes, magnitude='Excess')
+        logging.info(f"Ratio check found {len(output)} abnormal ratios")
+        return output
+    except Exception as e:
+        logging.error(f"Error in ratio check: {e}")
+        return None
+
+# (child region type, parent region type) pairs checked by the region level sum checks
+ROLLUP_LEVELS = [('FA', 'SA2'), ('SA2', 'SA3'), ('SA3', 'SA4')]
+
+def rollup_sum_check(conn, sa4_code=None, tolerance=1, codes=None):
+    """
+    The purpose of this function is to check, for Births, Deaths, Households and Population at once,
+    that the total of every parent region matches the sum of its children at every level
+    (FA -> SA2, SA2 -> SA3 and SA3 -> SA4). Per-code totals are fetched once and children are
+    aggregated into their parents with the AreasAsgs.Parent mapping.
+    Parents without any children with data are not compared.
+
+    input: connection, optional SA4 code to limit the check to, tolerance on the absolute difference,
+           optional list of parent region codes to limit the check to
+    output: DataFrame of mismatches (Metric | Code | Region Type | Child Type | Total | Children Total | Difference)
+    """
+    totals = fetch_dataset(conn, "Region_totals.sql")
+    hierarchy = fetch_dataset(conn, "Area_hierarchy.sql")
+    logging.info("Region totals and hierarchy returned")
+
+    # a code can be listed once per ASGS edition, count each child once per parent
+    links = hierarchy[['ASGSCode', 'Parent']].drop_duplicates()
+    index = hierarchy_index(conn)
+
+    if codes is not None:
+        links = links[links['Parent'].isin(codes)]
+    children = totals.merge(links, on='ASGSCode')
+    children['Child Type'] = index.region_types(children['ASGSCode'])
+    children['Region Type'] = index.region_types(children['Parent'])
+    levels = pd.MultiIndex.from_frame(children[['Child Type', 'Region Type']])
+    children = children[levels.isin(ROLLUP_LEVELS)]
+
+    children_total = children.groupby(['DataType', 'Parent', 'Child Type', 'Region Type'], as_index=False, observed=True)['Total'].sum()
+    children_total = children_total.rename(columns={'Parent': 'ASGSCode', 'Total': 'Children Total'})
+    compared = children_total.merge(totals, on=['DataType', 'ASGSCode'])
+    compared['Difference'] = compared['Total'] - compared['Children Total']
+
+    mismatches = compared[compared['Difference'].abs() > tolerance]
+    if sa4_code is not None:
+        mismatches = mismatches[index.within(mismatches['ASGSCode'], [int(float(sa4_code))])]
+    mismatches = mismatches.rename(columns={'DataType': 'Metric', 'ASGSCode': 'Code'})
+    return mismatches[['Metric', 'Code', 'Region Type', 'Child Type', 'Total', 'Children Total', 'Difference']] \
+        .sort_values(['Metric', 'Code']).reset_index(drop=True)
+
+def rollup_mismatches(conn, sa4_code=None):
+    """
+    The purpose of this function is to get the rollup mismatches of every metric. When conn is a
+    DataSession the rollup is computed once per run and shared by the four region level sum
+    checks, otherwise it is computed from queries on the connection.
 
-    Input: Connection
-    Output: Table which contains information of SA2s that failed the check (Code | Region Type | Description)
+    input: connection or DataSession, optional SA4 code
+    output: DataFrame of mismatches (see rollup_sum_check)
+    """
+    if isinstance(conn, DataSession):
+        mismatches = conn.rollup_sums(sa4_code)
+        if mismatches is None:
+            raise RuntimeError("The rollup sum check could not be computed")
+        return mismatches
+    return rollup_sum_check(conn, sa4_code=sa4_code)
+
+def region_level_sum_check(conn, metric, sa4_code=None, codes=None):
+    """
+    The purpose of this function is to turn the rollup mismatches of one metric into the
+    standard check output.
+
+    input: connection, metric (Births, Deaths, Households or Population), optional SA4 code,
+           optional list of region codes to limit the check to
+    output: Table which contains information of regions that failed the check
+            (Code | Region Type | Description | Magnitude), the magnitude is the difference
+    """
+    mismatches = rollup_mismatches(conn, sa4_code)
+    mismatches = mismatches[mismatches['Metric'] == metric]
+    if codes is not None:
+        mismatches = mismatches[mismatches['Code'].isin(codes)]
+    output = mismatches[['Code', 'Region Type']].copy()
+    output['Description'] = (
+        f"Mismatch between sum of {metric} at " + mismatches['Region Type'].astype(str) + " level vs. sum of "
+        + mismatches['Child Type'].astype(str) + "s within this " + mismatches['Region Type'].astype(str)
+        + ", difference is " + mismatches['Difference'].round(2).astype(str)
+    )
+    output['Magnitude'] = mismatches['Difference']
+    return output.reset_index(drop=True)
+
+def births_region_level_sum_check(conn, sa4_code:int=None, codes=None):
+    """
+    The purpose of this function is to check that the births of every SA2, SA3 and SA4 match
+    the sum of the births of the regions within it
+
+    Input: Connection, optional SA4 code, optional list of region codes to limit the check to
+    Output: Table which contains information of regions that failed the check (Code | Region Type | Description)
     """
     try:
-        sql = open(os.path.abspath("SQL_Queries/Births Sum Check for FA vs SA2 Output.sql"), 'r').read()
-        logging.info("Births region level sum check query opened")
-        df = execute_sql_query(sql_query=sql, conn=conn, params=(sa4_code,))
-        logging.info("Births region level sum check query executed")
+        df = region_level_sum_check(conn, 'Births', sa4_code, codes)
+        logging.info("Births region level sum check executed")
         return df
     except Exception as e:
         logging.error(e)
 
-def deaths_region_level_sum_check(conn):
+def deaths_region_level_sum_check(conn, sa4_code:int=None, codes=None):
     """
-    The purpose of this function is to call an SQL script which sums the deaths of all FAs in a particular SA2 and checks
-    if this value matches the total births of the SA2
+    The purpose of this function is to check that the deaths of every SA2, SA3 and SA4 match
+    the sum of the deaths of the regions within it
 
-    Input: Connection
-    Output: Table which contains information of SA2s that failed the check (Code | Region Type | Description)
+    Input: Connection, optional SA4 code, optional list of region codes to limit the check to
+    Output: Table which contains information of regions that failed the check (Code | Region Type | Description)
     """
     try:
-        sql = open(os.path.abspath("SQL_Queries/Deaths Sum Check for FA vs SA2 Output.sql"), 'r').read()
-        logging.info("Deaths region level sum check query opened")
-        df = execute_sql_query(sql_query=sql, conn=conn)
-        logging.info("Deaths region level sum check query executed")
+        df = region_level_sum_check(conn, 'Deaths', sa4_code, codes)
+        logging.info("Deaths region level sum check executed")
         return df
     except Exception as e:
         logging.error(e)
 
-def household_region_level_sum_check(conn):
+def household_region_level_sum_check(conn, sa4_code:int=None, codes=None):
     """
-    The purpose of this function is to call an SQL script which sums the households of all FAs in a particular SA2 and checks
-    if this value matches the total births of the SA2
+    The purpose of this function is to check that the households of every SA2, SA3 and SA4 match
+    the sum of the households of the regions within it
 
-    Input: Connection
-    Output: Table which contains information of SA2s that failed the check (Code | Region Type | Description)
+    Input: Connection, optional SA4 code, optional list of region codes to limit the check to
+    Output: Table which contains information of regions that failed the check (Code | Region Type | Description)
     """
     try:
-        sql = open(os.path.abspath("SQL_Queries/Household Sum Check for FA vs SA2 Output.sql"), 'r').read()
-        logging.info("Household region level sum check query opened")
-        df = execute_sql_query(sql_query=sql, conn=conn)
-        logging.info("Household region level sum check query executed")
+        df = region_level_sum_check(conn, 'Households', sa4_code, codes)
+        logging.info("Household region level sum check executed")
         return df
     except Exception as e:
         logging.error(e)
 
-def population_region_level_sum_check(conn):
+def population_region_level_sum_check(conn, sa4_code:int=None, codes=None):
     """
-    The purpose of this function is to call an SQL script which sums the population of all FAs in a particular SA2 and checks
-    if this value matches the total births of the SA2
+    The purpose of this function is to check that the population of every SA2, SA3 and SA4 match
+    the sum of the population of the regions within it
 
-    Input: Connection
-    Output: Table which contains information of SA2s that failed the check (Code | Region Type | Description)
+    Input: Connection, optional SA4 code, optional list of region codes to limit the check to
+    Output: Table which contains information of regions that failed the check (Code | Region Type | Description)
     """
     try:
-        sql = open(os.path.abspath("SQL_Queries/Population Sum Check for FA vs SA2 Output.sql"), 'r').read()
-        logging.info("Population region level sum check query opened")
-        df = execute_sql_query(sql_query=sql, conn=conn)
-        logging.info("Population region level sum check query executed")
+        df = region_level_sum_check(conn, 'Population', sa4_code, codes)
+        logging.info("Population region level sum check executed")
         return df
     except Exception as e:
         logging.error(e)
 
-def spike_check(conn, sensitivity, multiplier):
+def granular_sum_check(conn, metric, tolerance=1, codes=None):
+    """
+    The purpose of this function is to drill the FA vs SA2 sum check of one metric down to
+    sex, age and year. The query builds a sparse (SA2, sex, age, year) cube in which the FA cells
+    are rolled up into their SA2 with one grouped join, and returns only the cells that differ by
+    more than the tolerance (see SQL_Queries/Granular_<metric>.sql).
+
+    input: connection, metric (Births, Deaths, Households or Population), tolerance on the
+           absolute difference, optional list of SA2 codes to limit the check to
+    output: DataFrame of mismatched cells (Metric | SA2 | SexKey | AgeKey | Year | SA2 Total | FA Total | Difference)
+    """
+    cells = fetch_dataset(conn, f"Granular_{metric}.sql", (float(tolerance),))
+    if codes is not None:
+        cells = cells[cells['SA2'].isin(codes)]
+    output = pd.DataFrame({'Metric': metric, 'SA2': cells['SA2'], 'SexKey': cells['SexKey'], 'AgeKey': cells['AgeKey'],
+                           'Year': cells['Year'], 'SA2 Total': cells['SA2Total'], 'FA Total': cells['FATotal'],
+                           'Difference': cells['SA2Total'] - cells['FATotal']})
+    return output.sort_values(['SA2', 'SexKey', 'AgeKey', 'Year']).reset_index(drop=True)
+
+def erp_wide(conn, codes=None, years=None):
+    """
+    The purpose of this function is to get the ERP of every FA and SA2 as a year x region table
+
+    input: connection, optional list of region codes to limit to, optional list of every year of
+           the run (so a partition of the regions gets the year rows of a full run, see partitioned.py)
+    output: year x region DataFrame of ERP
+    """
+    return forecast_matrix(conn, 'ERP').frame(codes, years)
+
+def erp_growth_rates(conn, codes=None, years=None):
+    """
+    The purpose of this function is to get the year on year ERP growth rate of every FA and SA2
+
+    input: connection, optional list of region codes to limit to, optional list of every year of the run
+    output: year x region DataFrame of growth rates (from the second year)
+    """
+    wide_df = erp_wide(conn, codes, years)
+    logging.info("Query data returned")
+
+    # creating a percentage change df for ERP
+    rate_of_change = wide_df.pct_change()
+    return rate_of_change.iloc[1:]
+
+def spike_outliers(values, q1, q3, sensitivity, multiplier):
+    """
+    output: boolean year x region array, True for the growth rates more than multiplier*IQR
+            outside the quartiles of their region and larger than the sensitivity
+    """
+    iqr = q3 - q1
+    lower_bound = q1 - multiplier * iqr
+    upper_bound = q3 + multiplier * iqr
+    return (np.abs(values) > sensitivity) & ((values > upper_bound) | (values < lower_bound))
+
+def detect_spikes(rate_of_change, sensitivity, multiplier):
+    """
+    The purpose of this function is to find outliers in the growth rate of every region at once.
+    The rule of outlier is if the growth of population is more than multiplier*IQR away from
+    Q1 and Q3 + if the absolute growth rate is more than the sensitivity (ignoring small changes).
+    Quartiles are computed column-wise, so a region with a missing year gets NaN bounds and is
+    never flagged, the same as a per-region np.percentile call.
+
+    input: year x region DataFrame of growth rates, sensitivity, IQR multiplier
+    output: DataFrame indexed by region with columns flagged, worst_growth (the growth rate
+            with the largest absolute value) and worst_year (the year it occurred)
+    """
+    values = rate_of_change.to_numpy(dtype='float64')
+    if len(values) == 0:
+        # no growth rates (e.g. a region scope without any region), nothing can be flagged
+        return pd.DataFrame({'flagged': False, 'worst_growth': np.nan, 'worst_year': None}, index=rate_of_change.columns)
+    q1, q3 = np.percentile(values, [25, 75], axis=0)
+    outliers = spike_outliers(values, q1, q3, sensitivity, multiplier)
+
+    # worst growth per region, missing years are ignored
+    abs_values = np.where(np.isnan(values), -1.0, np.abs(values))
+    worst_row = abs_values.argmax(axis=0)
+    has_data = abs_values.max(axis=0) >= 0
+    worst_growth = np.where(has_data, values[worst_row, np.arange(values.shape[1])], np.nan)
+    worst_year = np.full(values.shape[1], None, dtype=object)
+    worst_year[has_data] = rate_of_change.index.to_numpy()[worst_row[has_data]]
+
+    return pd.DataFrame({
+        'flagged': outliers.any(axis=0),
+        'worst_growth': worst_growth,
+        'worst_year': worst_year,
+    }, index=rate_of_change.columns)
+
+def spike_check(conn, sensitivity, multiplier, codes=None, years=None):
     """
     The purpose of this function is to identify abnormal spike/drop of population forecast
     in a timeseries format.
 
-    input: connection
-    output: list of list which contains [region code, region type, description]
+    input: connection, optional list of region codes to limit the check to, optional list of every
+           year of the run (see erp_wide)
+    output: DataFrame of [Code, Region Type, Description, Year, Magnitude], the year and growth
+            rate of the worst change
     """
     try:
-        # getting queries
-        ERP_query= open(os.path.abspath("SQL_Queries/ERP_table(FA&SA2).sql"),'r').read()
-        area_type_query = open(os.path.abspath("SQL_Queries/Area_type.sql"),'r').read()
-        logging.info("Query file opened")
-        df = execute_sql_query(conn=conn, sql_query=ERP_query)
-        wide_df = df.pivot_table(index='ERPYear', columns='ASGS_2016', values='ERP')
-        area_type = execute_sql_query(conn=conn, sql_query=area_type_query)
-        area_dict = area_type.set_index('ASGSCode').to_dict()['RegionType']
-        logging.info("Query data returned")
-
-        def check_outliers(data_list):
-            """
-            This function determine if there are outliers from the input data list.
-            the rule of outlier is if the growth of population is more 5*IQR away from
-            Q1 and Q3 + if the growth rate is more than 0.005 or less than 0.005 (ignoring
-            small changes)
-
-            input: list of digit
-            output: True if there are outliers and False if there are not outliers 
-            """
-            Q1 = np.percentile(data_list, 25)
-            Q3 = np.percentile(data_list, 75)
-            IQR = Q3 - Q1
-            lower_bound = Q1 - multiplier * IQR
-            upper_bound = Q3 + multiplier * IQR
-            for data in data_list:
-                if abs(data) > sensitivity:
-                    if data > upper_bound or data < lower_bound: return True
-            return False
-        # creating a percentage change df for ERP
-        rate_of_change = wide_df.pct_change()
-        rate_of_change = rate_of_change.drop(rate_of_change.index[0])
-
-        output_list = []
-
-        # perform checks and output result
-        for region in wide_df.columns:
-            if check_outliers(rate_of_change[region][1:]):
-                output_list.append([region, area_dict[region], "Suddent spike or drop detected"])
-        output_df = pd.DataFrame(output_list, columns=['Code', 'Region Type', 'Description'])
+        rate_of_change = erp_growth_rates(conn, codes, years)
+
+        # perform checks on every region at once and output result
+        spikes = detect_spikes(rate_of_change.iloc[1:], sensitivity, multiplier)
+        flagged = spikes[spikes['flagged']]
+        region_types = hierarchy_index(conn).region_types(flagged.index)
+        output_list = [
+            [region, region_type,
+             f"Suddent spike or drop detected, worst growth rate {growth:.4f} in {year}", year, growth]
+            for region, region_type, growth, year in zip(flagged.index, region_types, flagged['worst_growth'],
+                                                         flagged['worst_year'])
+        ]
+        output_df = pd.DataFrame(output_list, columns=['Code', 'Region Type', 'Description', 'Year', 'Magnitude'])
         return output_df
     except Exception as e:
         logging.error(e)
 
-def trend_shape_check(conn, sensitivity):
+def classify_trend_shapes(rate_of_change, sensitivity):
+    """
+    The purpose of this function is to find abnormal shapes of trend for every region at once.
+    Growth rates are encoded into a signed int8 matrix: 1 if the growth is above the sensitivity,
+    -1 if it is below minus the sensitivity and 0 otherwise (the old "+", "-" and "0").
+
+    Rules (checked in this order, the first one found is reported):
+    +0- or -0+ ==> small bell curve
+    +0(more than 1)- or -0(more than 1)+ ==> bell curve
+    +-+ or -+- ==> wave/cycle
+    +- ==> straight change of sign of growth of population
+
+    input: year x region DataFrame of growth rates, sensitivity
+    output: DataFrame indexed by region with columns pattern (description of the abnormal shape,
+            None if no abnormal shape) and start_year (year where the first such pattern starts)
+    """
+    values = rate_of_change.to_numpy(dtype='float64')
+    signs = (values > sensitivity).astype(np.int8) - (values < -sensitivity).astype(np.int8)
+    n_years, n_regions = signs.shape
+    rows = np.arange(n_years)[:, None]
+
+    # position of the previous non-zero change for every cell, -1 if there is none
+    nonzero = signs != 0
+    last_nonzero = np.maximum.accumulate(np.where(nonzero, rows, -1), axis=0)
+    prev_nonzero = np.full_like(last_nonzero, -1)
+    prev_nonzero[1:] = last_nonzero[:-1]
+    prev_sign = np.take_along_axis(signs, np.maximum(prev_nonzero, 0), axis=0)
+
+    # a sign change ends at this cell, gap is the number of zeros in between
+    sign_change = nonzero & (prev_nonzero >= 0) & (prev_sign != signs)
+    gap = rows - prev_nonzero - 1
+    straight_change = sign_change & (gap == 0)
+    wave = np.zeros_like(straight_change)
+    wave[1:] = straight_change[1:] & straight_change[:-1]
+
+    # (mask of pattern end cells, offset from end to start, message) in order of priority
+    patterns = [
+        (sign_change & (gap == 1), None, "small bell curve detect"),
+        (sign_change & (gap >= 1), None, "Bell curve detect"),
+        (wave, 2, "wave detect"),
+        (straight_change, None, "straight change of sign detect"),
+    ]
+
+    message = np.full(n_regions, None, dtype=object)
+    start_row = np.full(n_regions, -1)
+    for mask, offset, text in patterns:
+        found = mask.any(axis=0) & (start_row < 0)
+        if not found.any():
+            continue
+        first_end = mask.argmax(axis=0)
+        if offset is None:
+            start = prev_nonzero[first_end, np.arange(n_regions)]
+        else:
+            start = first_end - offset
+        message[found] = text
+        start_row[found] = start[found]
+
+    start_year = np.full(n_regions, None, dtype=object)
+    start_year[start_row >= 0] = rate_of_change.index.to_numpy()[start_row[start_row >= 0]]
+    return pd.DataFrame({'pattern': message, 'start_year': start_year}, index=rate_of_change.columns)
+
+def trend_shape_check(conn, sensitivity, codes=None, years=None):
     """
     The purpose of this function is to identify abnormal shape of population forecast
     in a timeseries format.
 
-    input: connection
-    output: list of list which contains [region code, region type, description]
+    input: connection, optional list of region codes to limit the check to, optional list of every
+           year of the run (see erp_wide)
+    output: DataFrame of [Code, Region Type, Description, Year, Detail], the year the abnormal
+            shape starts and the shape
+    """
+    try:
+        rate_of_change = erp_growth_rates(conn, codes, years)
+
+        # perform checks on every region at once and output result
+        shapes = classify_trend_shapes(rate_of_change, sensitivity)
+        abnormal = shapes[shapes['pattern'].notna()]
+        region_types = hierarchy_index(conn).region_types(abnormal.index)
+        output_list = [
+            [region, region_type, f"{message}, starting in {year}", year, message]
+            for region, region_type, message, year in zip(abnormal.index, region_types, abnormal['pattern'],
+                                                          abnormal['start_year'])
+        ]
+        output_pd = pd.DataFrame(output_list, columns=['Code', 'Region Type', 'Description', 'Year', 'Detail'])
+        return output_pd
+    except Exception as e:
+        logging.error(e)
+
+
+def rolling_variance(values, window):
+    """
+    The purpose of this function is to compute the rolling sample variance (ddof=1) down the
+    columns of a matrix with cumulative sums. A window containing a missing value gives NaN,
+    the same as pandas rolling(window).var().
+
+    input: year x region array, window length
+    output: array of the same shape, NaN for the first window - 1 rows
+    """
+    if len(values) < window:
+        return np.full(values.shape, np.nan)
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    zeros = np.zeros((1, values.shape[1]))
+    sums = np.vstack([zeros, np.cumsum(filled, axis=0)])
+    squares = np.vstack([zeros, np.cumsum(filled ** 2, axis=0)])
+    counts = np.vstack([zeros, np.cumsum(valid, axis=0)])
+    window_sum = sums[window:] - sums[:-window]
+    window_squares = squares[window:] - squares[:-window]
+    full = (counts[window:] - counts[:-window]) == window
+    variance = (window_squares - window_sum ** 2 / window) / (window - 1)
+    # the sums of a constant window cancel to rounding noise, which is a variance of 0
+    variance[variance < 1e-10] = 0.0
+    variance[~full] = np.nan
+    return np.vstack([np.full((window - 1, values.shape[1]), np.nan), variance])
+
+def detect_irregular_patterns(wide_df, deviation_threshold=0.1, ratio_threshold=70, short_window=5, long_window=15):
+    """
+    The purpose of this function is to run the two tests of the legacy pattern check on every
+    region at once. Each ERP series is standardized (ddof=0), then:
+    1. neighbour deviation: the largest absolute difference between a year and the average of
+       the years before and after it is above deviation_threshold
+    2. variance ratio: on regions with a defined long run / short run rolling variance ratio,
+       the largest ratio is above ratio_threshold or the series changes direction
+       (its year on year differences are not all of the same sign)
+    Missing years are ignored.
+
+    input: year x region DataFrame of ERP, thresholds and rolling windows of the tests
+    output: DataFrame indexed by region with columns deviation (largest neighbour deviation),
+            deviation_year, variance_ratio (largest ratio), deviation_flag, ratio_flag, direction_flag
+    """
+    values = wide_df.to_numpy(dtype='float64')
+    with warnings.catch_warnings(), np.errstate(divide='ignore', invalid='ignore'):
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        standard = (values - np.nanmean(values, axis=0)) / np.nanstd(values, axis=0)
+        standard[~np.isfinite(standard)] = np.nan
+
+        # test 1: distance of every inner year from the average of its neighbours, -1 where undefined
+        deviation = np.abs(standard[1:-1] - (standard[:-2] + standard[2:]) / 2)
+        deviation = np.where(np.isnan(deviation), -1.0, deviation)
+        if len(deviation) == 0:
+            deviation = np.full((1, values.shape[1]), -1.0)
+        worst = deviation.argmax(axis=0)
+        max_deviation = deviation.max(axis=0)
+        has_deviation = max_deviation >= 0
+
+        # test 2: long run over short run variance, and the direction of the year on year changes
+        ratio = rolling_variance(standard, long_window) / rolling_variance(standard, short_window)
+        has_ratio = (np.nan_to_num(ratio, nan=0.0) != 0).any(axis=0)
+        max_ratio = np.where(np.isnan(ratio), -np.inf, ratio).max(axis=0, initial=-np.inf)
+        change = np.diff(standard, axis=0)
+        rising = (change > 0).any(axis=0)
+        falling = (change < 0).any(axis=0)
+
+    deviation_year = np.full(values.shape[1], None, dtype=object)
+    deviation_year[has_deviation] = wide_df.index.to_numpy()[1:-1][worst[has_deviation]]
+    return pd.DataFrame({
+        'deviation': np.where(has_deviation, max_deviation, np.nan),
+        'deviation_year': deviation_year,
+        'variance_ratio': np.where(has_ratio, max_ratio, np.nan),
+        'deviation_flag': has_deviation & (max_deviation > deviation_threshold),
+        'ratio_flag': has_ratio & (max_ratio > ratio_threshold),
+        'direction_flag': has_ratio & rising & falling,
+    }, index=wide_df.columns)
+
+def pattern_check(conn, codes=None, deviation_threshold=0.1, ratio_threshold=70, years=None):
+    """
+    The purpose of this function is to identify irregular ERP series with the neighbour deviation
+    and the variance ratio tests of the legacy pattern check (see detect_irregular_patterns)
+
+    input: connection, optional list of region codes to limit the check to, thresholds of the tests,
+           optional list of every year of the run (see erp_wide)
+    output: DataFrame of [Code, Region Type, Description, Detail (the tests the region failed)]
     """
     try:
-        # getting queries
-        ERP_query= open(os.path.abspath("SQL_Queries/ERP_table(FA&SA2).sql"),'r').read()
-        area_type_query = open(os.path.abspath("SQL_Queries/Area_type.sql"),'r').read()
-        logging.info("Query file opened")
-
-        # execute queries
-        # cursor = conn.cursor()
-        # cursor.execute(ERP_query)
-        # data = cursor.fetchall()
-        # df = pd.DataFrame(data)
-        df = execute_sql_query(conn=conn, sql_query=ERP_query)
-        wide_df = df.pivot_table(index='ERPYear', columns='ASGS_2016', values='ERP')
-        # cursor.execute(area_type_query)
-        # area_type = cursor.fetchall()
-        # area_type = pd.DataFrame(area_type)
-        area_type = execute_sql_query(conn=conn, sql_query=area_type_query)
-        area_dict = area_type.set_index('ASGSCode').to_dict()['RegionType']
+        wide_df = erp_wide(conn, codes, years)
         logging.info("Query data returned")
 
-        # creating a percentage change df for ERP
-        rate_of_change = wide_df.pct_change()
-        rate_of_change = rate_of_change.drop(rate_of_change.index[0])
-
-        def encode_change(data_list):
-            """
-            This function is used to convert the timeseries data into a string containing
-            "+", "-" and "0". 
-            for example, if the data_list is [1,0,-1], it will be convered to "+0-"
-            if data is > 0.005, it will be convert to "+", if data is < -0.005, it will
-            be convert to "-", if it is inbetween it will be convered to "0"
-            """
-            output_string = ""
-            for data in data_list:
-                if data > sensitivity: output_string += "+"
-                elif data < -1*sensitivity: output_string += "-"
-                else: output_string += "0"
-            return output_string
-
-        def find_abnormal_shape_encode(encode_string):
-            """
-            This function is used to find abnormal shape of trend through the encode string.
-            For example, if the encode string contains +0- or -0+, it might indicate a small
-            bell curve:
-
-            Rules:
-            +0- or -o+ ==> small bell curve
-            +0(more than 1)- or -0(more than 1)+ ==> bell curve
-            +-+ or -+- ==> wave/cycle
-            +- ==> straight change of sign of growth of population
-            """
-
-            if re.search(r'\+0-', encode_string) or re.search(r'-0\+', encode_string):
-                return True, "small bell curve detect"
-            elif re.search(r'\+0+-', encode_string) or re.search(r'-0+\+', encode_string):
-                return True, "Bell curve detect"
-            elif re.search(r'\+-\+', encode_string) or re.search(r'-\+-', encode_string):
-                return True, "wave detect"
-            elif re.search(r'\+-', encode_string) or re.search(r'-\+', encode_string):
-                return True, "straight change of sign detect"
-            else: return False, "no message"
-
-        output_list = []
-
-        # perform checks and output result
-        for region in wide_df.columns:
-            encoded_string = encode_change(rate_of_change[region].values)
-            is_abnormal, message = find_abnormal_shape_encode(encode_string = encoded_string)
-            if is_abnormal:
-                # if message == "small bell curve detect" : des = message 
-                # elif message == "Bell curve detect": des = message 
-                # elif message == "wave detect": des = message 
-                # else: des = message
-                output_list.append([region, area_dict[region], message])
-        output_pd = pd.DataFrame(output_list, columns=['Code', 'Region Type', 'Description'])
-        return output_pd
+        # perform checks on every region at once and output result
+        patterns = detect_irregular_patterns(wide_df, deviation_threshold, ratio_threshold)
+        flagged = patterns[patterns[['deviation_flag', 'ratio_flag', 'direction_flag']].any(axis=1)]
+        # (flag column, text in the description, name of the test) of every test
+        tests = [
+            ('deviation_flag', "neighbour deviation " + flagged['deviation'].round(3).astype(str)
+             + " in " + flagged['deviation_year'].astype(str), "neighbour deviation"),
+            ('ratio_flag', "variance ratio " + flagged['variance_ratio'].round(1).astype(str), "variance ratio"),
+            ('direction_flag', pd.Series("change of trend direction", index=flagged.index), "trend direction"),
+        ]
+        description = pd.Series("", index=flagged.index)
+        detail = pd.Series("", index=flagged.index)
+        for flag, text, name in tests:
+            separator = np.where(description == "", "", ", ")
+            description = description.where(~flagged[flag], description + separator + text)
+            detail = detail.where(~flagged[flag], detail + separator + name)
+        return pd.DataFrame({'Code': flagged.index, 'Region Type': hierarchy_index(conn).region_types(flagged.index),
+                             'Description': ("Irregular pattern detected, " + description).to_numpy(),
+                             'Detail': detail.to_numpy()})
     except Exception as e:
         logging.error(e)
 
 
+def run_rules(conn, check, codes=None, pushdown=False):
+    """
+    The purpose of this function is to run the rules of a check (see rules.py), one pass over
+    the data of each table
+
+    input: connection, key of the check, optional list of region codes to limit the check to,
+           True to fetch only the rows failing a rule when every rule of the table can be pushed down
+    output: DataFrame of [Code, Region Type, Description, Detail]
+    """
+    from rules import evaluate_rules, pushdown_filter, rules_for
+
+    outputs = []
+    for table, rules in rules_for(check).items():
+        pushed = pushdown_filter(rules) if pushdown else None
+        if pushed is None:
+            df = fetch_dataset(conn, table)
+        else:
+            df = fetch_dataset(conn, table, tuple(pushed[1]), where=pushed[0])
+        if codes is not None:
+            df = df[df['ASGSCode'].isin(codes)]
+        if 'Parent' in df.columns:
+            # parent names come from the hierarchy index rather than a self-join in the query
+            parents, unique_parents = pd.factorize(df['Parent'])
+            names = pd.Categorical(hierarchy_index(conn).names_of(unique_parents))
+            df = df.assign(ParentName=names.take(parents, allow_fill=True))
+        outputs.append(evaluate_rules(df, rules))
+    return pd.concat(outputs, ignore_index=True) if len(outputs) > 1 else outputs[0]
+
+
 # Negative Check Function
-def perform_negative_check(conn):
+def perform_negative_check(conn, codes=None, pushdown=False):
     '''
-    This function checks for negative values in the Births, Deaths, and ERP tables.
-    Returns a DataFrame with columns: Code, Region Type, Description.
+    This function checks for negative values (below -10) in the Births, Deaths, and ERP tables,
+    with the rules of rules.py. If codes is given only those regions are checked.
+    Returns a DataFrame with columns: Code, Region Type, Description, Detail (the table with negative values).
     '''
     try:
         logging.info("Performing negative checks...")
-        
-        # Fetch query from the SQL file
-        with open('SQL_Queries/Negative_Sanity_ML_Check.sql', 'r') as file:
-            query = file.read()
-        
-        # Fetch data from the database
-        df = execute_sql_query(sql_query=query, conn=conn)
-
-        result_list = []
-
-        for region_type in ['FA', 'SA2']:
-            # Filter the dataframe for the current region type
-            region_df = df[df['RegionType'] == region_type]
-            
-            # Check for negative values
-            negative_births = region_df[(region_df['DataType'] == 'Births') & (region_df['Total'] < -10)]
-            if not negative_births.empty:
-                for code in negative_births['ASGSCode'].unique():
-                    result_list.append({'Code': code, 'Region Type': region_type, 'Description': 'Negative Births Values Found'})
-
-            negative_deaths = region_df[(region_df['DataType'] == 'Deaths') & (region_df['Total'] < -10)]
-            if not negative_deaths.empty:
-                for code in negative_deaths['ASGSCode'].unique():
-                    result_list.append({'Code': code, 'Region Type': region_type, 'Description': 'Negative Deaths Values Found'})
-
-            negative_erp = region_df[(region_df['DataType'] == 'ERP') & (region_df['Total'] < -10)]
-            if not negative_erp.empty:
-                for code in negative_erp['ASGSCode'].unique():
-                    result_list.append({'Code': code, 'Region Type': region_type, 'Description': 'Negative ERP Values Found'})
-
-        return pd.DataFrame(result_list, columns=['Code', 'Region Type', 'Description'])
+        return run_rules(conn, 'negative', codes, pushdown)
     except Exception as e:
         logging.error(f"Error performing negative checks: {e}")
-        return pd.DataFrame(columns=['Code', 'Region Type', 'Description'])  # Return DataFrame with correct columns on error
+        return pd.DataFrame(columns=['Code', 'Region Type', 'Description', 'Detail'])  # Return DataFrame with correct columns on error
 
 
 def perform_sanity_check(conn):
     '''
-    This function performs checks for zero values, missing values, and duplicate values in Births, Deaths, ERP.
-    Returns a DataFrame with columns: Code, Region Type, Description.
+    This function checks for missing values and duplicate records in Births, Deaths, ERP, with the rules of rules.py.
+    Returns a DataFrame with columns: Code, Region Type, Description, Detail (missing values or duplicate records).
     '''
     try:
         logging.info("Performing sanity checks...")
-
-        # Fetch query from the SQL file
-        with open('SQL_Queries/Negative_Sanity_ML_Check.sql', 'r') as file:
-            query = file.read()
-
-        # Fetch data from the database
-        df = execute_sql_query(sql_query=query, conn=conn)
-
-        result_list = []
-
-        for region_type in ['FA', 'SA2']:
-            region_df = df[df['RegionType'] == region_type]
-            
-            # # Check for zero values
-            # zero_births = region_df[(region_df['DataType'] == 'Births') & (region_df['Total'] == 0)]
-            # if not zero_births.empty:
-            #     for code in zero_births['ASGSCode'].unique():
-            #         result_list.append({'Code': code, 'Region Type': region_type, 'Description': 'Zero Births Values Found'})
-
-            # zero_deaths = region_df[(region_df['DataType'] == 'Deaths') & (region_df['Total'] == 0)]
-            # if not zero_deaths.empty:
-            #     for code in zero_deaths['ASGSCode'].unique():
-            #         result_list.append({'Code': code, 'Region Type': region_type, 'Description': 'Zero Deaths Values Found'})
-
-            # zero_population = region_df[(region_df['DataType'] == 'ERP') & (region_df['Total'] == 0)]
-            # if not zero_population.empty:
-            #     for code in zero_population['ASGSCode'].unique():
-            #         result_list.append({'Code': code, 'Region Type': region_type, 'Description': 'Zero Population Values Found'})
-
-            # Check for missing values
-            missing_values = region_df.isnull().sum()
-            if missing_values.any():
-                result_list.append({'Code': 'All', 'Region Type': region_type, 'Description': 'Missing Values Detected'})
-
-            # Check for duplicate records
-            duplicates = region_df[region_df.duplicated()]
-            if not duplicates.empty:
-                for code in duplicates['ASGSCode'].unique():
-                    result_list.append({'Code': code, 'Region Type': region_type, 'Description': 'Duplicate Records Found'})
-
-        return pd.DataFrame(result_list, columns=['Code', 'Region Type', 'Description'])
+        return run_rules(conn, 'sanity')
     except Exception as e:
         logging.error(f"Error performing sanity checks: {e}")
-        return pd.DataFrame(columns=['Code', 'Region Type', 'Description'])  # Return DataFrame with correct columns on error
+        return pd.DataFrame(columns=['Code', 'Region Type', 'Description', 'Detail'])  # Return DataFrame with correct columns on error
 
 
 
 # Machine Learning Anomaly Detection Function
-def perform_ml_anomaly_detection(conn, contamination_):
+def perform_ml_anomaly_detection(conn, contamination_, vintage=None, model_dir="models", n_jobs=-1):
+    """
+    The purpose of this function is to flag FAs and SA2s whose ERP series looks unlike the
+    others of their region type, using an IsolationForest on per-region features (see anomaly_model.py).
+    input: connection, share of regions expected to be anomalous, forecast vintage the model is
+           saved under (default: a hash of the data), model directory (None to never save), parallel jobs
+    output: DataFrame of [Code, Region Type, Description, Magnitude (anomaly score, lower is more anomalous)]
+    """
     try:
         logging.info("Performing machine learning anomaly detection...")
-        query = open(os.path.abspath('SQL_Queries/ERP_ML.sql'), 'r').read()
-        df = execute_sql_query(sql_query=query, conn=conn)
-        result_list = []
-
-        # def outlier_plot(data, outlier_method_name, x_var, y_var,region_type):
-        #     # print(f'Outlier Method: {outlier_method_name}')
-           
-        #     # print(f'Number of anomalous values: {len(data[data["anomaly"] == -1])}')
-        #     # print(f'Number of non-anomalous values: {len(data[data["anomaly"] == 1])}')
-        #     # print(f'Total Number of values: {len(data)}')
-
-        #     # Create FacetGrid
-        #     g = sns.FacetGrid(data, col='anomaly', height=4, hue='anomaly', hue_order=[1, -1], palette={1: 'green', -1: 'red'})
-        #     g.map(sns.scatterplot, x_var, y_var, s = 20, legend='full')
-        #     g.fig.suptitle(f'{outlier_method_name} - {region_type}', y=1.10, fontweight='bold')
-            
-        #     # Set limits for x and y axes 
-        #     g.set(xlim=(data[x_var].min(), data[x_var].max()), ylim=(0, data[y_var].max() + 1000))
-
-        #     # Customize subplot titles
-        #     axes = g.axes.flatten()
-        #     axes[0].set_title(f'Outliers in {region_type}\n{len(data[data["anomaly"] == -1])} points')
-        #     axes[1].set_title(f'Inliers in {region_type}\n{len(data[data["anomaly"] == 1])} points')
-
-        #     for ax in axes:
-        #         ax.set_xticks(data[x_var].unique())
-        #         ax.set_xticklabels(data[x_var].unique(), rotation=45, ha='right')
-        #    # Add legend 
-        #     for ax in g.axes.flat:
-        #         handles, labels = ax.get_legend_handles_labels()
-        #         ax.legend(handles, [f'{label} ({region_type})' for label in labels], title='Anomaly Status')
-
-        #     plt.tight_layout()
-        #     plt.show()
-
-        #     return g
-
-        for region_type in ['FA', 'SA2']:
-            region_df = df[df['RegionType'] == region_type]
-            
-            # Ensure ASGSCode is present
-            if 'ASGSCode' not in region_df.columns:
-                logging.error("Column 'ASGSCode' is missing from the DataFrame")
-                return pd.DataFrame(columns=['Code', 'Region Type', 'Description'])
-
-            # Prepare input features
-            anomaly_inputs = ['ERPYear', 'Total']
-            
-            # Initialize and fit the Isolation Forest model
-            model_IF = IsolationForest(contamination=contamination_, random_state=42)
-            region_df['anomaly_scores'] = model_IF.fit_predict(region_df[anomaly_inputs])
-            region_df['anomaly'] = model_IF.predict(region_df[anomaly_inputs])
-            # Manually set negative values as outliers
-            region_df.loc[region_df['Total'] < 0, 'anomaly'] = -1
-            
-            # Plot results
-            #outlier_plot(region_df, "Isolation Forest", "ERPYear", "Total", region_type)
-            # Append results to the result list
-            for index, row in region_df.iterrows():
-                if row['anomaly'] == -1:
-                    result_list.append({'Code': row['ASGSCode'], 'Region Type': region_type, 'Description': 'Machine Learning Anomaly Detected'})
-        
-        # Convert result_list to DataFrame
-        result_df = pd.DataFrame(result_list, columns=['Code', 'Region Type', 'Description'])
-        # Drop duplicate rows based on the 'Code' column, keeping the first occurrence
-        result_df = result_df.drop_duplicates(subset='Code')
-
-        # Reset index if needed
-        result_df = result_df.reset_index(drop=True)
-        
-        
-        return result_df
-      
+        # sklearn takes a second to import, only load it when the ML check is selected
+        from anomaly_model import detect_anomalies
+        df = fetch_dataset(conn, "ERP_ML.sql")
+        hierarchy = fetch_dataset(conn, "Area_hierarchy.sql")
+
+        flagged = detect_anomalies(df, hierarchy, contamination_, vintage=vintage, model_dir=model_dir, n_jobs=n_jobs)
+        result_df = pd.DataFrame({'Code': flagged['ASGSCode'], 'Region Type': flagged['RegionType'],
+                                  'Description': 'Machine Learning Anomaly Detected', 'Magnitude': flagged['Score']})
+        return result_df.drop_duplicates(subset='Code').reset_index(drop=True)
+
     except Exception as e:
         logging.error(f"Error performing machine learning anomaly detection: {e}")
         return pd.DataFrame(columns=['Code', 'Region Type', 'Description'])
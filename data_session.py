@@ -0,0 +1,309 @@
+"""
+This file contains the run-scoped data session which makes sure every SQL file is fetched
+from the database once per run and then shared by all checks that ask for it
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+from forecast_matrix import build_matrix
+from hierarchy import INDEX_DIR, load_hierarchy
+from metrics import add_query_time, frame_memory_mb, query_time
+from region_scope import RegionScope
+
+
+QUERY_DIR = "SQL_Queries"
+
+# where a query takes an extra filter (e.g. the SQL of the rules pushed down by rules.py), a no-op
+# when the file is run as is; the parameters of the filter follow those of the file
+FILTER_MARKER = re.compile(r'/\*\s*filter\s*\*/\s*1\s*=\s*1')
+
+# dataset name of the ASGS hierarchy index (see hierarchy.py), built or loaded once per session
+HIERARCHY_INDEX = "hierarchy index"
+
+# dataset name of the forecast matrices (see forecast_matrix.py), listed as (FORECAST_MATRIX, (metric,)),
+# or (FORECAST_MATRIX, (metric, SA4 code)) for a matrix of the regions of one SA4
+FORECAST_MATRIX = "forecast matrix"
+
+# dataset name of the rollup mismatches of the region level sum checks (see checks.rollup_sum_check),
+# computed once per session and listed as ROLLUP_SUMS for every region or (ROLLUP_SUMS, (SA4 code,))
+# for the regions of one SA4
+ROLLUP_SUMS = "rollup sums"
+
+# dtypes applied while each query result is streamed in, keeping the large results compact
+# (ERP counts are whole numbers well below 2**24 so float32 holds them exactly)
+QUERY_SCHEMAS = {
+    "Area_type.sql": {'ASGSCode': 'int64', 'RegionType': 'category'},
+    "Area_hierarchy.sql": {'ASGSCode': 'int64', 'RegionType': 'category', 'Parent': 'Int64'},
+    "Area_index.sql": {'ASGSCode': 'Int64', 'ASGS': 'Int64', 'RegionType': 'object', 'Parent': 'Int64'},
+    "Region_totals.sql": {'ASGSCode': 'int64', 'DataType': 'category', 'Total': 'float64'},
+    "ERP_table(FA&SA2).sql": {'ASGS_2016': 'int64', 'ERP': 'float32', 'ERPYear': 'int16'},
+    **{f"{metric}_series.sql": {'ASGSCode': 'int64', 'Year': 'int16', 'Total': 'float32'}
+       for metric in ['Births', 'Deaths', 'Households']},
+    "ERP_years.sql": {'ERPYear': 'int16', 'ASGS': 'Int64'},
+    "ERP_ML.sql": {'ASGSCode': 'int64', 'ERPYear': 'int16', 'RegionType': 'category', 'Total': 'float32'},
+    "Region_fingerprints.sql": {'ASGSCode': 'int64', 'SourceTable': 'category', 'RowCount': 'int64',
+                                'Total': 'float64', 'WeightedTotal': 'float64'},
+    **{f"Granular_{metric}.sql": {'SA2': 'int64', 'SexKey': 'int16', 'AgeKey': 'int16', 'Year': 'int16',
+                                   'SA2Total': 'float64', 'FATotal': 'float64'}
+       for metric in ['Births', 'Deaths', 'Households', 'Population']},
+    "Negative_Sanity_ML_Check.sql": {'ASGSCode': 'int64', 'Sex': 'category', 'Year': 'int16',
+                                     'RegionType': 'category', 'Parent': 'Int64', 'Total': 'float32', 'DataType': 'category'},
+}
+
+
+def read_sql_file(sql_file):
+    """
+    The purpose of this function is to read an SQL script from the SQL_Queries folder
+
+    input: file name of the SQL script (e.g. "Area_type.sql")
+    output: the text of the SQL script
+    """
+    with open(os.path.abspath(os.path.join(QUERY_DIR, sql_file)), 'r') as file:
+        return file.read()
+
+
+def apply_filter(sql_query, where=None):
+    """
+    output: the SQL query with its filter marker replaced by the condition (unchanged without one)
+    """
+    if where is None:
+        return sql_query
+    if not FILTER_MARKER.search(sql_query):
+        raise ValueError("The query has no /* filter */ 1 = 1 marker")
+    return FILTER_MARKER.sub(lambda match: f"({where})", sql_query)
+
+
+class DataSession:
+    """
+    The purpose of this class is to memoize query results for the duration of one run.
+
+    Results are keyed by (SQL file, hash of the SQL text, params) so editing a query file
+    or passing different parameters never returns stale data. The DataFrames handed out
+    are shared between checks, so checks must treat them as read-only.
+    The session can be used from several threads and can be sent to worker processes, in
+    which case only the cached data travels (the connection stays in the parent process).
+    With a region scope, every query is limited to the regions of the scope, and with run
+    metrics every query is recorded with its time, rows and memory. The ASGS hierarchy index is
+    built once per session (for every region, whatever the scope), and like the forecast matrices
+    (which worker processes map from disk rather than receive as a copy) and the rollup mismatches
+    it is only sent to the worker processes of the checks that list it.
+    """
+
+    def __init__(self, conn, executor, scope=None, metrics=None):
+        """
+        input: database connection and the function used to run a query,
+               called as executor(conn=conn, sql_query=sql, params=params, schema=schema),
+               optional RegionScope applied to every query, optional RunMetrics
+        """
+        self.conn = conn
+        self.executor = executor
+        self.scope = scope
+        self.metrics = metrics
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.hierarchy = None
+        self.index_dir = INDEX_DIR
+        self.matrices = {}
+        self.rollups = {}
+        # query seconds of building the rollup of every region, shared by every check reading a rollup
+        self.rollup_query_s = 0.0
+        self.lock = threading.Lock()
+        self.hierarchy_lock = threading.Lock()
+        self.matrix_lock = threading.Lock()
+        self.rollup_lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['conn'] = None
+        state['metrics'] = None
+        del state['lock']
+        del state['hierarchy_lock']
+        del state['matrix_lock']
+        del state['rollup_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.hierarchy_lock = threading.Lock()
+        self.matrix_lock = threading.Lock()
+        self.rollup_lock = threading.Lock()
+
+    def fetch(self, sql_file, params=(), conn=None, where=None, keep=True):
+        """
+        The purpose of this function is to return the result of an SQL file, running the
+        query only if this file/params combination has not been fetched in this run.
+
+        input: file name of the SQL script, query parameters, optional connection to use
+               instead of the session connection (e.g. one per worker thread), optional SQL
+               condition replacing the filter marker of the file (its parameters go last in params),
+               False to not keep the result in the session (e.g. data only read to build a matrix)
+        output: DataFrame with the query result (the HierarchyIndex for HIERARCHY_INDEX, the
+                ForecastMatrix of the metric in params for FORECAST_MATRIX, the rollup mismatches
+                of the SA4 in params, or of every region, for ROLLUP_SUMS)
+        """
+        if sql_file == HIERARCHY_INDEX:
+            return self.hierarchy_index(conn)
+        if sql_file == FORECAST_MATRIX:
+            return self.forecast_matrix(params[0], conn, *params[1:])
+        if sql_file == ROLLUP_SUMS:
+            return self.rollup_sums(params[0] if params else None)
+        sql = self.scoped_sql(sql_file, where)
+        key = self.key(sql_file, params, sql)
+        with self.lock:
+            if key in self.cache:
+                self.hits += 1
+                logging.info(f"Data session cache hit: {sql_file}")
+                return self.cache[key]
+            self.misses += 1
+        logging.info(f"Data session cache miss: {sql_file}")
+        start_time = time.perf_counter()
+        df = self.executor(conn=conn if conn is not None else self.conn, sql_query=sql, params=params,
+                           schema=QUERY_SCHEMAS.get(sql_file))
+        elapsed = time.perf_counter() - start_time
+        if self.metrics is not None:
+            self.metrics.record('query', sql_file, wall_s=round(elapsed, 4), query_s=round(elapsed, 4),
+                                rows=len(df) if df is not None else None, memory_mb=frame_memory_mb(df),
+                                params=list(params) or None)
+        # failed queries are not cached so a later check can retry them
+        if df is not None and keep:
+            with self.lock:
+                self.cache[key] = df
+        return df
+
+    def hierarchy_index(self, conn=None):
+        """
+        The purpose of this function is to return the ASGS hierarchy index of the session, loading
+        the saved index (or building it when AreasAsgs changed) on first use
+
+        input: optional connection to use instead of the session connection
+        output: HierarchyIndex, None if it could not be built
+        """
+        with self.hierarchy_lock:
+            if self.hierarchy is None:
+                unscoped = DataSession(conn if conn is not None else self.conn, self.executor, metrics=self.metrics)
+                try:
+                    self.hierarchy = load_hierarchy(unscoped.fetch, self.index_dir)
+                except Exception as e:
+                    logging.error(f"Hierarchy index could not be built: {e}")
+            return self.hierarchy
+
+    def matrix_key(self, metric, sa4_code=None):
+        """
+        output: the key of a forecast matrix in the session, the matrix of every region of the
+                session when the session already has a region scope
+        """
+        return metric if sa4_code is None or self.scope is not None else (metric, int(float(sa4_code)))
+
+    def forecast_matrix(self, metric, conn=None, sa4_code=None):
+        """
+        The purpose of this function is to return the forecast matrix of a metric, building it on
+        first use. The rows it is built from are not kept in the session. With an SA4 code only the
+        rows of the regions of the SA4 are read (unless the session has its own region scope).
+
+        input: metric (see forecast_matrix.MATRIX_SOURCES), optional connection to use, optional SA4 code
+        output: ForecastMatrix, None if it could not be built
+        """
+        key = self.matrix_key(metric, sa4_code)
+        with self.matrix_lock:
+            if key not in self.matrices:
+                source = self
+                if isinstance(key, tuple):
+                    source = DataSession(self.conn, self.executor, RegionScope([key[1]]), self.metrics)
+                try:
+                    self.matrices[key] = build_matrix(lambda sql_file: source.fetch(sql_file, conn=conn, keep=False),
+                                                      metric)
+                except Exception as e:
+                    logging.error(f"{metric} forecast matrix could not be built: {e}")
+                    return None
+            return self.matrices[key]
+
+    def rollup_sums(self, sa4_code=None):
+        """
+        The purpose of this function is to return the rollup mismatches of every metric, computed
+        on first use for every region of the session and then split by SA4, so the four region
+        level sum checks and the SA4 jobs of a batch share one rollup
+
+        input: optional SA4 code
+        output: DataFrame of mismatches (see checks.rollup_sum_check), None if it could not be computed
+        """
+        from checks import rollup_sum_check
+
+        key = None if sa4_code is None else int(float(sa4_code))
+        with self.rollup_lock:
+            if key not in self.rollups:
+                try:
+                    if None not in self.rollups:
+                        # its queries are taken off the clock of the thread that happened to build it
+                        start = query_time()
+                        self.rollups[None] = rollup_sum_check(self)
+                        built = query_time() - start
+                        add_query_time(-built)
+                        self.rollup_query_s += built
+                    mismatches = self.rollups[None]
+                    if key is not None:
+                        in_sa4 = self.hierarchy_index().within(mismatches['Code'], [key])
+                        self.rollups[key] = mismatches[in_sa4].reset_index(drop=True)
+                except Exception as e:
+                    logging.error(f"Rollup sum check could not be computed: {e}")
+                    return None
+            return self.rollups[key]
+
+    def scoped_sql(self, sql_file, where=None):
+        """
+        output: the text of an SQL file, with the region scope of the session and the filter applied
+        """
+        sql = apply_filter(read_sql_file(sql_file), where)
+        return self.scope.apply(sql) if self.scope is not None else sql
+
+    def key(self, sql_file, params=(), sql=None):
+        """
+        output: the cache key of an SQL file and its parameters
+        """
+        if sql is None:
+            sql = self.scoped_sql(sql_file)
+        return (sql_file, hashlib.sha1(sql.encode('utf-8')).hexdigest(), tuple(params))
+
+    def subset(self, datasets):
+        """
+        The purpose of this function is to make a session holding only some of the cached data,
+        so a worker process is sent just the datasets its check needs.
+
+        input: list of SQL file names or (SQL file name, params) tuples
+        output: new DataSession without a connection sharing the cached DataFrames
+        """
+        session = DataSession(None, self.executor, self.scope)
+        for dataset in datasets:
+            sql_file, params = dataset if isinstance(dataset, tuple) else (dataset, ())
+            if sql_file == HIERARCHY_INDEX:
+                session.hierarchy = self.hierarchy
+                continue
+            if sql_file == ROLLUP_SUMS:
+                key = int(float(params[0])) if params else None
+                if key in self.rollups:
+                    session.rollups[key] = self.rollups[key]
+                continue
+            if sql_file == FORECAST_MATRIX:
+                key = self.matrix_key(*params)
+                if key in self.matrices:
+                    session.matrices[key] = self.matrices[key]
+                continue
+            key = self.key(sql_file, params)
+            if key in self.cache:
+                session.cache[key] = self.cache[key]
+        return session
+
+    def report(self):
+        """
+        The purpose of this function is to summarise how effective the cache was in this run
+
+        output: dictionary with the number of hits, misses and cached datasets
+        """
+        stats = {'hits': self.hits, 'misses': self.misses, 'datasets': len(self.cache)}
+        logging.info(f"Data session cache stats: {stats}")
+        return stats
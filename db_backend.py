@@ -0,0 +1,303 @@
+"""
+This file contains the database backends used by execute_sql_query.
+A backend owns a pool of connections and knows how to run the T-SQL files in SQL_Queries on its
+driver, so checks can run concurrently (each query borrows its own connection) and the whole
+pipeline can run without SQL Server on a local SQLite copy of the forecasts.dbo schema.
+"""
+import logging
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import zlib
+from contextlib import contextmanager
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+# number of rows fetched from the cursor at a time
+DEFAULT_CHUNKSIZE = 50000
+
+# tables of forecasts.dbo used by the checks, created as-is in the SQLite stand-in
+FORECASTS_SCHEMA = {
+    'AreasAsgs': "ASGSCode INTEGER, ASGS INTEGER, RegionType TEXT, Parent INTEGER, Name TEXT",
+    'Births': "ASGSCode INTEGER, SexKey INTEGER, AgeKey INTEGER, Year INTEGER, Number REAL",
+    'Deaths': "ASGSCode INTEGER, SexKey INTEGER, AgeKey INTEGER, Year INTEGER, Number REAL",
+    'ERP': "ASGS_2016 INTEGER, SexKey INTEGER, AgeKey INTEGER, ERPYear INTEGER, Number REAL",
+    'Households': "ASGSCode INTEGER, HhKey INTEGER, ERPYear INTEGER, Number REAL",
+}
+
+
+def binary_checksum(*values):
+    """
+    The purpose of this function is to stand in for T-SQL BINARY_CHECKSUM on SQLite: a signed 32 bit
+    hash of a list of values, which only has to be the same between runs on the same backend
+    """
+    text = "\x1f".join("\x00" if value is None else str(value) for value in values)
+    checksum = zlib.crc32(text.encode('utf-8'))
+    return checksum - (1 << 32) if checksum >= 1 << 31 else checksum
+
+
+def bind_params(sql_query, params, paramstyle):
+    """
+    The purpose of this function is to make '?' placeholders work on every driver.
+    Queries are written with '?' (qmark), drivers using %s (format/pyformat) get them translated.
+
+    input: SQL text, query parameters, DB-API paramstyle of the driver
+    output: (SQL text, params) ready for cursor.execute
+    """
+    params = tuple(params) if params else ()
+    if not params:
+        return sql_query, None
+    if paramstyle in ('format', 'pyformat'):
+        sql_query = sql_query.replace('%', '%%').replace('?', '%s')
+    return sql_query, params
+
+
+def _batch_frame(rows, columns, schema):
+    """
+    The purpose of this function is to turn one fetchmany batch into a DataFrame with the
+    dtypes of the query schema, so only one batch of Python row objects is alive at a time
+    """
+    if rows and isinstance(rows[0], dict):
+        data = {column: [row[column] for row in rows] for column in columns}
+    elif rows:
+        data = dict(zip(columns, zip(*rows)))
+    else:
+        # object columns, so an empty categorical still gets string categories
+        data = {column: pd.Series([], dtype=object) for column in columns}
+    frame = pd.DataFrame(data, columns=columns)
+    if schema:
+        frame = frame.astype({column: dtype for column, dtype in schema.items() if column in frame.columns})
+    return frame
+
+
+def _concat_batches(frames, columns):
+    """
+    The purpose of this function is to join the batches column by column, merging the categories
+    of categorical columns instead of falling back to object dtype
+    """
+    if len(frames) == 1:
+        return frames[0]
+    data = {}
+    for column in columns:
+        parts = [frame[column] for frame in frames]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            data[column] = pd.Series(union_categoricals([part.array for part in parts]))
+        else:
+            data[column] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(data, columns=columns)
+
+
+def iter_query(conn, sql_query, params=(), paramstyle=None, schema=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    The purpose of this function is to run a query on a DB-API connection and stream the result.
+    Rows are read with fetchmany and converted batch by batch to the dtypes given in schema
+    (e.g. int64 codes, int16 years, float32 numbers, categorical region types).
+    Column names come from the cursor description, so it works whether the driver returns
+    tuples or dictionaries.
+
+    input: DB-API connection, SQL text, query parameters, optional paramstyle of the driver,
+           optional dictionary of column -> dtype, number of rows fetched per batch
+    output: generator of DataFrames, one per batch (a single empty DataFrame if there are no rows)
+    """
+    if paramstyle is None:
+        paramstyle = getattr(sys.modules.get(type(conn).__module__.split('.')[0]), 'paramstyle', 'qmark')
+    sql_query, params = bind_params(sql_query, params, paramstyle)
+    cursor = conn.cursor()
+    try:
+        if params is None:
+            cursor.execute(sql_query)
+        else:
+            cursor.execute(sql_query, params)
+        columns = [column[0] for column in cursor.description]
+        empty = True
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            empty = False
+            yield _batch_frame(rows, columns, schema)
+        if empty:
+            yield _batch_frame([], columns, schema)
+    finally:
+        cursor.close()
+
+
+def read_query(conn, sql_query, params=(), paramstyle=None, schema=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    The purpose of this function is to run a query on a DB-API connection and return a DataFrame.
+    The rows are streamed in with iter_query, which keeps the peak memory close to the size of
+    the final compact DataFrame.
+
+    input: same as iter_query
+    output: DataFrame with the query result
+    """
+    frames = list(iter_query(conn, sql_query, params, paramstyle, schema, chunksize))
+    return _concat_batches(frames, list(frames[0].columns))
+
+
+def strip_schema_names(sql_query):
+    """
+    The purpose of this function is to point forecasts.dbo.X, [forecasts].[dbo].[X] and dbo.X at
+    a single local schema and turn [bracketed] identifiers into standard "quoted" ones
+    """
+    sql_query = re.sub(r'(\[forecasts\]|\bforecasts)\.(\[dbo\]|dbo)\.', '', sql_query, flags=re.IGNORECASE)
+    sql_query = re.sub(r'(\[dbo\]|\bdbo)\.', '', sql_query, flags=re.IGNORECASE)
+    return re.sub(r'\[(\w+)\]', r'"\1"', sql_query)
+
+
+class DatabaseBackend:
+    """
+    The purpose of this class is to give every driver the same interface: a bounded pool of
+    connections, '?' parameter binding and a read_query returning a DataFrame.
+    Subclasses implement connect() and, if their SQL dialect differs from T-SQL, translate().
+    """
+    paramstyle = 'qmark'
+
+    def __init__(self, pool_size=4):
+        self.pool_size = pool_size
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(pool_size)
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def connect(self):
+        """
+        output: a new DB-API connection
+        """
+        raise NotImplementedError
+
+    def translate(self, sql_query):
+        """
+        output: the SQL text rewritten for this backend's dialect
+        """
+        return sql_query
+
+    @contextmanager
+    def connection(self):
+        """
+        The purpose of this function is to borrow a connection from the pool, blocking while
+        pool_size connections are in use, and give it back afterwards
+        """
+        self.slots.acquire()
+        try:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+                with self.lock:
+                    self.connections.append(conn)
+            try:
+                yield conn
+            finally:
+                self.idle.put(conn)
+        finally:
+            self.slots.release()
+
+    def read_query(self, sql_query, params=(), schema=None):
+        """
+        The purpose of this function is to run a query on a pooled connection
+
+        input: SQL text written for SQL Server with '?' placeholders, query parameters,
+               optional dictionary of column -> dtype
+        output: DataFrame with the query result
+        """
+        with self.connection() as conn:
+            return read_query(conn, self.translate(sql_query), params, self.paramstyle, schema)
+
+    def iter_query(self, sql_query, params=(), schema=None, chunksize=DEFAULT_CHUNKSIZE):
+        """
+        The purpose of this function is to stream a query result batch by batch on a pooled
+        connection, for results too large to hold in memory at once
+
+        output: generator of DataFrames, one per batch
+        """
+        with self.connection() as conn:
+            yield from iter_query(conn, self.translate(sql_query), params, self.paramstyle, schema, chunksize)
+
+    def close(self):
+        """
+        The purpose of this function is to close every connection opened by the pool
+        """
+        with self.lock:
+            for conn in self.connections:
+                try:
+                    conn.close()
+                except Exception as e:
+                    logging.error(f"Closing connection failed: {e}")
+            self.connections = []
+        self.idle = queue.LifoQueue()
+
+
+class MSSQLBackend(DatabaseBackend):
+    """
+    The purpose of this class is to connect to the production SQL Server with pymssql
+    (macOS and Linux) or pyodbc (Windows).
+
+    input: driver name ('pymssql' or 'pyodbc'), arguments of the driver's connect function
+    """
+
+    def __init__(self, driver, *connect_args, pool_size=4, **connect_kwargs):
+        super().__init__(pool_size)
+        if driver not in ('pymssql', 'pyodbc'):
+            raise ValueError(f"Unsupported SQL Server driver: {driver}")
+        self.driver = driver
+        self.paramstyle = 'pyformat' if driver == 'pymssql' else 'qmark'
+        self.connect_args = connect_args
+        self.connect_kwargs = connect_kwargs
+
+    def connect(self):
+        if self.driver == 'pymssql':
+            import pymssql
+            return pymssql.connect(*self.connect_args, **self.connect_kwargs)
+        import pyodbc
+        return pyodbc.connect(*self.connect_args, **self.connect_kwargs)
+
+
+class SQLiteBackend(DatabaseBackend):
+    """
+    The purpose of this class is to run the checks on a local SQLite file holding the
+    forecasts.dbo tables, e.g. on Linux build boxes without SQL Server.
+
+    input: path of the SQLite database file
+    """
+
+    def __init__(self, path, pool_size=4):
+        super().__init__(pool_size)
+        self.path = path
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.create_function('LEFT_STR', 2, lambda value, length: None if value is None else str(value)[:length])
+        conn.create_function('BINARY_CHECKSUM', -1, binary_checksum, deterministic=True)
+        return conn
+
+    def translate(self, sql_query):
+        sql_query = strip_schema_names(sql_query)
+        # LEFT(x, n) on codes, SQLite only knows LEFT as part of LEFT JOIN
+        return re.sub(r'\bLEFT\s*\(', 'LEFT_STR(', sql_query, flags=re.IGNORECASE)
+
+    def create_schema(self):
+        """
+        The purpose of this function is to create the forecasts.dbo tables if they do not exist
+        """
+        with self.connection() as conn:
+            for table, columns in FORECASTS_SCHEMA.items():
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+            conn.commit()
+
+    def load_table(self, table, df):
+        """
+        The purpose of this function is to append the rows of a DataFrame to one of the tables
+
+        input: table name, DataFrame with (a subset of) the columns of the table
+        """
+        columns = ", ".join(df.columns)
+        placeholders = ", ".join("?" * len(df.columns))
+        with self.connection() as conn:
+            conn.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})",
+                             df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+            conn.commit()
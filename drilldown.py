@@ -0,0 +1,72 @@
+"""
+This file contains the granular drill-down of the FA vs SA2 sum checks, which lists the
+(SA2, sex, age, year) cells where an SA2 does not match the sum of its FAs, without the parameter
+window.
+
+usage: python drilldown.py
+       python drilldown.py --metrics Births Deaths --scope 401 402 --tolerance 5 --output drilldown.csv
+"""
+import argparse
+import logging
+import time
+
+import pandas as pd
+
+from main import connect_to_database
+
+
+GRANULAR_METRICS = ['Births', 'Deaths', 'Households', 'Population']
+
+
+def run_drilldown(session, metrics=None, tolerance=1, codes=None):
+    """
+    The purpose of this function is to drill every metric down to the mismatched cells
+
+    input: DataSession, list of metrics (default: every metric), tolerance on the absolute
+           difference, optional list of SA2 codes to limit the drill-down to
+    output: DataFrame of mismatched cells of every metric (see checks.granular_sum_check)
+    """
+    from checks import granular_sum_check
+
+    metrics = GRANULAR_METRICS if metrics is None else metrics
+    unknown = [metric for metric in metrics if metric not in GRANULAR_METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)} (known metrics: {', '.join(GRANULAR_METRICS)})")
+    outputs = []
+    for metric in metrics:
+        cells = granular_sum_check(session, metric, tolerance, codes)
+        logging.info(f"{metric} drill-down: {len(cells)} mismatched cells in {cells['SA2'].nunique()} SA2s")
+        outputs.append(cells)
+    return pd.concat(outputs, ignore_index=True)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="List the sex, age and year cells where an SA2 does not match the sum of its FAs")
+    parser.add_argument('--metrics', nargs='+', default=None, help="metrics to drill down (default: " + ", ".join(GRANULAR_METRICS) + ")")
+    parser.add_argument('--scope', nargs='+', default=None, help="only check the regions below these state, SA4, SA3 or SA2 codes")
+    parser.add_argument('--tolerance', type=float, default=1, help="largest absolute difference accepted (default: 1)")
+    parser.add_argument('--output', default='drilldown.csv', help="csv output (default: drilldown.csv)")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    logging.basicConfig(filename='app.log', filemode='w', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    start_time = time.time()
+
+    from checks import execute_sql_query
+    from data_session import DataSession
+    from region_scope import RegionScope
+
+    conn = connect_to_database()
+    session = DataSession(conn, execute_sql_query, RegionScope(args.scope) if args.scope else None)
+    try:
+        cells = run_drilldown(session, args.metrics, args.tolerance)
+    finally:
+        conn.close()
+    cells.to_csv(args.output, index=False)
+    for metric, metric_cells in cells.groupby('Metric', sort=False):
+        print(f"{metric}: {len(metric_cells)} mismatched cells in {metric_cells['SA2'].nunique()} SA2s")
+    print(f"Mismatched cells written to {args.output}")
+    print(f"Running time: {time.time() - start_time:.6f} seconds")
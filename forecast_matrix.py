@@ -0,0 +1,146 @@
+"""
+This file contains the forecast matrix, the region x year table of one metric (ERP, births, deaths
+or households of every FA and SA2) shared by the time series checks of a run.
+The values are one contiguous float32 year x region buffer with a boolean mask of the cells that
+have data, next to the sorted integer codes of the regions and the years. A data session builds
+each matrix once per run. The first time a matrix is sent to a worker process it is written to
+memory-mapped files, and from then on only the path travels: every worker maps the same pages
+instead of receiving a pickled copy.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+
+# metric -> (SQL file, code column, year column, value column), one row per region and year
+MATRIX_SOURCES = {
+    'ERP': ("ERP_table(FA&SA2).sql", 'ASGS_2016', 'ERPYear', 'ERP'),
+    'Births': ("Births_series.sql", 'ASGSCode', 'Year', 'Total'),
+    'Deaths': ("Deaths_series.sql", 'ASGSCode', 'Year', 'Total'),
+    'Households': ("Households_series.sql", 'ASGSCode', 'Year', 'Total'),
+}
+
+ARRAYS = ['values', 'mask', 'codes', 'years']
+
+
+def _remove(directory, pid):
+    # worker processes forked from the writer must not remove its files
+    if os.getpid() == pid:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class ForecastMatrix:
+    """
+    The purpose of this class is to hold the region x year values of one metric.
+
+    metric: name of the metric (see MATRIX_SOURCES)
+    codes: sorted int64 region codes, one per column
+    years: sorted int16 years, one per row
+    values: C-contiguous float32 year x region array, NaN where a region has no data
+    mask: boolean year x region array, True where a region has data
+    """
+
+    def __init__(self, metric, codes, years, values, mask=None):
+        self.metric = metric
+        self.codes = codes
+        self.years = years
+        self.values = values
+        self.mask = ~np.isnan(values) if mask is None else mask
+        self.directory = None
+        self.lookup = pd.Index(codes)
+        # build the hash table of the codes now, checks look codes up from several threads at once
+        self.lookup.get_indexer(codes[:1])
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def from_frame(cls, metric, df, code_column, year_column, value_column):
+        """
+        The purpose of this function is to build the matrix from the rows of a query, without a
+        pandas pivot. Rows without a value are left out, so like pivot_table a region or year
+        without any value gets no column or row.
+
+        input: metric, DataFrame with one row per region and year, names of its code, year and value columns
+        output: ForecastMatrix
+        """
+        df = df[df[value_column].notna()]
+        codes, columns = np.unique(df[code_column].to_numpy(dtype='int64'), return_inverse=True)
+        years, rows = np.unique(df[year_column].to_numpy(dtype='int16'), return_inverse=True)
+        values = np.full((len(years), len(codes)), np.nan, dtype='float32')
+        values[rows, columns] = df[value_column].to_numpy(dtype='float32')
+        return cls(metric, codes, years, values)
+
+    def __getstate__(self):
+        self.publish()
+        return {'metric': self.metric, 'directory': self.directory}
+
+    def __setstate__(self, state):
+        arrays = {name: np.load(os.path.join(state['directory'], f"{name}.npy"), mmap_mode='r') for name in ARRAYS}
+        self.__init__(state['metric'], arrays['codes'], arrays['years'], arrays['values'], arrays['mask'])
+        self.directory = state['directory']
+
+    def publish(self):
+        """
+        The purpose of this function is to write the matrix to memory-mapped files once, so worker
+        processes map it instead of copying it. The files are removed when the matrix of the
+        process that wrote them is released (or when that process exits).
+
+        output: directory of the files
+        """
+        with self.lock:
+            if self.directory is None:
+                directory = tempfile.mkdtemp(prefix=f"forecast_matrix_{self.metric.lower()}_")
+                for name in ARRAYS:
+                    np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+                weakref.finalize(self, _remove, directory, os.getpid())
+                self.directory = directory
+                logging.info(f"Published the {self.metric} forecast matrix to {directory}")
+            return self.directory
+
+    def columns(self, codes):
+        """
+        output: positions of the columns of the codes that are in the matrix, in code order
+        """
+        positions = self.lookup.get_indexer(pd.Index(np.asarray(codes)).unique())
+        return np.sort(positions[positions >= 0])
+
+    def frame(self, codes=None, years=None):
+        """
+        The purpose of this function is to give a float64 year x region DataFrame of the matrix,
+        the table the time series checks work on
+
+        input: optional list of region codes to limit to, optional list of every year of the run
+               (missing years become rows of NaN)
+        output: DataFrame indexed by year with one column per region code
+        """
+        columns = slice(None) if codes is None else self.columns(codes)
+        wide = pd.DataFrame(self.values[:, columns].astype('float64'), index=pd.Index(self.years, name='Year'),
+                            columns=pd.Index(self.codes[columns], name='Code'))
+        return wide if years is None else wide.reindex(years)
+
+
+def build_matrix(fetch, metric):
+    """
+    The purpose of this function is to build the matrix of a metric
+
+    input: function returning the result of an SQL file (e.g. DataSession.fetch), metric
+    output: ForecastMatrix
+    """
+    if metric not in MATRIX_SOURCES:
+        raise ValueError(f"Unknown forecast matrix {metric} (known: {', '.join(MATRIX_SOURCES)})")
+    sql_file, code_column, year_column, value_column = MATRIX_SOURCES[metric]
+    df = fetch(sql_file)
+    if df is None:
+        raise RuntimeError(f"The data of the {metric} forecast matrix could not be fetched")
+    matrix = ForecastMatrix.from_frame(metric, df, code_column, year_column, value_column)
+    logging.info(f"Built the {metric} forecast matrix: {len(matrix.years)} years x {len(matrix)} regions, "
+                 f"{matrix.values.nbytes / 1024 ** 2:.1f} MB")
+    return matrix
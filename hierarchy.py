@@ -0,0 +1,230 @@
+"""
+This file contains the ASGS hierarchy index shared by the checks.
+The regions of AreasAsgs are held in arrays: codes (sorted), the level of every region, a pointer
+to the position of its parent, its children in CSR form (child_ptr / children) and the position of
+its ancestor at every level. Lookups of many codes at once (type, parent, name, ancestor at a
+level) are one hash lookup of the codes followed by array indexing.
+The index is saved to disk with a cheap summary of AreasAsgs and is only rebuilt when the table
+changes, and a data session builds or loads it once per run for every check.
+"""
+import json
+import logging
+import math
+import numbers
+import os
+
+import numpy as np
+import pandas as pd
+
+
+INDEX_DIR = "hierarchy_index"
+INDEX_FILE = "areas_index.npz"
+
+# region types from the top of the hierarchy down, a level is a position in this list
+LEVELS = ['STE', 'SA4', 'SA3', 'SA2', 'FA']
+
+
+class HierarchyIndex:
+    """
+    The purpose of this class is to answer region structure questions with array lookups.
+
+    input: sorted unique codes, level of every region (-1 for other region types), position of
+           the parent of every region (-1 if it has none), names, summary of the source table
+    """
+
+    def __init__(self, codes, levels, parents, names, state=None):
+        self.codes = np.asarray(codes, dtype='int64')
+        self.levels = np.asarray(levels, dtype='int8')
+        self.parents = np.asarray(parents, dtype='int32')
+        self.names = np.asarray(names, dtype=object)
+        self.state = state
+        self.lookup = pd.Index(self.codes)
+        # build the hash table of the codes now, checks look codes up from several threads at once
+        self.lookup.get_indexer(self.codes[:1])
+
+        # children of region i are children[child_ptr[i]:child_ptr[i + 1]]
+        has_parent = self.parents >= 0
+        self.children = np.flatnonzero(has_parent)[np.argsort(self.parents[has_parent], kind='stable')].astype('int32')
+        counts = np.bincount(self.parents[has_parent], minlength=len(self.codes))
+        self.child_ptr = np.concatenate([[0], np.cumsum(counts)]).astype('int64')
+
+        # position of the ancestor of every region at every level (the region itself at its own level)
+        self.ancestors = np.full((len(self.codes), len(LEVELS)), -1, dtype='int32')
+        current = np.arange(len(self.codes), dtype='int32')
+        rows = np.arange(len(self.codes))
+        for _ in range(len(LEVELS)):
+            valid = current >= 0
+            if not valid.any():
+                break
+            level = self.levels[current[valid]]
+            known = level >= 0
+            self.ancestors[rows[valid][known], level[known]] = current[valid][known]
+            current[valid] = self.parents[current[valid]]
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def from_frame(cls, areas, state=None):
+        """
+        The purpose of this function is to build the index from the rows of AreasAsgs. A code listed
+        in several ASGS editions takes the type, parent and name of its latest edition.
+
+        input: DataFrame (ASGSCode | ASGS | RegionType | Parent | Name), summary of the table
+        output: HierarchyIndex
+        """
+        areas = areas.dropna(subset=['ASGSCode'])
+        if 'ASGS' in areas.columns:
+            areas = areas.sort_values(['ASGSCode', 'ASGS'], ascending=[True, False], na_position='last')
+        areas = areas.drop_duplicates('ASGSCode').sort_values('ASGSCode')
+        codes = areas['ASGSCode'].to_numpy(dtype='int64')
+        region_types = areas['RegionType'].astype(str).str.strip()
+        levels = region_types.map({name: level for level, name in enumerate(LEVELS)}).fillna(-1).to_numpy(dtype='int8')
+        parents = pd.Index(codes).get_indexer(pd.Index(areas['Parent'].astype('Int64')))
+        names = areas['Name'].to_numpy(dtype=object) if 'Name' in areas.columns else np.full(len(codes), None)
+        return cls(codes, levels, parents, names, state)
+
+    def save(self, path):
+        """
+        The purpose of this function is to write the index to an npz file (replaced atomically)
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", 'wb') as file:
+            np.savez(file, codes=self.codes, levels=self.levels, parents=self.parents,
+                     names=self.names.astype(str), has_name=pd.notna(self.names),
+                     state=np.array(json.dumps(self.state)))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        output: the HierarchyIndex saved in an npz file
+        """
+        with np.load(path, allow_pickle=False) as saved:
+            names = saved['names'].astype(object)
+            names[~saved['has_name']] = None
+            return cls(saved['codes'], saved['levels'], saved['parents'], names, json.loads(str(saved['state'])))
+
+    def positions(self, codes):
+        """
+        output: array of the positions of the codes in the index, -1 for unknown codes
+        """
+        return self.lookup.get_indexer(pd.Index(pd.array(np.asarray(codes).ravel(), dtype='Int64')))
+
+    def _take(self, values, positions, missing):
+        result = values[np.maximum(positions, 0)]
+        if values.dtype == object:
+            result = result.copy()
+        result[positions < 0] = missing
+        return result
+
+    def region_types(self, codes):
+        """
+        output: object array of the region type of every code (None if unknown)
+        """
+        names = np.array(LEVELS + [None], dtype=object)
+        levels = self._take(self.levels, self.positions(codes), -1)
+        return names[levels]
+
+    def parents_of(self, codes):
+        """
+        output: Int64 array of the parent code of every code (<NA> if none)
+        """
+        parents = self._take(self.parents, self.positions(codes), -1)
+        return self._codes_at(parents)
+
+    def names_of(self, codes):
+        """
+        output: object array of the name of every code (None if unknown)
+        """
+        return self._take(self.names, self.positions(codes), None)
+
+    def ancestors_at(self, codes, level):
+        """
+        output: Int64 array of the code of the ancestor at a level ('STE', 'SA4', 'SA3' or 'SA2')
+                of every code, the code itself if it is at that level (<NA> if none)
+        """
+        positions = self.positions(codes)
+        ancestors = self._take(self.ancestors[:, LEVELS.index(level)], positions, -1)
+        return self._codes_at(ancestors)
+
+    def within(self, codes, regions):
+        """
+        output: boolean array, True for the codes that are one of the regions or below one of them
+                (by their parent links, whatever the digits of the codes)
+        """
+        positions = self.positions(codes)
+        regions = self.positions(regions)
+        inside = np.isin(self.ancestors[np.maximum(positions, 0)], regions[regions >= 0]).any(axis=1)
+        return inside & (positions >= 0)
+
+    def children_of(self, code):
+        """
+        output: array of the codes of the direct children of a region
+        """
+        position = self.positions([code])[0]
+        if position < 0:
+            return np.array([], dtype='int64')
+        return self.codes[self.children[self.child_ptr[position]:self.child_ptr[position + 1]]]
+
+    def descendants_of(self, code, level=None):
+        """
+        output: array of the codes below a region, only those at a level if one is given
+        """
+        position = self.positions([code])[0]
+        if position < 0 or self.levels[position] < 0:
+            return np.array([], dtype='int64')
+        below = (self.ancestors[:, self.levels[position]] == position) & (np.arange(len(self.codes)) != position)
+        if level is not None:
+            below &= self.levels == LEVELS.index(level)
+        return self.codes[below]
+
+    def _codes_at(self, positions):
+        codes = pd.array(self.codes[np.maximum(positions, 0)], dtype='Int64')
+        codes[positions < 0] = pd.NA
+        return codes
+
+
+def same_state(old, new):
+    """
+    output: True if two summaries of AreasAsgs describe the same table
+    """
+    if old is None or new is None or old.keys() != new.keys():
+        return False
+    for key, value in new.items():
+        if isinstance(value, float) and isinstance(old[key], float):
+            if not math.isclose(old[key], value, rel_tol=1e-12, abs_tol=1e-6):
+                return False
+        elif old[key] != value:
+            return False
+    return True
+
+
+def load_hierarchy(fetch, directory=INDEX_DIR):
+    """
+    The purpose of this function is to load the saved hierarchy index, or to build and save it if
+    AreasAsgs changed since it was saved
+
+    input: function returning the result of an SQL file (e.g. DataSession.fetch), index directory
+           (None to never save)
+    output: HierarchyIndex
+    """
+    # a row of the frame would turn the integer checksums into floats, which round away the change of one row
+    summary = fetch("Area_state.sql").to_dict('records')[0]
+    state = {key: None if pd.isna(value) else int(value) if isinstance(value, numbers.Integral) else float(value)
+             for key, value in summary.items()}
+    path = os.path.join(directory, INDEX_FILE) if directory else None
+    if path and os.path.exists(path):
+        try:
+            index = HierarchyIndex.load(path)
+            if same_state(index.state, state):
+                logging.info(f"Loaded hierarchy index {path}")
+                return index
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Hierarchy index {path} could not be read: {e}")
+
+    index = HierarchyIndex.from_frame(fetch("Area_index.sql"), state)
+    if path:
+        index.save(path)
+        logging.info(f"Saved hierarchy index {path} ({len(index)} regions)")
+    return index
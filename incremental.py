@@ -0,0 +1,212 @@
+"""
+This file contains the incremental re-check mode.
+Every incremental run stores a fingerprint of the data of each region in each source table and
+the output of every check. The next run compares fingerprints, works out which regions changed
+(plus their ancestors, whose sums depend on them), re-runs the region-level checks for those
+regions only, on a data session that only reads their rows, and merges the new flags into the
+previous output.
+"""
+import logging
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from data_session import DataSession
+from region_scope import RegionScope
+from scheduler import run_checks
+
+
+DEFAULT_STATE_DIR = "incremental_state"
+STATE_FILE = "state.pkl"
+
+# the re-checked regions are listed in the queries, more regions than this are read with every region
+MAX_SCOPE_CODES = 5000
+
+
+def load_state(state_dir):
+    """
+    output: the state saved by the last incremental run, None if there is none
+    """
+    path = os.path.join(state_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+def save_state(state_dir, fingerprints, hierarchy_hash, results, tasks):
+    """
+    The purpose of this function is to store what the next incremental run compares against
+
+    input: state directory, dictionary of check name -> fingerprint DataFrame its output is up to
+           date with, hash of the region hierarchy, check results, list of CheckTask that produced
+           the results
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    temp_path = os.path.join(state_dir, STATE_FILE + ".tmp")
+    with open(temp_path, 'wb') as file:
+        pickle.dump({'fingerprints': fingerprints, 'hierarchy_hash': hierarchy_hash, 'results': results,
+                     'settings': {task.name: task_settings(task) for task in tasks}}, file)
+    os.replace(temp_path, os.path.join(state_dir, STATE_FILE))
+
+
+def check_fingerprints(state):
+    """
+    output: dictionary of check name -> fingerprints of the saved state (states saved before the
+            fingerprints were kept per check have one DataFrame for every check)
+    """
+    if isinstance(state['fingerprints'], pd.DataFrame):
+        return {name: state['fingerprints'] for name in state['results']}
+    return state['fingerprints']
+
+
+def task_settings(task):
+    """
+    output: text describing the arguments of a check, a check whose arguments changed is run in full
+    """
+    return repr(sorted(task.kwargs.items()))
+
+
+def hierarchy_hash(hierarchy):
+    """
+    output: a hash of the region hierarchy, which changes if any region or parent changes
+    """
+    ordered = hierarchy.astype({'RegionType': str}).sort_values(['ASGSCode', 'Parent']).reset_index(drop=True)
+    return int(pd.util.hash_pandas_object(ordered, index=False).sum())
+
+
+def changed_codes(previous, current):
+    """
+    The purpose of this function is to find the regions whose data changed in any source table
+
+    input: fingerprints of the last run and of this run (ASGSCode | SourceTable | RowCount | Total | WeightedTotal)
+    output: numpy array of region codes that were added, removed or changed
+    """
+    keys = ['ASGSCode', 'SourceTable']
+    merged = previous.astype({'SourceTable': str}).merge(current.astype({'SourceTable': str}), on=keys,
+                                                         how='outer', suffixes=('_old', '_new'))
+    changed = merged['RowCount_old'].ne(merged['RowCount_new'])
+    for column in ['Total', 'WeightedTotal']:
+        old, new = merged[f'{column}_old'].to_numpy(), merged[f'{column}_new'].to_numpy()
+        changed |= ~np.isclose(old, new, rtol=1e-12, atol=1e-6, equal_nan=True)
+    return merged.loc[changed, 'ASGSCode'].unique()
+
+
+def with_ancestors(codes, hierarchy):
+    """
+    The purpose of this function is to add the parent, grandparent, ... of every code
+
+    input: region codes, hierarchy DataFrame (ASGSCode | RegionType | Parent)
+    output: set of the codes and all their ancestors
+    """
+    parents = hierarchy[['ASGSCode', 'Parent']].dropna().drop_duplicates()
+    scope = set(codes)
+    frontier = set(codes)
+    while frontier:
+        frontier = set(parents.loc[parents['ASGSCode'].isin(frontier), 'Parent'].astype('int64')) - scope
+        scope |= frontier
+    return scope
+
+
+def merge_results(previous, new, scope):
+    """
+    The purpose of this function is to replace the previous flags of the re-checked regions
+
+    input: previous check output, check output for the re-checked regions, re-checked codes
+    output: merged check output
+    """
+    kept = previous[~previous['Code'].isin(scope)]
+    return pd.concat([kept, new], ignore_index=True)
+
+
+def changed_session(session, codes, hierarchy):
+    """
+    The purpose of this function is to create the data session of the re-checked regions. It reads
+    the rows of the regions and of their children (whose sums the region level sum checks compare
+    with their parent), and shares the hierarchy index and metrics of the run.
+
+    input: DataSession of the run, re-checked region codes, hierarchy DataFrame (ASGSCode | RegionType | Parent)
+    output: DataSession, the run session itself if the regions are too many to list in a query
+    """
+    children = hierarchy.loc[hierarchy['Parent'].isin(codes), 'ASGSCode']
+    read = set(codes) | set(children.astype('int64'))
+    if len(read) > MAX_SCOPE_CODES:
+        logging.info(f"{len(read)} regions to read, the re-checked regions are read with every region")
+        return session
+    scoped = DataSession(session.conn, session.executor, RegionScope(read, descendants=False), session.metrics)
+    scoped.hierarchy = session.hierarchy_index()
+    scoped.index_dir = session.index_dir
+    return scoped
+
+
+def run_incremental(tasks, session, state_dir=DEFAULT_STATE_DIR, **run_kwargs):
+    """
+    The purpose of this function is to run the checks only for the regions whose data changed
+    since the last incremental run. Incremental checks are limited to the changed regions and
+    their ancestors and read only the rows of those regions (and of their children); the other
+    checks (which need every region, e.g. the ML model) are not re-run and keep their previous
+    output. Without a previous state, or when the region hierarchy changed, every check is run in
+    full, and so is a check that failed in the last run or has new arguments.
+    A check that fails on the changed regions keeps its previous output and the fingerprints it
+    was up to date with, so the next run re-checks those regions again.
+
+    input: list of CheckTask, DataSession, state directory, arguments of run_checks
+    output: dictionary of check name -> check output, as returned by run_checks
+    """
+    fingerprints = session.fetch("Region_fingerprints.sql")
+    hierarchy = session.fetch("Area_hierarchy.sql")
+    current_hash = hierarchy_hash(hierarchy)
+    state = load_state(state_dir)
+
+    if state is None or state['hierarchy_hash'] != current_hash:
+        logging.info("No usable incremental state, running every check in full")
+        results = run_checks(tasks, session, **run_kwargs)
+        save_state(state_dir, {task.name: fingerprints for task in tasks}, current_hash, results, tasks)
+        return results
+
+    previous_fingerprints = check_fingerprints(state)
+    results, saved, full_tasks, limited = {}, {}, [], {}
+    # checks saved with the same fingerprints share the regions to re-check
+    scopes = {}
+    for task in tasks:
+        previous = state['results'].get(task.name)
+        if previous is None or task.name not in previous_fingerprints \
+                or state['settings'].get(task.name) != task_settings(task):
+            # a new check, one with new arguments or one that failed last time has no output to merge into
+            full_tasks.append(task)
+            continue
+        results[task.name] = previous
+        if not task.incremental:
+            logging.warning(f"{task.name} is not re-run in incremental mode, keeping its previous output")
+            saved[task.name] = fingerprints
+            continue
+        old = previous_fingerprints[task.name]
+        if id(old) not in scopes:
+            changed = changed_codes(old, fingerprints)
+            scopes[id(old)] = sorted(with_ancestors(changed, hierarchy))
+            logging.info(f"Incremental run: {len(changed)} regions changed, {len(scopes[id(old)])} regions to re-check")
+        if scopes[id(old)]:
+            limited[task.name] = (task.limited_to(scopes[id(old)]), scopes[id(old)])
+        else:
+            saved[task.name] = fingerprints
+
+    if full_tasks:
+        # a check that fails here is saved without output and run in full again next time
+        results.update(run_checks(full_tasks, session, **run_kwargs))
+        saved.update({task.name: fingerprints for task in full_tasks})
+    if limited:
+        codes = set().union(*(scope for _, scope in limited.values()))
+        new_results = run_checks([task for task, _ in limited.values()], changed_session(session, codes, hierarchy),
+                                 **run_kwargs)
+        for name, output in new_results.items():
+            if output is None:
+                logging.error(f"{name} failed on the changed regions, keeping its previous output")
+                saved[name] = previous_fingerprints[name]
+            else:
+                results[name] = merge_results(results[name], output, limited[name][1])
+                saved[name] = fingerprints
+
+    save_state(state_dir, saved, current_hash, results, tasks)
+    return results
@@ -1,52 +1,41 @@
+import argparse
 import logging
+import os
 import platform
-import pandas as pd
-import re
 import warnings
 import time
+from db_backend import MSSQLBackend, SQLiteBackend
 
 warnings.simplefilter(action='ignore', category=UserWarning)
 
-# Set up basic configuration for logging
-logging.basicConfig(
-    filename='app.log',  # Log file name
-    filemode='w',
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-logging.info("Log set up done, start running the file")
-
-start_time = time.time()
-
-# Import the household_check function
-try:
-    from checks import household_check, births_region_level_sum_check, deaths_region_level_sum_check, household_region_level_sum_check, population_region_level_sum_check, trend_shape_check, spike_check, perform_negative_check, perform_sanity_check, perform_ml_anomaly_detection
-    from parameter_window import open_parameter_window
-except Exception as e:
-    logging.error(f"Import failed: {e}")
-
-# Connect to the database
-try:
-    current_system = platform.system()
-    if current_system == "Darwin":
-        import pymssql
-        conn = pymssql.connect(
-            server='localhost',
-            user='sa',
-            password='MBS_project_2024',
-            database='forecasts',
-            as_dict=True)
-
-    elif current_system == "Windows":
-        import pyodbc
-        conn = pyodbc.connect(
-                    'Driver={SQL Server};'
-                    'Server=GDANSK;'
-                    'Database=SafiTopsDown_Transformed;'
-                    'Trusted_Connection=yes')
-
 
+def connect_to_database(use_snapshot=True):
+    """
+    The purpose of this function is to create the database backend of the run.
+    Queries borrow connections from its pool, so concurrent checks never share a connection.
+    Setting the PEXA_SNAPSHOT environment variable to a snapshot directory (see snapshot.py)
+    runs the checks on that snapshot, and setting PEXA_DATABASE to an SQLite file runs them on
+    that local copy of the forecasts database instead of SQL Server.
+
+    input: False to always connect to the database (e.g. to refresh the snapshot from it)
+    output: DatabaseBackend
+    """
+    snapshot_dir = os.environ.get('PEXA_SNAPSHOT')
+    if snapshot_dir and use_snapshot:
+        from snapshot import SnapshotBackend
+        return SnapshotBackend(snapshot_dir)
+
+    database_file = os.environ.get('PEXA_DATABASE')
+    if database_file:
+        return SQLiteBackend(database_file)
+
+    if platform.system() == "Windows":
+        return MSSQLBackend(
+            'pyodbc',
+            'Driver={SQL Server};'
+            'Server=GDANSK;'
+            'Database=SafiTopsDown_Transformed;'
+            'Trusted_Connection=yes')
 
     #   'Driver={SQL Server};'
     #   'Server=GDANSK;'
@@ -54,122 +43,126 @@ try:
     #   'UID=sa;'
     #   'PWD=MBS_project_2024')
 
+    # pymssql works on both macOS and Linux
+    return MSSQLBackend(
+        'pymssql',
+        server='localhost',
+        user='sa',
+        password='MBS_project_2024',
+        database='forecasts')
+
+
+def write_output(results, path='final_output.csv'):
+    """
+    The purpose of this function is to merge the output of every check into one row per flagged
+    region (see results_store.py), written to a csv file and to a Parquet file next to it
+
+    input: dictionary of check name -> check output, path of the csv file
+    output: consolidated DataFrame
+    """
+    from results_store import ResultStore
+
+    store = ResultStore()
+    for name, output in results.items():
+        store.add(name, output)
+    return store.write(path, os.path.splitext(path)[0] + '.parquet')
+
+
+def main(incremental=False, selected=None, scope=None, metrics_dir="metrics", partition_level=None):
+    """
+    input: True to only re-check the regions whose data changed since the last incremental run,
+           list of check keys to run (default: every check, see registry.py),
+           list of state, SA4, SA3 or SA2 codes to limit the run to (default: every region),
+           directory of the metrics file of the run (None to not write one),
+           level the national ERP checks are partitioned by (default: no partitions, see partitioned.py)
+    """
+    # Set up basic configuration for logging
+    logging.basicConfig(
+        filename='app.log',  # Log file name
+        filemode='w',
+        level=logging.DEBUG,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    logging.info("Log set up done, start running the file")
+
+    start_time = time.time()
+
+    # Import the check functions
+    try:
+        from checks import execute_sql_query
+        from parameter_window import open_parameter_window
+        from data_session import DataSession
+        from metrics import RunMetrics, peak_rss_mb
+        from parameters import DEFAULT_PARAMETERS
+        from region_scope import RegionScope
+        from registry import build_tasks
+        from scheduler import run_checks
+    except Exception as e:
+        logging.error(f"Import failed: {e}")
+
+    # Connect to the database
+    try:
+        conn = connect_to_database()
+        logging.info("Database backend created")
+    except Exception as e:
+        logging.error(f"Connection to database failed: {e}")
+        conn = None
+
+    # every check reads its data through the session so each SQL file is fetched once per run
+    metrics = RunMetrics(metrics_dir)
+    session = DataSession(conn, execute_sql_query, RegionScope(scope) if scope else None, metrics)
+
+    # get input parameters
+    try:
+        parameters = dict(zip(DEFAULT_PARAMETERS, open_parameter_window()))
+        logging.info("Got inputted parameters")
+    except Exception as e:
+        logging.error(e)
+
+    tasks = build_tasks(parameters, selected, partition_level)
+    max_connections = conn.pool_size if conn is not None else 1
+    if incremental:
+        from incremental import run_incremental
+        results = run_incremental(tasks, session, max_connections=max_connections)
     else:
-        logging.error(f"Running on an unsupported system: {current_system}")
-    logging.info("Connection to database was successful")
-except Exception as e:
-    logging.error(f"Connection to database failed: {e}")
-    conn = None
-
-# get input parameters
-try:
-    ratio_upper, ratio_lower, multiplier, sensitivity, contamination, sa4_code = open_parameter_window()
-    logging.info("Got inputted parameters")
-except Exception as e:
-    logging.error(e)
-
-# household ratio check 
-# if conn:
-#     try:
-#         logging.info("Trying to execute household check")
-#         ratio_df = household_check(conn, ratio_upper, ratio_lower)
-#         logging.info("Household check completed successfully")
-#         # Optionally, you can log or save the results:
-#         # logging.info(f"Found {len(unique_outlier_asgs_codes)} unique outlier ASGS codes.")
-#     except Exception as e:
-#         logging.error(f"Household check failed: {e}")
-# else:
-#     logging.error("Skipped checks because the connection was not established.")
-
-    
-# region level consistency check
-try:
-    logging.info("Try to execute births check")
-    births_check_output = births_region_level_sum_check(conn, sa4_code)
-    logging.info("Births check done")
-except Exception as e:
-    logging.error(f"Births check failed: {e}")
-
-# try:
-#     logging.info("Try to execute deaths check")
-#     deaths_check_output = deaths_region_level_sum_check(conn)
-#     logging.info("Deaths check done")
-# except Exception as e:
-#     logging.error(f"Deaths check failed: {e}")
-
-# try:
-#     logging.info("Try to execute household check")
-#     household_check_output = household_region_level_sum_check(conn)
-#     logging.info("Household check done")
-# except Exception as e:
-#     logging.error(f"Household check failed: {e}")
-
-# try:
-#     logging.info("Try to execute population check")
-#     population_check_output = population_region_level_sum_check(conn)
-#     logging.info("Population check done")
-# except Exception as e:
-#     logging.error(f"Population check failed: {e}")
-
-# try:
-#     logging.info("Running Negative Checks:")
-#     negative_checks = perform_negative_check(conn)
-# except Exception as e:
-#     logging.error(f"Negative check failed: {e}")
-
-# try:
-#     logging.info("Running Sanity Checks:")
-#     sanity_checks = perform_sanity_check(conn)
-# except Exception as e:
-#     logging.error(f"Sanity check failed: {e}")
-
-# try:
-#     logging.info("Running Machine Learning Anomaly Detection:")
-#     ml_anomaly = perform_ml_anomaly_detection(conn, contamination_ = contamination)
-# except Exception as e:
-#     logging.error(f"ML Anomaly Detection check failed: {e}")
-
-
-# # pattern check 
-
-# try:
-#     logging.info("Try to execute spike check")
-#     spike_output = spike_check(conn, sensitivity, multiplier) # so far filter out 327 region
-#     logging.info("spike check done")
-#     logging.info("Try to execute shape check")
-#     shape_output = trend_shape_check(conn, sensitivity) # so far filter out 360 region
-#     logging.info("shape check done")
-# except Exception as e:
-#     logging.error(e)
-
-# print(spike_output)
-# print(shape_output)
-
-# merge result together and output a csv file
-#output_list = [ratio_df, sanity_checks, births_check_output, deaths_check_output, population_check_output, household_check_output, negative_checks,ml_anomaly, spike_output,shape_output]
-print(births_check_output)
-output_list = [births_check_output]
-
-
-merged_df = pd.concat(output_list, ignore_index=True)
-merged_df = merged_df.sort_values(by=['Region Type', 'Code'], ascending=[False, True])
-merged_df.to_csv('final_output.csv', index=False)
-
-# summary stat 
-end_time = time.time()
-running_time = end_time - start_time
-
-print(f'The number of unique abnormal region are: {len(merged_df["Code"].unique())}') # something wrong with sanity check, without it only has 565 region been tagged
-print(f"Running time: {running_time:.6f} seconds")
-
-# print(f'For sanity check, {len(sanity_checks.iloc[:, 0].unique())} of unique region been tagged')
-# print(f'For ratio check, {len(ratio_df.iloc[:, 0].unique())} of unique region been tagged')
-# print(f'For births check, {len(births_check_output.iloc[:, 0].unique())} of unique region been tagged')
-# # print(f'For deaths check, {len(deaths_check_output.iloc[:, 0].unique())} of unique region been tagged')
-# # print(f'For household check, {len(household_check_output.iloc[:, 0].unique())} of unique region been tagged')
-# print(f'For population check, {len(population_check_output.iloc[:, 0].unique())} of unique region been tagged')
-# print(f'For negative checks, {len(negative_checks.iloc[:, 0].unique())} of unique region been tagged')
-# print(f'For ML anomaly check, {len(ml_anomaly.iloc[:, 0].unique())} of unique region been tagged')
-# print(f'For spike check, {len(spike_output.iloc[:, 0].unique())} of unique region been tagged')
-# print(f'For shape check, {len(shape_output.iloc[:, 0].unique())} of unique region been tagged')
-
+        results = run_checks(tasks, session, max_connections=max_connections)
+    if conn is not None:
+        conn.close()
+
+    # merge result together and output a csv file
+    merged_df = write_output(results)
+
+    # summary stat 
+    end_time = time.time()
+    running_time = end_time - start_time
+
+    print(f'The number of unique abnormal region are: {len(merged_df["Code"].unique())}') # something wrong with sanity check, without it only has 565 region been tagged
+    print(f"Running time: {running_time:.6f} seconds")
+    cache_stats = session.report()
+    print(f"Data session cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    for name, output in results.items():
+        if output is not None:
+            print(f'For {name}, {len(output.iloc[:, 0].unique())} of unique region been tagged')
+    metrics.record('run', 'main', wall_s=round(running_time, 4), rows=len(merged_df), peak_rss_mb=peak_rss_mb())
+    metrics.report()
+
+
+if __name__ == '__main__':
+    from partitioned import PARTITION_LEVELS
+    from registry import CHECKS
+
+    parser = argparse.ArgumentParser(description="Run the forecast checks and write final_output.csv")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only re-check the regions whose data changed since the last incremental run")
+    parser.add_argument('--checks', nargs='+', default=None,
+                        help="checks to run (default: every check): " + ", ".join(CHECKS))
+    parser.add_argument('--scope', nargs='+', default=None,
+                        help="only check the regions below these state, SA4, SA3 or SA2 codes")
+    parser.add_argument('--metrics-dir', default="metrics",
+                        help="directory of the JSON-lines metrics file of the run (default: metrics)")
+    parser.add_argument('--partition-level', choices=PARTITION_LEVELS, default=None,
+                        help="run the spike, shape, pattern and ML checks one partition of this level at a time")
+    args = parser.parse_args()
+    main(incremental=args.incremental, selected=args.checks, scope=args.scope, metrics_dir=args.metrics_dir,
+         partition_level=args.partition_level)
@@ -0,0 +1,134 @@
+"""
+This file contains the performance metrics of a run.
+Every query fetched by the data session and every check run by the scheduler is recorded with its
+wall time, rows, DataFrame memory and the peak RSS of the process; checks also record how much of
+their time went to waiting on queries versus computing. Every execute_sql_query call adds its time
+to a per-thread query clock, which measures both the queries a check runs itself and the datasets
+the scheduler fetches for it beforehand. Records are appended to a JSON-lines file
+(one per run) as they happen, and a summary table is printed at the end of the run.
+"""
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+
+DEFAULT_METRICS_DIR = "metrics"
+
+# seconds spent in queries by the current thread, so a check can split its time into query and compute
+_query_clock = threading.local()
+
+
+def peak_rss_mb():
+    """
+    output: the peak resident memory of this process in MB, None if it cannot be measured
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS reports bytes
+        return round(peak / 1024 / (1024 if os.uname().sysname == 'Darwin' else 1), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        memory = psutil.Process().memory_info()
+        return round(getattr(memory, 'peak_wset', memory.rss) / 1024 ** 2, 1)
+    except ImportError:
+        return None
+
+
+def frame_memory_mb(df):
+    """
+    output: memory used by a DataFrame in MB (0 for anything that is not a DataFrame)
+    """
+    if not isinstance(df, pd.DataFrame):
+        return 0.0
+    return round(df.memory_usage(deep=True).sum() / 1024 ** 2, 3)
+
+
+def add_query_time(seconds):
+    _query_clock.seconds = getattr(_query_clock, 'seconds', 0.0) + seconds
+
+
+def reset_query_time():
+    _query_clock.seconds = 0.0
+
+
+def query_time():
+    """
+    output: seconds this thread spent in queries since the last reset_query_time()
+    """
+    return getattr(_query_clock, 'seconds', 0.0)
+
+
+def measure_check(func, *args, **kwargs):
+    """
+    The purpose of this function is to run a check and measure it, in the thread or process
+    running the check
+
+    input: check function and its arguments
+    output: check output, dictionary of measurements (wall_s, query_s of the queries the check
+            ran itself, compute_s, rows, memory_mb, peak_rss_mb, pid)
+    """
+    reset_query_time()
+    start_time = time.perf_counter()
+    result = func(*args, **kwargs)
+    wall_time = time.perf_counter() - start_time
+    waited = min(query_time(), wall_time)
+    return result, {'wall_s': round(wall_time, 4), 'query_s': round(waited, 4),
+                    'compute_s': round(wall_time - waited, 4),
+                    'rows': len(result) if isinstance(result, pd.DataFrame) else None,
+                    'memory_mb': frame_memory_mb(result), 'peak_rss_mb': peak_rss_mb(), 'pid': os.getpid()}
+
+
+class RunMetrics:
+    """
+    The purpose of this class is to collect the metrics of one run and write them to a
+    JSON-lines file. It can be used from several threads.
+
+    input: directory of the metrics files (None to keep the records in memory only)
+    """
+
+    def __init__(self, directory=DEFAULT_METRICS_DIR):
+        self.run_id = time.strftime('%Y%m%d-%H%M%S')
+        self.records = []
+        self.lock = threading.Lock()
+        self.path = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.path = os.path.join(directory, f"run-{self.run_id}.jsonl")
+
+    def record(self, stage, name, **values):
+        """
+        The purpose of this function is to add one record to the run
+
+        input: stage ('query', 'check' or 'run'), name of the query or check, measurements
+        """
+        values.setdefault('peak_rss_mb', peak_rss_mb())
+        record = {'run': self.run_id, 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'stage': stage, 'name': name, **values}
+        with self.lock:
+            self.records.append(record)
+            if self.path:
+                with open(self.path, 'a') as file:
+                    file.write(json.dumps(record, default=str) + "\n")
+
+    def summary(self):
+        """
+        output: DataFrame with one row per record, the slowest first within each stage
+        """
+        columns = ['stage', 'name', 'wall_s', 'fetch_s', 'query_s', 'compute_s', 'rows', 'memory_mb', 'peak_rss_mb']
+        summary = pd.DataFrame(self.records).reindex(columns=columns)
+        order = {'query': 0, 'check': 1, 'run': 2}
+        return summary.sort_values(['stage', 'wall_s'], ascending=[True, False],
+                                   key=lambda column: column.map(order) if column.name == 'stage' else column)
+
+    def report(self):
+        """
+        The purpose of this function is to print the summary table of the run
+        """
+        print(self.summary().to_string(index=False, na_rep='-'))
+        if self.path:
+            print(f"Metrics written to {self.path}")
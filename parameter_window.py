@@ -1,5 +1,6 @@
 import tkinter as tk
 from tkinter import ttk
+from parameters import DEFAULT_PARAMETERS, parse_parameter, save_parameters as write_parameters
 
 def open_parameter_window():
     # This list will hold the parameters to return
@@ -7,37 +8,23 @@ def open_parameter_window():
 
     def save_default_parameters():
         # Save the default values
-        ratio_upper = 5
-        ratio_lower = 1
-        multiplier = 5
-        sensitivity = 0.005
-        contamination = 0.003
-        sa4_code = 213
-        
-        save_parameters(ratio_upper, ratio_lower, multiplier, sensitivity, contamination, sa4_code)
+        save_parameters(*DEFAULT_PARAMETERS.values())
 
     def save_entered_parameters():
         # Get values from entry fields, use entered values or defaults if empty
-        ratio_upper = float(entry_param1.get()) if entry_param1.get() else 5
-        ratio_lower = float(entry_param2.get()) if entry_param2.get() else 1
-        multiplier = float(entry_param3.get()) if entry_param3.get() else 5
-        sensitivity = float(entry_param4.get()) if entry_param4.get() else 0.005
-        contamination = float(entry_param5.get()) if entry_param5.get() else 0.003
-        sa4_code = float(entry_param6.get()) if entry_param6.get() else 213
+        entries = [entry_param1, entry_param2, entry_param3, entry_param4, entry_param5, entry_param6, entry_param7]
+        ratio_upper, ratio_lower, multiplier, sensitivity, contamination, sa4_code, vintage = [
+            parse_parameter(name, entry.get()) if entry.get() else default
+            for (name, default), entry in zip(DEFAULT_PARAMETERS.items(), entries)
+        ]
         
-        save_parameters(ratio_upper, ratio_lower, multiplier, sensitivity, contamination, sa4_code)
+        save_parameters(ratio_upper, ratio_lower, multiplier, sensitivity, contamination, sa4_code, vintage)
 
-    def save_parameters(ratio_upper, ratio_lower, multiplier, sensitivity, contamination, sa4_code):
-        with open('parameters.txt', 'w') as f:
-            f.write(f"ratio_upper: {ratio_upper}\n")
-            f.write(f"ratio_lower: {ratio_lower}\n")
-            f.write(f"multiplier: {multiplier}\n")
-            f.write(f"sensitivity: {sensitivity}\n")
-            f.write(f"contamination: {contamination}\n")
-            f.write(f"sa4_code: {sa4_code}\n")
+    def save_parameters(ratio_upper, ratio_lower, multiplier, sensitivity, contamination, sa4_code, vintage):
+        write_parameters(dict(zip(DEFAULT_PARAMETERS, [ratio_upper, ratio_lower, multiplier, sensitivity, contamination, sa4_code, vintage])))
 
         # Save parameters to the list
-        parameters.extend([ratio_upper, ratio_lower, multiplier, sensitivity, contamination, sa4_code])
+        parameters.extend([ratio_upper, ratio_lower, multiplier, sensitivity, contamination, sa4_code, vintage])
         
         print(f"ratio_upper set to: {ratio_upper}")
         print(f"ratio_lower set to: {ratio_lower}")
@@ -45,6 +32,7 @@ def open_parameter_window():
         print(f"sensitivity set to: {sensitivity}")
         print(f"contamination set to: {contamination}")
         print(f"sa4_code set to: {sa4_code}")
+        print(f"vintage set to: {vintage}")
         window.destroy()  # Close the window after saving
 
     # Create the main window
@@ -82,13 +70,17 @@ def open_parameter_window():
     entry_param6.grid(row=5, column=1, padx=10, pady=10)
     entry_param6.insert(0, "213")  # Set default value    
 
+    ttk.Label(window, text="Forecast vintage of the ML models (empty: hash of the data):").grid(row=6, column=0, padx=10, pady=10)
+    entry_param7 = ttk.Entry(window)
+    entry_param7.grid(row=6, column=1, padx=10, pady=10)
+
     # Add a button to save default parameters
     default_button = ttk.Button(window, text="Use Default Values", command=save_default_parameters)
-    default_button.grid(row=6, column=0, pady=10, padx=10)
+    default_button.grid(row=7, column=0, pady=10, padx=10)
 
     # Add a button to save entered parameters
     save_button = ttk.Button(window, text="Use Entered Values", command=save_entered_parameters)
-    save_button.grid(row=6, column=1, pady=10, padx=10)
+    save_button.grid(row=7, column=1, pady=10, padx=10)
 
     # Start the GUI event loop
     window.mainloop()
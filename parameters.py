@@ -0,0 +1,66 @@
+"""
+This file contains the check parameters: their default values and how they are read from and
+written to parameters.txt. It does not import tkinter, so headless runs can use it.
+"""
+import os
+
+
+# name -> default value, in the order the parameters are returned and written
+DEFAULT_PARAMETERS = {
+    'ratio_upper': 5,
+    'ratio_lower': 1,
+    'multiplier': 5,
+    'sensitivity': 0.005,
+    'contamination': 0.003,
+    'sa4_code': 213,
+    # forecast vintage the ML models are saved under, None for a hash of the ERP data
+    'vintage': None,
+}
+
+
+def parse_parameter(name, value):
+    """
+    The purpose of this function is to convert a parameter from text.
+    SA4 codes are kept as whole numbers (213, not 213.0) because they are matched against codes.
+
+    input: parameter name, text value
+    output: int for sa4_code, text for vintage (None when it is empty), float otherwise
+    """
+    if name == 'sa4_code':
+        return int(float(value))
+    if name == 'vintage':
+        return value.strip() or None
+    return float(value)
+
+
+def read_parameters(path='parameters.txt'):
+    """
+    The purpose of this function is to read the parameters saved in parameters.txt.
+    Parameters missing from the file keep their default value.
+
+    input: path of the parameter file
+    output: dictionary of parameter name -> value
+    """
+    parameters = dict(DEFAULT_PARAMETERS)
+    if not os.path.exists(path):
+        return parameters
+    with open(path, 'r') as f:
+        for line in f:
+            if ':' not in line:
+                continue
+            name, value = (part.strip() for part in line.split(':', 1))
+            if name in parameters and value:
+                parameters[name] = parse_parameter(name, value)
+    return parameters
+
+
+def save_parameters(parameters, path='parameters.txt'):
+    """
+    The purpose of this function is to write the parameters to parameters.txt
+
+    input: dictionary of parameter name -> value, path of the parameter file
+    """
+    with open(path, 'w') as f:
+        for name in DEFAULT_PARAMETERS:
+            value = parameters.get(name, DEFAULT_PARAMETERS[name])
+            f.write(f"{name}: {'' if value is None else value}\n")
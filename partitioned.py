@@ -0,0 +1,205 @@
+"""
+This file contains the partitioned mode of the national ERP checks (spike, shape, pattern and ML).
+Instead of fetching the ERP of every region at once, the regions are split by a level of the
+hierarchy (state, SA4 or SA3) and the ERP of one partition at a time is fetched into its own data
+session, checked and dropped, so memory is bounded by the largest partition. A region belongs to
+the partition of its ancestor at the level in the hierarchy index (FA codes do not start with the
+code of their SA4), and a partition only checks its own regions. The per-partition flags are then
+merged, and the flags are the same as those of a full in-memory run:
+- every partition gets the year rows of a full run (ERP_years.sql), so growth rates and patterns
+  of a region do not depend on the other regions of its partition
+- the ML features of the partitions are collected (one small row per region) and the models are
+  fitted and scored once on all of them, in the order of a full run
+A partition level below SA3 would split the siblings of an SA2, whose share of the parent region
+is an ML feature, so it is not allowed.
+
+usage: python main.py --partition-level SA4
+       python batch.py --sa4 all --partition-level STE
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+from data_session import DataSession
+from region_scope import RegionScope
+
+
+PARTITION_LEVELS = ['STE', 'SA4', 'SA3']
+DEFAULT_LEVEL = 'SA4'
+
+OUTPUT_COLUMNS = ['Code', 'Region Type', 'Description']
+
+
+def partition_scopes(index, level=DEFAULT_LEVEL, scope=None, codes=None):
+    """
+    The purpose of this function is to split the regions of the hierarchy into partitions by their
+    ancestor at the level in the hierarchy index, so every region of a full run is in exactly one
+    partition. The scope of a partition can read a few more rows (e.g. a region listed under
+    another parent in an older ASGS edition), the regions of the partition are those it checks.
+
+    input: HierarchyIndex, partition level, optional RegionScope of the run, optional list of region
+           codes (only the partitions holding one of them are returned)
+    output: list of (RegionScope, int64 array of the region codes of the partition), in code order
+    """
+    if level not in PARTITION_LEVELS:
+        raise ValueError(f"Unknown partition level {level} (known levels: {', '.join(PARTITION_LEVELS)})")
+    regions = index.codes
+    if codes is not None:
+        regions = np.intersect1d(regions, np.asarray(codes).astype('int64'))
+    if scope is not None:
+        scope_codes = [int(code) for code in scope.codes]
+        scope_owners = index.ancestors_at(scope_codes, level).to_numpy(dtype='int64', na_value=-1)
+        regions = regions[scope.contains(regions, index)]
+    owners = index.ancestors_at(regions, level).to_numpy(dtype='int64', na_value=-1)
+    regions, owners = regions[owners >= 0], owners[owners >= 0]
+
+    partitions = []
+    order = np.argsort(owners, kind='stable')
+    partition_codes, starts = np.unique(owners[order], return_index=True)
+    for partition, members in zip(partition_codes, np.split(regions[order], starts[1:])):
+        # the run scope can be narrower than a partition, its codes then become the partition scope
+        if scope is None or (scope.descendants and scope.contains([partition], index)[0]):
+            partitions.append((RegionScope([partition]), members))
+        else:
+            narrower = [code for code, owner in zip(scope_codes, scope_owners) if owner == partition]
+            partitions.append((RegionScope(narrower, scope.descendants), members))
+    return partitions
+
+
+def partition_sessions(session, level=DEFAULT_LEVEL, codes=None):
+    """
+    The purpose of this function is to create the data session of every partition, one at a time,
+    so the data of a partition is released when the next one starts
+
+    input: DataSession of the run, partition level, optional list of region codes
+    output: generator of (DataSession scoped to one partition, region codes of the partition)
+    """
+    index = session.hierarchy_index()
+    if index is None:
+        raise RuntimeError("The hierarchy index could not be built")
+    partitions = partition_scopes(index, level, session.scope, codes)
+    logging.info(f"Partitioned run: {len(partitions)} {level} partitions")
+    for scope, members in partitions:
+        partition = DataSession(session.conn, session.executor, scope, session.metrics)
+        partition.hierarchy = index
+        yield partition, members
+
+
+def run_years(session, edition=None):
+    """
+    output: sorted list of the years with FA or SA2 ERP in the run, only those of an ASGS edition
+            if one is given
+    """
+    years = session.fetch("ERP_years.sql")
+    if edition is not None:
+        years = years[years['ASGS'] == edition]
+    return sorted(int(year) for year in years['ERPYear'].unique())
+
+
+def _as_session(conn):
+    if isinstance(conn, DataSession):
+        return conn
+    from checks import execute_sql_query
+    return DataSession(conn, execute_sql_query)
+
+
+def run_partitioned(conn, check, columns, level=DEFAULT_LEVEL, codes=None, **kwargs):
+    """
+    The purpose of this function is to run a time series check partition by partition and merge
+    the flags in the order of a full run
+
+    input: connection or DataSession, check function taking codes and years arguments, columns of
+           its output, partition level, optional list of region codes to limit the check to, other
+           check arguments
+    output: merged output of the check, None if it failed on any partition
+    """
+    session = _as_session(conn)
+    years = run_years(session)
+    outputs = []
+    for partition, members in partition_sessions(session, level, codes):
+        output = check(partition, codes=members, years=years, **kwargs)
+        if output is None:
+            logging.error(f"{check.__name__} failed on partition {partition.scope}")
+            return None
+        if not output.empty:
+            outputs.append(output)
+    if not outputs:
+        return pd.DataFrame(columns=columns)
+    merged = pd.concat(outputs, ignore_index=True)
+    # a full run reports the regions in code order
+    return merged.sort_values('Code', kind='stable', ignore_index=True)
+
+
+def spike_check(conn, sensitivity, multiplier, level=DEFAULT_LEVEL, codes=None):
+    """
+    The purpose of this function is to run checks.spike_check partition by partition
+    """
+    from checks import spike_check as check
+    return run_partitioned(conn, check, OUTPUT_COLUMNS + ['Year', 'Magnitude'], level, codes,
+                           sensitivity=sensitivity, multiplier=multiplier)
+
+
+def trend_shape_check(conn, sensitivity, level=DEFAULT_LEVEL, codes=None):
+    """
+    The purpose of this function is to run checks.trend_shape_check partition by partition
+    """
+    from checks import trend_shape_check as check
+    return run_partitioned(conn, check, OUTPUT_COLUMNS + ['Year', 'Detail'], level, codes, sensitivity=sensitivity)
+
+
+def pattern_check(conn, level=DEFAULT_LEVEL, codes=None):
+    """
+    The purpose of this function is to run checks.pattern_check partition by partition
+    """
+    from checks import pattern_check as check
+    return run_partitioned(conn, check, OUTPUT_COLUMNS + ['Detail'], level, codes)
+
+
+def ml_anomaly_detection(conn, contamination_, level=DEFAULT_LEVEL, vintage=None, model_dir="models", n_jobs=-1):
+    """
+    The purpose of this function is to run the ML anomaly check with the features of every region
+    computed partition by partition. The models are fitted on the features of every region at
+    once, and the vintage is the hash of the ERP rows of every partition, so the flags (and saved
+    models) are those of checks.perform_ml_anomaly_detection.
+
+    input: connection or DataSession, contamination, partition level, forecast vintage (default:
+           a hash of the data), model directory (None to never save), parallel jobs
+    output: DataFrame of [Code, Region Type, Description, Magnitude (anomaly score)]
+    """
+    try:
+        logging.info("Performing partitioned machine learning anomaly detection...")
+        from anomaly_model import region_features, row_hashes, score_regions, data_vintage
+
+        session = _as_session(conn)
+        # ERP_ML.sql only reads the regions of the 2021 edition
+        years = run_years(session, edition=2021)
+        features, negative, hashes = [], [], []
+        for partition, members in partition_sessions(session, level):
+            erp = partition.fetch("ERP_ML.sql")
+            hierarchy = partition.fetch("Area_hierarchy.sql")
+            if erp is None or hierarchy is None:
+                raise RuntimeError(f"The data of partition {partition.scope} could not be fetched")
+            if erp.empty:
+                continue
+            # the features of a region can read its parent, only the regions of the partition are kept
+            partition_features = region_features(erp, hierarchy, years)
+            features.append(partition_features[partition_features.index.isin(members)])
+            erp = erp[erp['ASGSCode'].isin(members)]
+            negative.append(erp.loc[erp['Total'] < 0, 'ASGSCode'].unique())
+            if vintage is None:
+                hashes.append(row_hashes(erp))
+
+        if not features:
+            flagged = pd.DataFrame(columns=['ASGSCode', 'RegionType', 'Score'])
+        else:
+            features = pd.concat(features).sort_index(kind='stable')
+            vintage = data_vintage(None, pd.concat(hashes, ignore_index=True)) if vintage is None else vintage
+            flagged = score_regions(features, np.concatenate(negative), contamination_, vintage, model_dir, n_jobs)
+        result_df = pd.DataFrame({'Code': flagged['ASGSCode'], 'Region Type': flagged['RegionType'],
+                                  'Description': 'Machine Learning Anomaly Detected', 'Magnitude': flagged['Score']})
+        return result_df.drop_duplicates(subset='Code').reset_index(drop=True)
+
+    except Exception as e:
+        logging.error(f"Error performing partitioned machine learning anomaly detection: {e}")
+        return pd.DataFrame(columns=OUTPUT_COLUMNS)
@@ -0,0 +1,173 @@
+"""
+This file contains the cross-metric ratio engine.
+A ratio divides one forecast metric by another (see forecast_matrix.py), region by region and year
+by year: the ERP per household, the births and deaths per person (crude birth and death rates), or
+the yearly growth of the households against the growth of the population. The matrices of the
+metrics the ratios read are aligned once on their common regions and years, every ratio is computed
+in float64 in one vectorized pass, and for every region a ratio leaves its bounds the earliest
+abnormal year, the number of abnormal years, the peak value and the peak as a multiple of the bound
+it crosses (comparable between ratios of different scales) are reported.
+The SQL side only fetches per-code yearly totals, the ratios are never computed in the database.
+"""
+import numpy as np
+import pandas as pd
+
+
+class Ratio:
+    """
+    The purpose of this class is to declare one ratio of two metrics.
+
+    label: name of the ratio in the descriptions of the flags
+    numerator, denominator: metrics of the ratio (see forecast_matrix.MATRIX_SOURCES)
+    growth: True to divide the yearly growth factors (value / value of the previous year) of the
+            metrics instead of their values
+    upper, lower: default bounds, a value >= upper or <= lower is abnormal
+    digits: decimals of the peak value in the descriptions
+    """
+
+    def __init__(self, label, numerator, denominator, growth=False, upper=np.inf, lower=-np.inf, digits=2):
+        self.label = label
+        self.numerator = numerator
+        self.denominator = denominator
+        self.growth = growth
+        self.upper = upper
+        self.lower = lower
+        self.digits = digits
+
+
+# key of the ratio -> ratio. The household size bounds are the ratio_upper / ratio_lower parameters
+# (see parameters.py), the other bounds are wide enough for small regions with few births or deaths.
+RATIOS = {
+    'household_size': Ratio("ERP/household ratio", 'ERP', 'Households', upper=5, lower=1),
+    'birth_rate': Ratio("crude birth rate (births per person)", 'Births', 'ERP', upper=0.05, lower=0.001, digits=4),
+    'death_rate': Ratio("crude death rate (deaths per person)", 'Deaths', 'ERP', upper=0.05, digits=4),
+    'household_growth': Ratio("household growth/population growth ratio", 'Households', 'ERP', growth=True,
+                              upper=1.1, lower=0.9, digits=3),
+}
+
+# ratios of the ratio check, the household size has its own check (checks.household_check)
+RATIO_CHECKS = ['birth_rate', 'death_rate', 'household_growth']
+
+OUTPUT_COLUMNS = ['Ratio', 'Code', 'Year', 'Abnormal Years', 'Peak', 'Excess']
+
+
+def metrics_of(ratios):
+    """
+    output: list of the metrics read by a list of ratio keys, in the order they are first used
+    """
+    metrics = []
+    for key in ratios:
+        for metric in (RATIOS[key].numerator, RATIOS[key].denominator):
+            if metric not in metrics:
+                metrics.append(metric)
+    return metrics
+
+
+def align(matrices, codes=None, index=None, sa4_code=None):
+    """
+    The purpose of this function is to put forecast matrices on the same regions and years: the
+    regions and years every matrix has, limited to some codes or to the codes under an SA4 if given.
+    The regions under the SA4 are found by their ancestors in the hierarchy index, FA codes do not
+    start with the code of their SA4.
+
+    input: dictionary of metric -> ForecastMatrix, optional list of region codes, HierarchyIndex and
+           SA4 code (None for every SA4)
+    output: sorted int64 codes, sorted years, dictionary of metric -> float64 year x region array
+    """
+    matrices = list(matrices.items())
+    common_codes = matrices[0][1].codes
+    common_years = matrices[0][1].years
+    for _, matrix in matrices[1:]:
+        common_codes = np.intersect1d(common_codes, matrix.codes)
+        common_years = np.intersect1d(common_years, matrix.years)
+    if codes is not None:
+        common_codes = np.intersect1d(common_codes, np.asarray(codes, dtype='int64'))
+    if sa4_code is not None:
+        common_codes = common_codes[index.within(common_codes, [int(float(sa4_code))])]
+
+    aligned = {}
+    for metric, matrix in matrices:
+        rows = np.searchsorted(matrix.years, common_years)
+        columns = matrix.lookup.get_indexer(common_codes)
+        aligned[metric] = matrix.values[np.ix_(rows, columns)].astype('float64')
+    return common_codes, common_years, aligned
+
+
+def _growth(values):
+    growth = np.full(values.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth[1:] = values[1:] / values[:-1]
+    growth[1:][values[:-1] == 0] = np.nan
+    return growth
+
+
+def ratio_values(ratio, aligned):
+    """
+    The purpose of this function is to compute a ratio on aligned metrics. A zero denominator (or a
+    zero value of the previous year for a growth ratio) gives no value rather than an infinity.
+
+    input: Ratio, dictionary of metric -> aligned float64 year x region array
+    output: float64 year x region array, NaN where the ratio has no value
+    """
+    numerator, denominator = aligned[ratio.numerator], aligned[ratio.denominator]
+    if ratio.growth:
+        numerator, denominator = _growth(numerator), _growth(denominator)
+    values = np.full(numerator.shape, np.nan)
+    np.divide(numerator, denominator, out=values, where=denominator != 0)
+    return values
+
+
+def evaluate_ratios(matrices, ratios=None, bounds=None, codes=None, index=None, sa4_code=None):
+    """
+    The purpose of this function is to check ratios of forecast metrics against their bounds in one
+    pass: the ratios are stacked in a ratio x year x region array and compared with the bounds at
+    once. The peak of a region is the value furthest outside the bounds, measured as a multiple of
+    the bound it crosses (value / upper above the bounds, lower / value below them, infinite for a
+    value of zero or below under the lower bound).
+
+    input: dictionary of metric -> ForecastMatrix holding every metric of the ratios, list of ratio
+           keys (default: every ratio), optional dictionary of ratio key -> (upper, lower) replacing
+           the default bounds, optional list of region codes, HierarchyIndex and SA4 code (None for
+           every SA4)
+    output: DataFrame of [Ratio, Code, Year (earliest abnormal year), Abnormal Years, Peak, Excess
+            (peak as a multiple of its bound)] with one row per ratio and abnormal region, ordered by
+            ratio and code
+    """
+    ratios = list(RATIOS) if ratios is None else list(ratios)
+    bounds = bounds or {}
+    region_codes, years, aligned = align({metric: matrices[metric] for metric in metrics_of(ratios)}, codes, index,
+                                        sa4_code)
+
+    values = np.stack([ratio_values(RATIOS[key], aligned) for key in ratios]) if ratios \
+        else np.empty((0, len(years), len(region_codes)))
+    upper = np.array([bounds.get(key, (RATIOS[key].upper, RATIOS[key].lower))[0] for key in ratios], dtype='float64')
+    lower = np.array([bounds.get(key, (RATIOS[key].upper, RATIOS[key].lower))[1] for key in ratios], dtype='float64')
+    upper, lower = upper[:, None, None], lower[:, None, None]
+
+    above = values >= upper
+    abnormal = above | (values <= lower)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        excess = np.where(above, values / upper, np.where(values > 0, lower / values, np.inf))
+    excess = np.where(abnormal, excess, -np.inf)
+
+    ratio_positions, region_positions = np.nonzero(abnormal.any(axis=1))
+    earliest = abnormal.argmax(axis=1)[ratio_positions, region_positions]
+    peak = excess.argmax(axis=1)[ratio_positions, region_positions]
+    return pd.DataFrame({
+        'Ratio': np.asarray(ratios, dtype=object)[ratio_positions],
+        'Code': region_codes[region_positions],
+        'Year': years[earliest].astype('int64'),
+        'Abnormal Years': abnormal.sum(axis=1)[ratio_positions, region_positions],
+        'Peak': values[ratio_positions, peak, region_positions],
+        'Excess': excess[ratio_positions, peak, region_positions],
+    }, columns=OUTPUT_COLUMNS)
+
+
+def describe(flags):
+    """
+    output: description of every row of the output of evaluate_ratios
+    """
+    labels = flags['Ratio'].map({key: ratio.label for key, ratio in RATIOS.items()})
+    peaks = [str(round(float(peak), RATIOS[key].digits)) for key, peak in zip(flags['Ratio'], flags['Peak'])]
+    return ("Found abnormal " + labels + ", Earliest abnormal year is: " + flags['Year'].astype(str)
+            + ", abnormal in " + flags['Abnormal Years'].astype(str) + " years, peak ratio " + pd.Series(peaks, index=flags.index))
@@ -0,0 +1,84 @@
+"""
+This file contains the region scope of a run.
+A scope is a list of region codes (states, SA4s, SA3s or SA2s). A region is in scope when it is
+one of the scope codes or below one of them by the Parent links of AreasAsgs: the codes of the FAs
+do not start with the code of their SA2, so the digits of a code are not enough. Every SQL file
+marks where the scope filter goes with
+
+    /* region_scope: <code column> */ 1 = 1
+
+which is a no-op when the file is run as is, and which the data session replaces with a filter on
+that column, so a partial run only reads the rows of the regions it checks.
+A scope can also hold exact region codes of any type without the regions below them (e.g. the
+regions an incremental run re-checks).
+"""
+import re
+
+import numpy as np
+
+
+SCOPE_MARKER = re.compile(r'/\*\s*region_scope:\s*([\w\.\[\]"]+)\s*\*/\s*1\s*=\s*1')
+
+# number of digits of the codes of the regions a scope can hold (the FAs are not scope regions)
+CODE_LENGTHS = {1: 'state', 3: 'SA4', 5: 'SA3', 9: 'SA2'}
+
+# levels below a region of each type down to the FAs
+LEVELS_BELOW = {'state': 4, 'SA4': 3, 'SA3': 2, 'SA2': 1}
+
+
+class RegionScope:
+    """
+    The purpose of this class is to limit a run to some regions and everything below them.
+
+    input: list of state, SA4, SA3 or SA2 codes (e.g. [4] for a state, [401, 402] for two SA4s),
+           False to limit the run to exactly these regions (codes of any region type)
+    """
+
+    def __init__(self, codes, descendants=True):
+        self.codes = sorted({str(int(float(code))) for code in codes}, key=int)
+        self.descendants = descendants
+        if not self.codes:
+            raise ValueError("A region scope needs at least one code")
+        for code in self.codes:
+            if descendants and len(code) not in CODE_LENGTHS:
+                raise ValueError(f"{code} is not a state, SA4, SA3 or SA2 code")
+
+    def __repr__(self):
+        if not self.descendants:
+            return f"RegionScope({len(self.codes)} regions)"
+        return f"RegionScope({', '.join(self.codes)})"
+
+    def contains(self, codes, index):
+        """
+        output: boolean array, True for the codes in the scope (found below the scope codes by the
+                parent links of a HierarchyIndex)
+        """
+        scope_codes = [int(code) for code in self.codes]
+        if not self.descendants:
+            return np.isin(np.asarray(codes, dtype='int64'), scope_codes)
+        return index.within(codes, scope_codes)
+
+    def predicate(self, column):
+        """
+        The purpose of this function is to write the SQL filter of the scope on a code column.
+        The regions one level below the scope are the AreasAsgs rows whose Parent is a scope code,
+        the regions two levels below are those whose Parent is one of these, and so on down to the
+        FAs, every level being an IN on the indexed Parent column.
+
+        input: name of the code column in the query
+        output: SQL condition
+        """
+        regions = ', '.join(self.codes)
+        if not self.descendants:
+            return f"{column} IN ({regions})"
+        conditions = [f"{column} IN ({regions})"]
+        for _ in range(max(LEVELS_BELOW[CODE_LENGTHS[len(code)]] for code in self.codes)):
+            regions = f"SELECT ASGSCode FROM dbo.AreasAsgs WHERE Parent IN ({regions})"
+            conditions.append(f"{column} IN ({regions})")
+        return "(" + " OR ".join(conditions) + ")"
+
+    def apply(self, sql_query):
+        """
+        output: the SQL query with every region scope marker replaced by the filter of the scope
+        """
+        return SCOPE_MARKER.sub(lambda match: self.predicate(match.group(1)), sql_query)
@@ -0,0 +1,141 @@
+"""
+This file contains the check registry.
+Every check is declared by name with the function that runs it, the datasets it reads, the
+parameters it takes and the heavy modules it needs. Nothing is imported until a check is
+selected, so a run of a few cheap checks does not pay for sklearn or the ML model.
+"""
+import importlib
+import logging
+
+from data_session import FORECAST_MATRIX, HIERARCHY_INDEX, ROLLUP_SUMS
+
+
+class CheckSpec:
+    """
+    The purpose of this class is to declare one check of the registry.
+
+    name: name of the check in the log, the output and the incremental state
+    function: 'module:function' of the check
+    datasets: SQL files (or (SQL file, params) tuples) the check reads through the session, or a
+              function of the check arguments returning them for parameterized queries, plus
+              HIERARCHY_INDEX for the checks using the ASGS hierarchy index,
+              (FORECAST_MATRIX, (metric,)) for those reading a forecast matrix and ROLLUP_SUMS for
+              those reading the shared rollup of the region level sum checks
+    arguments: dictionary of check argument -> parameter name (see parameters.py)
+    requires: modules the check imports when it runs, loaded when the check is selected
+    kind, incremental: see scheduler.CheckTask
+    details: optional columns of the check output kept by the result store (Year, Magnitude, Detail)
+    partitioned: 'module:function' of the partitioned mode of the check (see partitioned.py), which
+                 fetches its own data one partition at a time
+    """
+
+    def __init__(self, name, function, datasets, arguments=None, requires=(), kind='io', incremental=False,
+                 details=(), partitioned=None):
+        self.name = name
+        self.function = function
+        self.datasets = datasets if callable(datasets) else list(datasets)
+        self.arguments = dict(arguments or {})
+        self.requires = tuple(requires)
+        self.kind = kind
+        self.incremental = incremental
+        self.details = tuple(details)
+        self.partitioned = partitioned
+
+    def load(self, partitioned=False):
+        """
+        output: the check function (or the function of its partitioned mode), after importing its
+                module and its heavy dependencies
+        """
+        for module in self.requires:
+            importlib.import_module(module)
+        module, function = (self.partitioned if partitioned else self.function).split(':')
+        return getattr(importlib.import_module(module), function)
+
+    def datasets_for(self, kwargs):
+        """
+        output: the datasets the check reads when called with these arguments
+        """
+        return list(self.datasets(**kwargs)) if callable(self.datasets) else self.datasets
+
+
+def sum_check_data(sa4_code=None):
+    # the four region level sum checks share one rollup of every metric (see DataSession.rollup_sums)
+    return [ROLLUP_SUMS if sa4_code is None else (ROLLUP_SUMS, (int(float(sa4_code)),))]
+
+
+ERP_DATA = [(FORECAST_MATRIX, ('ERP',)), HIERARCHY_INDEX]
+RULE_DATA = ["Negative_Sanity_ML_Check.sql", HIERARCHY_INDEX]
+def ratio_data(metrics):
+    def datasets(sa4_code=None, **bounds):
+        # with an SA4 code the matrices only hold the regions of the SA4 (see DataSession.forecast_matrix)
+        sa4 = () if sa4_code is None else (int(float(sa4_code)),)
+        return [(FORECAST_MATRIX, (metric,) + sa4) for metric in metrics] + [HIERARCHY_INDEX]
+    return datasets
+
+
+HOUSEHOLD_RATIO_DATA = ratio_data(['ERP', 'Households'])
+RATIO_DATA = ratio_data(['ERP', 'Births', 'Deaths', 'Households'])
+
+# key used on the command line -> check
+CHECKS = {
+    'household_ratio': CheckSpec("household ratio check", "checks:household_check", HOUSEHOLD_RATIO_DATA,
+                                 {'ratio_upper': 'ratio_upper', 'ratio_lower': 'ratio_lower', 'sa4_code': 'sa4_code'},
+                                 incremental=True, details=['Year', 'Magnitude']),
+    'births': CheckSpec("births check", "checks:births_region_level_sum_check", sum_check_data,
+                        {'sa4_code': 'sa4_code'}, incremental=True, details=['Magnitude']),
+    'deaths': CheckSpec("deaths check", "checks:deaths_region_level_sum_check", sum_check_data,
+                        {'sa4_code': 'sa4_code'}, incremental=True, details=['Magnitude']),
+    'households': CheckSpec("household check", "checks:household_region_level_sum_check", sum_check_data,
+                            {'sa4_code': 'sa4_code'}, incremental=True, details=['Magnitude']),
+    'population': CheckSpec("population check", "checks:population_region_level_sum_check", sum_check_data,
+                            {'sa4_code': 'sa4_code'}, incremental=True, details=['Magnitude']),
+    'negative': CheckSpec("negative check", "checks:perform_negative_check", RULE_DATA, incremental=True,
+                          details=['Detail']),
+    'sanity': CheckSpec("sanity check", "checks:perform_sanity_check", RULE_DATA, details=['Detail']),
+    'ml': CheckSpec("ML anomaly check", "checks:perform_ml_anomaly_detection", ["ERP_ML.sql", "Area_hierarchy.sql"],
+                    {'contamination_': 'contamination', 'vintage': 'vintage'}, requires=['anomaly_model', 'sklearn.ensemble'], kind='cpu',
+                    details=['Magnitude'], partitioned="partitioned:ml_anomaly_detection"),
+    'spike': CheckSpec("spike check", "checks:spike_check", ERP_DATA,
+                       {'sensitivity': 'sensitivity', 'multiplier': 'multiplier'}, kind='cpu', incremental=True,
+                       details=['Year', 'Magnitude'], partitioned="partitioned:spike_check"),
+    'shape': CheckSpec("shape check", "checks:trend_shape_check", ERP_DATA,
+                       {'sensitivity': 'sensitivity'}, kind='cpu', incremental=True,
+                       details=['Year', 'Detail'], partitioned="partitioned:trend_shape_check"),
+    'pattern': CheckSpec("pattern check", "checks:pattern_check", ERP_DATA, kind='cpu', incremental=True,
+                         details=['Detail'], partitioned="partitioned:pattern_check"),
+    'ratios': CheckSpec("ratio check", "checks:ratio_check", RATIO_DATA, {'sa4_code': 'sa4_code'}, incremental=True,
+                        details=['Year', 'Magnitude', 'Detail']),
+}
+
+
+def build_tasks(parameters, selected=None, partition_level=None):
+    """
+    The purpose of this function is to create the scheduler tasks of the selected checks,
+    loading only the modules those checks need
+
+    input: dictionary of parameters (see parameters.py), list of check keys (default: every check),
+           optional partition level ('STE', 'SA4' or 'SA3') running the checks that have a
+           partitioned mode one partition at a time
+    output: list of CheckTask
+    """
+    from scheduler import CheckTask
+
+    selected = list(CHECKS) if selected is None else selected
+    unknown = [key for key in selected if key not in CHECKS]
+    if unknown:
+        raise ValueError(f"Unknown checks: {', '.join(unknown)} (known checks: {', '.join(CHECKS)})")
+
+    tasks = []
+    for key in selected:
+        spec = CHECKS[key]
+        kwargs = {argument: parameters[parameter] for argument, parameter in spec.arguments.items()}
+        if partition_level is not None and spec.partitioned:
+            # the partitions are fetched by the check itself, which needs the database connection
+            # of the run, so it runs on a thread
+            tasks.append(CheckTask(spec.name, spec.load(partitioned=True), [HIERARCHY_INDEX], kind='io',
+                                   incremental=spec.incremental, level=partition_level, **kwargs))
+        else:
+            tasks.append(CheckTask(spec.name, spec.load(), spec.datasets_for(kwargs), kind=spec.kind,
+                                   incremental=spec.incremental, **kwargs))
+        logging.info(f"Loaded {spec.name}")
+    return tasks
@@ -0,0 +1,184 @@
+"""
+This file contains the result store of a run.
+Every check returns one row per flag (Code | Region Type | Description, plus the optional Year,
+Magnitude and Detail columns declared in registry.py). The store consolidates them into one row
+per flagged region with:
+
+    Flags                 bitmask of the failed checks, bit i is the i-th check of registry.CHECKS
+    Description           descriptions of every flag of the region, in the order of the checks
+    <check>               True if the region failed the check
+    <check>_year          earliest year of the flag
+    <check>_magnitude     size of the flag (ratio, difference, growth rate or anomaly score)
+    <check>_detail        short text of the flag (e.g. the abnormal shape)
+
+Codes, region types and details are categoricals, and the table is written in chunks to csv and
+Parquet, so national outputs stay small and load quickly.
+"""
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+from registry import CHECKS
+
+
+# check name in the results of a run -> key of the check in the registry
+CHECK_KEYS = {spec.name: key for key, spec in CHECKS.items()}
+FLAG_BITS = {key: 1 << position for position, key in enumerate(CHECKS)}
+CHECK_ORDER = {key: position for position, key in enumerate(CHECKS)}
+DETAIL_DTYPES = {'Year': 'Int16', 'Magnitude': 'float32', 'Detail': 'category'}
+CHUNK_ROWS = 100_000
+
+
+def code_text(codes):
+    """
+    output: region codes as text, without the '.0' of codes read as floats
+    """
+    codes = pd.Series(codes).reset_index(drop=True)
+    numbers = pd.to_numeric(codes, errors='coerce')
+    whole = (numbers.notna() & (numbers == numbers.round())).to_numpy()
+    text = codes.astype(str).str.strip().to_numpy(dtype=object)
+    text[whole] = numbers[whole].astype('int64').astype(str).to_numpy()
+    return text
+
+
+def decode_flags(flags):
+    """
+    output: the check keys set in a Flags bitmask
+    """
+    return [key for key, bit in FLAG_BITS.items() if int(flags) & bit]
+
+
+class ResultStore:
+    """
+    The purpose of this class is to collect the outputs of the checks of a run and consolidate
+    them into one row per flagged region.
+    """
+
+    def __init__(self):
+        self.frames = []
+
+    def add(self, name, output):
+        """
+        The purpose of this function is to add the output of one check. An output with a Check
+        column (e.g. the SA4 checks of a batch) holds the flags of several checks.
+
+        input: name or key of the check, check output (None if the check failed)
+        """
+        if output is None or output.empty:
+            return
+        if 'Check' in output.columns:
+            checks = output['Check'].astype(str).map(lambda check: CHECK_KEYS.get(check, check)).to_numpy()
+        else:
+            checks = np.full(len(output), CHECK_KEYS.get(name, name), dtype=object)
+        unknown = set(checks) - set(CHECKS)
+        if unknown:
+            logging.warning(f"Flags of unknown checks not stored: {', '.join(sorted(unknown))}")
+        known = np.isin(checks, list(CHECKS))
+        if not known.any():
+            return
+        output = output[known]
+        self.frames.append(pd.DataFrame({
+            'Code': code_text(output['Code']),
+            'Region Type': output['Region Type'].astype(str).str.strip().to_numpy(),
+            'Check': checks[known],
+            'Description': output['Description'].to_numpy(dtype=object) if 'Description' in output else None,
+            'Year': pd.to_numeric(output['Year'], errors='coerce').to_numpy() if 'Year' in output else np.nan,
+            'Magnitude': pd.to_numeric(output['Magnitude'], errors='coerce').to_numpy() if 'Magnitude' in output else np.nan,
+            'Detail': output['Detail'].to_numpy(dtype=object) if 'Detail' in output else None,
+        }))
+
+    def columns(self):
+        """
+        output: dictionary of column -> dtype of the consolidated table, the same for every run
+        """
+        columns = {'Code': 'category', 'Region Type': 'category', 'Flags': 'uint32', 'Description': 'object'}
+        for key, spec in CHECKS.items():
+            columns[key] = 'bool'
+            for detail in spec.details:
+                columns[f"{key}_{detail.lower()}"] = DETAIL_DTYPES[detail]
+        return columns
+
+    def table(self):
+        """
+        The purpose of this function is to consolidate the flags into one row per region. A check
+        that flags a region more than once keeps the earliest year, the magnitude with the largest
+        absolute value and every distinct detail, and the description of a region joins the
+        distinct descriptions of its flags with '; '.
+
+        output: DataFrame with the columns of columns(), sorted by region type and code
+        """
+        columns = self.columns()
+        if not self.frames:
+            return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in columns.items()})
+        flags = pd.concat(self.frames, ignore_index=True)
+
+        regions = flags.loc[flags['Region Type'] != '', ['Code', 'Region Type']].drop_duplicates('Code')
+        codes = pd.Index(flags['Code'].unique(), name='Code')
+        table = pd.DataFrame(index=codes)
+        table['Region Type'] = regions.set_index('Code')['Region Type'].reindex(codes).fillna('')
+
+        per_check = flags.groupby(['Code', 'Check'])
+        failed = per_check.size().index.to_frame(index=False)
+        bits = failed['Check'].map(FLAG_BITS).astype('uint32')
+        table['Flags'] = bits.groupby(failed['Code']).sum().reindex(codes).astype('uint32')
+        descriptions = flags.dropna(subset=['Description']).drop_duplicates(['Code', 'Description'])
+        descriptions = descriptions.iloc[np.argsort(descriptions['Check'].map(CHECK_ORDER).to_numpy(), kind='stable')]
+        table['Description'] = descriptions.groupby('Code')['Description'].agg('; '.join).reindex(codes)
+
+        years = per_check['Year'].min()
+        magnitude = flags.assign(size=flags['Magnitude'].abs()).sort_values('size', ascending=False, na_position='last') \
+            .drop_duplicates(['Code', 'Check']).set_index(['Code', 'Check'])['Magnitude']
+        details = flags.dropna(subset=['Detail']).drop_duplicates(['Code', 'Check', 'Detail']).sort_values('Detail') \
+            .groupby(['Code', 'Check'])['Detail'].agg(', '.join)
+        for key, spec in CHECKS.items():
+            in_check = failed.loc[failed['Check'] == key, 'Code']
+            table[key] = codes.isin(in_check)
+            for detail, values in [('Year', years), ('Magnitude', magnitude), ('Detail', details)]:
+                if detail in spec.details:
+                    check_values = values.xs(key, level='Check') if key in values.index.get_level_values('Check') else None
+                    if check_values is None:
+                        # an empty column, object dtype so an empty Detail is still a text categorical
+                        check_values = pd.Series(None, index=[], dtype=object)
+                    table[f"{key}_{detail.lower()}"] = check_values.reindex(codes)
+
+        table = table.reset_index()
+        table = table.sort_values(['Region Type', 'Code'], ascending=[False, True], ignore_index=True)
+        return table[list(columns)].astype(columns)
+
+    def write(self, csv_path, parquet_path=None, chunk_rows=CHUNK_ROWS):
+        """
+        The purpose of this function is to write the consolidated table to csv and Parquet, a
+        chunk of rows at a time. Parquet needs pyarrow, without it only the csv file is written.
+
+        input: path of the csv file, path of the Parquet file (None to not write one), rows per chunk
+        output: consolidated DataFrame
+        """
+        table = self.table()
+        writer = None
+        if parquet_path:
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                schema = pa.Schema.from_pandas(table, preserve_index=False)
+                # categoricals are dictionaries of text, also when a column has no values at all
+                for column in table.columns[table.dtypes == 'category']:
+                    index = schema.get_field_index(column)
+                    schema = schema.set(index, pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+                schema = schema.with_metadata({**(schema.metadata or {}), b'flag_bits': json.dumps(FLAG_BITS).encode()})
+                writer = pq.ParquetWriter(parquet_path, schema)
+            except ImportError:
+                logging.warning("pyarrow is not installed, the Parquet output is not written")
+
+        try:
+            for start in range(0, max(len(table), 1), chunk_rows):
+                chunk = table.iloc[start:start + chunk_rows]
+                chunk.to_csv(csv_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+                if writer is not None:
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False))
+        finally:
+            if writer is not None:
+                writer.close()
+        logging.info(f"Wrote {len(table)} flagged regions to {csv_path}" + (f" and {parquet_path}" if writer else ""))
+        return table
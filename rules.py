@@ -0,0 +1,179 @@
+"""
+This file contains the threshold rule engine of the negative and sanity checks.
+A rule is declared as (table, column, predicate, description): the rows of the table for which the
+predicate holds are flagged, e.g. births totals below -10. Every rule of a table is evaluated in
+one vectorized pass over the fetched data, sharing the masks of the rules that test the same
+thing, so adding a rule costs no extra scan of the data. Comparison and null rules can also be
+pushed down to SQL, so only the rows failing a rule are fetched.
+"""
+import operator
+
+import numpy as np
+import pandas as pd
+
+
+COMPARISONS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+               '==': operator.eq, '!=': operator.ne}
+SQL_OPERATORS = {'==': '=', '!=': '<>'}
+
+# region types the rules are checked for, in the order they are reported
+RULE_REGION_TYPES = ['FA', 'SA2']
+
+
+class Rule:
+    """
+    The purpose of this class is to declare one rule.
+
+    check: key of the check reporting the rule (see registry.py)
+    table: SQL file of the data the rule reads
+    column: column the predicate applies to, None for every column ('null' and 'duplicate' only)
+    predicate: (operator, value) with an operator of COMPARISONS, ('null',) or ('duplicate',)
+    description: description of the flag
+    where: dictionary of column -> value limiting the rule to some rows
+    detail: short text of the flag kept by the result store
+    per_region: True to flag every region failing the rule, False to flag the region type once
+                (reported with the code 'All')
+    """
+
+    def __init__(self, check, table, column, predicate, description, where=None, detail=None, per_region=True):
+        self.check = check
+        self.table = table
+        self.column = column
+        self.predicate = tuple(predicate)
+        self.description = description
+        self.where = dict(where or {})
+        self.detail = detail
+        self.per_region = per_region
+        if self.predicate[0] not in COMPARISONS and self.predicate[0] not in ('null', 'duplicate'):
+            raise ValueError(f"Unknown rule predicate {self.predicate[0]!r}")
+
+    def __repr__(self):
+        return f"Rule({self.check}: {self.description})"
+
+    def mask(self, df, masks):
+        """
+        The purpose of this function is to find the rows failing the rule
+
+        input: DataFrame of the rule table, dictionary of masks already computed in this pass
+        output: boolean array, True for the rows failing the rule
+        """
+        result = self._predicate_mask(df, masks)
+        for column, value in self.where.items():
+            result = result & _cached(masks, ('==', column, value), lambda: (df[column] == value).to_numpy(dtype=bool))
+        return result
+
+    def _predicate_mask(self, df, masks):
+        kind = self.predicate[0]
+        if kind == 'duplicate':
+            columns = None if self.column is None else [self.column]
+            return _cached(masks, ('duplicate', self.column), lambda: df.duplicated(subset=columns).to_numpy())
+        if kind == 'null':
+            if self.column is None:
+                return _cached(masks, ('null', None), lambda: df.isnull().any(axis=1).to_numpy())
+            return _cached(masks, ('null', self.column), lambda: df[self.column].isnull().to_numpy())
+        compare = COMPARISONS[kind]
+        value = self.predicate[1]
+        # comparisons with a missing value are False, as in SQL
+        return _cached(masks, (kind, self.column, value), lambda: compare(df[self.column], value).to_numpy(dtype=bool))
+
+    def sql(self):
+        """
+        output: (SQL condition, parameters) selecting the rows failing the rule, None if the rule
+                cannot be pushed down (duplicates, or nulls in any column)
+        """
+        kind = self.predicate[0]
+        if kind == 'duplicate' or self.column is None:
+            return None
+        if kind == 'null':
+            conditions, params = [f"{self.column} IS NULL"], []
+        else:
+            conditions, params = [f"{self.column} {SQL_OPERATORS.get(kind, kind)} ?"], [self.predicate[1]]
+        for column, value in self.where.items():
+            conditions.append(f"{column} = ?")
+            params.append(value)
+        return " AND ".join(conditions), params
+
+
+def _cached(masks, key, compute):
+    if key not in masks:
+        masks[key] = compute()
+    return masks[key]
+
+
+NEGATIVE_SANITY_TABLE = "Negative_Sanity_ML_Check.sql"
+
+RULES = [
+    Rule('negative', NEGATIVE_SANITY_TABLE, 'Total', ('<', -10), 'Negative Births Values Found',
+         where={'DataType': 'Births'}, detail='Births'),
+    Rule('negative', NEGATIVE_SANITY_TABLE, 'Total', ('<', -10), 'Negative Deaths Values Found',
+         where={'DataType': 'Deaths'}, detail='Deaths'),
+    Rule('negative', NEGATIVE_SANITY_TABLE, 'Total', ('<', -10), 'Negative ERP Values Found',
+         where={'DataType': 'ERP'}, detail='ERP'),
+    Rule('sanity', NEGATIVE_SANITY_TABLE, None, ('null',), 'Missing Values Detected',
+         detail='Missing values', per_region=False),
+    Rule('sanity', NEGATIVE_SANITY_TABLE, None, ('duplicate',), 'Duplicate Records Found',
+         detail='Duplicate records'),
+]
+
+
+def rules_for(check):
+    """
+    output: dictionary of table -> rules of a check, in the order they are declared
+    """
+    tables = {}
+    for rule in RULES:
+        if rule.check == check:
+            tables.setdefault(rule.table, []).append(rule)
+    return tables
+
+
+def pushdown_filter(rules):
+    """
+    The purpose of this function is to combine the rules of a table into one SQL condition which
+    keeps the rows failing any of them
+
+    input: list of Rule of one table
+    output: (SQL condition, parameters), None if any rule cannot be pushed down
+    """
+    conditions = [rule.sql() for rule in rules]
+    if not conditions or any(condition is None for condition in conditions):
+        return None
+    return (" OR ".join(f"({condition})" for condition, _ in conditions),
+            [param for _, params in conditions for param in params])
+
+
+def evaluate_rules(df, rules, code_column='ASGSCode', type_column='RegionType', region_types=RULE_REGION_TYPES):
+    """
+    The purpose of this function is to evaluate every rule of a table in one pass over its data
+
+    input: DataFrame of the table, list of Rule of that table, code and region type columns,
+           region types to check
+    output: DataFrame of [Code, Region Type, Description, Detail], one row per region and failed
+            rule, ordered by region type and then by rule
+    """
+    columns = ['Code', 'Region Type', 'Description', 'Detail']
+    if df is None or df.empty or not rules:
+        return pd.DataFrame(columns=columns)
+    types = df[type_column]
+    if isinstance(types.dtype, pd.CategoricalDtype):
+        # only the categories need stripping
+        types = types.map(lambda region_type: str(region_type).strip()).to_numpy(dtype=object)
+    else:
+        types = types.astype(str).str.strip().to_numpy(dtype=object)
+    in_types = np.isin(types, region_types)
+    masks = {}
+    failed = np.column_stack([rule.mask(df, masks) & in_types for rule in rules])
+
+    # (rule, row) pairs in rule order, rows in the order of the data
+    rule_index, rows = np.nonzero(failed.T)
+    per_region = np.array([rule.per_region for rule in rules])[rule_index]
+    flags = pd.DataFrame({
+        'Code': np.where(per_region, df[code_column].to_numpy(dtype=object)[rows], 'All'),
+        'Region Type': types[rows],
+        'rule': rule_index,
+    }).drop_duplicates(['rule', 'Region Type', 'Code'])
+    flags['type_order'] = flags['Region Type'].map({region_type: order for order, region_type in enumerate(region_types)})
+    flags = flags.sort_values(['type_order', 'rule'], kind='stable')
+    flags['Description'] = [rules[index].description for index in flags['rule']]
+    flags['Detail'] = [rules[index].detail for index in flags['rule']]
+    return flags[columns].reset_index(drop=True)
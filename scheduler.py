@@ -0,0 +1,131 @@
+"""
+This file contains the check scheduler which runs independent checks concurrently.
+Datasets are fetched on a thread pool (each query borrows its own pooled connection from the
+database backend), query-light checks run on the same kind of thread pool and CPU-heavy checks
+run in a process pool, so the database and the CPU are busy at the same time.
+The queries of a dataset are timed while it is fetched and their time is shared between the checks
+reading the dataset, so the fetch time of a check covers the data it waited for. The rollup of every
+region is built once for all the rollup datasets and its time is shared between all their checks.
+"""
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from data_session import ROLLUP_SUMS
+from metrics import measure_check, query_time, reset_query_time
+
+
+class CheckTask:
+    """
+    The purpose of this class is to declare one check for the scheduler.
+
+    name: name used in the log and as the key of the result
+    func: check function, called as func(session, **kwargs)
+    datasets: SQL files (or (SQL file, params) tuples) the check reads through the session
+    kind: 'io' for checks that mostly wait on the database, 'cpu' for checks that crunch data
+    incremental: True if the check takes a codes argument limiting it to some regions
+    kwargs: extra arguments of the check function
+    """
+
+    def __init__(self, name, func, datasets, kind='io', incremental=False, **kwargs):
+        if kind not in ('io', 'cpu'):
+            raise ValueError(f"Unknown check kind: {kind}")
+        self.name = name
+        self.func = func
+        self.datasets = list(datasets)
+        self.kind = kind
+        self.incremental = incremental
+        self.kwargs = kwargs
+
+    def limited_to(self, codes):
+        """
+        output: a copy of this task that only checks the given region codes
+        """
+        return CheckTask(self.name, self.func, self.datasets, self.kind, self.incremental,
+                         **dict(self.kwargs, codes=codes))
+
+
+def _dataset_parts(dataset):
+    return dataset if isinstance(dataset, tuple) else (dataset, ())
+
+
+def _fetch_dataset(session, dataset):
+    """
+    The purpose of this function is to fetch one dataset into the session
+
+    output: seconds spent in queries to fetch it (0 if it was already in the session)
+    """
+    sql_file, params = _dataset_parts(dataset)
+    reset_query_time()
+    session.fetch(sql_file, params)
+    return query_time()
+
+
+def _call_check(func, session, kwargs):
+    return measure_check(func, session, **kwargs)
+
+
+def _reads_rollup(task):
+    return any(_dataset_parts(dataset)[0] == ROLLUP_SUMS for dataset in task.datasets)
+
+
+def _run_task(task, session, dataset_futures, readers, rollup_share, process_pool):
+    """
+    The purpose of this function is to wait for the datasets of a check and then run it,
+    in this thread for 'io' checks or in the process pool for 'cpu' checks. The query time of
+    the check is the time of the queries it ran itself and its fetch time is its share of the
+    query time of its datasets (split evenly between the checks reading a dataset), which the
+    check waited for before it started so it is added to its wall time too.
+
+    input: rollup_share, function returning the share of each check reading a rollup of the
+           time spent building the rollup of every region
+    """
+    fetch_time = 0.0
+    for dataset in task.datasets:
+        fetch_time += dataset_futures[dataset].result() / readers[dataset]
+    if _reads_rollup(task):
+        fetch_time += rollup_share()
+    logging.info(f"Try to execute {task.name}")
+    if task.kind == 'cpu':
+        result, measurements = process_pool.submit(_call_check, task.func, session.subset(task.datasets), task.kwargs).result()
+    else:
+        result, measurements = _call_check(task.func, session, task.kwargs)
+    measurements['fetch_s'] = round(fetch_time, 4)
+    measurements['wall_s'] = round(measurements['wall_s'] + fetch_time, 4)
+    logging.info(f"{task.name} done in {measurements['wall_s']:.2f} seconds")
+    if session.metrics is not None:
+        session.metrics.record('check', task.name, kind=task.kind, **measurements)
+    return result
+
+
+def run_checks(tasks, session, max_connections=4, max_processes=None):
+    """
+    The purpose of this function is to run a list of checks concurrently.
+    Every dataset is fetched once, as soon as the run starts, and each check starts as soon as
+    its own datasets are available. A failing check is logged and does not stop the others.
+
+    input: list of CheckTask, DataSession on a DatabaseBackend, number of concurrent queries
+           (at most the pool size of the backend), number of worker processes
+    output: dictionary of check name -> check output (None if the check failed)
+    """
+    readers = Counter(dataset for task in tasks for dataset in set(task.datasets))
+    datasets = set(readers)
+    rollup_readers = sum(_reads_rollup(task) for task in tasks)
+    rollup_start = session.rollup_query_s
+
+    def rollup_share():
+        return (session.rollup_query_s - rollup_start) / rollup_readers
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_connections) as fetch_pool, \
+            ThreadPoolExecutor(max_workers=max(len(tasks), 1)) as check_pool, \
+            ProcessPoolExecutor(max_workers=max_processes) as process_pool:
+        dataset_futures = {dataset: fetch_pool.submit(_fetch_dataset, session, dataset) for dataset in datasets}
+        check_futures = {task.name: check_pool.submit(_run_task, task, session, dataset_futures, readers, rollup_share,
+                                                      process_pool) for task in tasks}
+        for name, future in check_futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logging.error(f"{name} failed: {e}")
+                results[name] = None
+    return results
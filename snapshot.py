@@ -0,0 +1,284 @@
+"""
+This file contains the local snapshot of the forecast tables.
+The raw Births, Deaths, ERP, Households and AreasAsgs tables are exported once into Parquet files
+partitioned by SA4, and re-exported only when the table in the database has changed. The checks
+then run on the snapshot through SnapshotBackend (DuckDB views over the Parquet files), so repeat
+runs need no database connection.
+
+usage: python snapshot.py refresh <directory>    export the tables that changed since the last export
+       python snapshot.py status <directory>     list the tables that are out of date
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import time
+
+import pandas as pd
+
+from db_backend import DatabaseBackend, FORECASTS_SCHEMA, strip_schema_names
+
+
+# table -> (code column used for the SA4 partition, column summed as the change checksum, weight of
+# the weighted checksum). The weights are those of the WeightedTotal of Region_fingerprints.sql, so
+# moving a number between years, sexes, ages or household types changes the weighted checksum even
+# if the total stays the same; a region of AreasAsgs moved to another parent changes it too.
+SNAPSHOT_TABLES = {
+    'AreasAsgs': ('ASGSCode', 'Parent', "ASGSCode % 1000"),
+    'Births': ('ASGSCode', 'Number', "Year * 1000 + SexKey * 100 + AgeKey"),
+    'Deaths': ('ASGSCode', 'Number', "Year * 1000 + SexKey * 100 + AgeKey"),
+    'ERP': ('ASGS_2016', 'Number', "ERPYear * 1000 + SexKey * 100 + AgeKey"),
+    'Households': ('ASGSCode', 'Number', "ERPYear * 1000 + HhKey"),
+}
+
+STATE_CHECKSUMS = ['checksum', 'weighted_checksum']
+
+MANIFEST_FILE = "manifest.json"
+
+# partition of rows whose region is not below any SA4 (e.g. states)
+NO_SA4 = -1
+
+
+def _table_columns(table):
+    return [column.split()[0] for column in FORECASTS_SCHEMA[table].split(', ')]
+
+
+def _arrow_schema(table):
+    import pyarrow as pa
+    types = {'INTEGER': pa.int64(), 'REAL': pa.float64(), 'TEXT': pa.string()}
+    return pa.schema([(name, types[kind]) for name, kind in
+                      (column.split() for column in FORECASTS_SCHEMA[table].split(', '))])
+
+
+def _pandas_schema(table):
+    dtypes = {'INTEGER': 'Int64', 'REAL': 'float64', 'TEXT': 'object'}
+    return {name: dtypes[kind] for name, kind in (column.split() for column in FORECASTS_SCHEMA[table].split(', '))}
+
+
+def table_state(backend, table):
+    """
+    The purpose of this function is to summarise a table in the database cheaply, so a change in
+    the table can be detected without reading it
+
+    input: DatabaseBackend, table name
+    output: dictionary with row_count, max_code, checksum (sum of the checksum column) and
+            weighted_checksum (sum of the checksum column weighted by its keys)
+    """
+    code_column, checksum_column, weight = SNAPSHOT_TABLES[table]
+    sql = (f"SELECT COUNT(*) AS row_count, MAX({code_column}) AS max_code, "
+           f"SUM(CAST({checksum_column} AS FLOAT)) AS checksum, "
+           f"SUM(CAST({checksum_column} AS FLOAT) * ({weight})) AS weighted_checksum FROM dbo.{table}")
+    state = backend.read_query(sql).iloc[0]
+    return {key: None if pd.isna(value) else (float(value) if key in STATE_CHECKSUMS else int(value))
+            for key, value in state.items()}
+
+
+def read_manifest(directory):
+    """
+    output: the manifest of the snapshot in directory (empty if there is no snapshot yet)
+    """
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'tables': {}}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def _same_state(old, new):
+    if old is None:
+        return False
+    if old['row_count'] != new['row_count'] or old['max_code'] != new['max_code']:
+        return False
+    for key in STATE_CHECKSUMS:
+        # snapshots exported before the weighted checksum existed are out of date
+        if key not in old:
+            return False
+        if old[key] is None or new[key] is None:
+            if old[key] != new[key]:
+                return False
+        # the server may sum floats in a different order between runs
+        elif not math.isclose(old[key], new[key], rel_tol=1e-12, abs_tol=1e-6):
+            return False
+    return True
+
+
+def stale_tables(backend, directory):
+    """
+    The purpose of this function is to find the tables whose snapshot no longer matches the database
+
+    input: DatabaseBackend, snapshot directory
+    output: dictionary of stale table name -> current state of the table in the database
+    """
+    manifest = read_manifest(directory)
+    stale = {}
+    for table in SNAPSHOT_TABLES:
+        state = table_state(backend, table)
+        if not _same_state(manifest['tables'].get(table, {}).get('state'), state):
+            stale[table] = state
+    return stale
+
+
+def sa4_of_codes(areas):
+    """
+    The purpose of this function is to find the SA4 every region belongs to by walking up the
+    AreasAsgs parent mapping
+
+    input: AreasAsgs DataFrame (ASGSCode, RegionType, Parent)
+    output: Series of code -> SA4 code (NO_SA4 for regions above SA4 level)
+    """
+    areas = areas.drop_duplicates('ASGSCode').set_index('ASGSCode')
+    region_type = areas['RegionType'].astype(str).str.strip()
+    parent = areas['Parent']
+    current = pd.Series(areas.index, index=areas.index)
+    # FA -> SA2 -> SA3 -> SA4 needs at most three steps, allow a couple more for other levels
+    for _ in range(5):
+        not_sa4 = current.map(region_type).ne('SA4') & current.notna()
+        if not not_sa4.any():
+            break
+        current[not_sa4] = current[not_sa4].map(parent)
+    is_sa4 = current.map(region_type).eq('SA4')
+    return current.where(is_sa4, NO_SA4).astype('int64')
+
+
+def export_table(backend, table, directory, sa4_lookup):
+    """
+    The purpose of this function is to stream one table from the database into Parquet files,
+    one file per SA4, without holding the whole table in memory
+
+    input: DatabaseBackend, table name, snapshot directory, Series of code -> SA4 code
+    output: number of rows exported
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    code_column = SNAPSHOT_TABLES[table][0]
+    columns = _table_columns(table)
+    arrow_schema = _arrow_schema(table)
+    table_dir = os.path.join(directory, table)
+    temp_dir = table_dir + ".tmp"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    writers = {}
+    rows = 0
+    try:
+        sql = f"SELECT {', '.join(columns)} FROM dbo.{table}"
+        for batch in backend.iter_query(sql, schema=_pandas_schema(table)):
+            sa4 = batch[code_column].map(sa4_lookup).fillna(NO_SA4).astype('int64')
+            for sa4_code, part in batch.groupby(sa4.to_numpy()):
+                if sa4_code not in writers:
+                    partition_dir = os.path.join(temp_dir, f"sa4={sa4_code}")
+                    os.makedirs(partition_dir)
+                    writers[sa4_code] = pq.ParquetWriter(os.path.join(partition_dir, "part-0.parquet"), arrow_schema)
+                writers[sa4_code].write_table(pa.Table.from_pandas(part, schema=arrow_schema, preserve_index=False))
+            rows += len(batch)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    # swap the new files in only once the export is complete
+    os.makedirs(temp_dir, exist_ok=True)
+    shutil.rmtree(table_dir, ignore_errors=True)
+    os.rename(temp_dir, table_dir)
+    return rows
+
+
+def refresh_snapshot(backend, directory, force=False):
+    """
+    The purpose of this function is to bring the snapshot up to date, exporting only the tables
+    that changed in the database since the last export
+
+    input: DatabaseBackend, snapshot directory, True to export every table
+    output: list of the tables that were exported
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    stale = {table: table_state(backend, table) for table in SNAPSHOT_TABLES} if force else stale_tables(backend, directory)
+    if not stale:
+        logging.info("Snapshot is up to date")
+        return []
+
+    areas = backend.read_query("SELECT ASGSCode, RegionType, Parent FROM dbo.AreasAsgs")
+    sa4_lookup = sa4_of_codes(areas)
+    for table, state in stale.items():
+        start_time = time.time()
+        rows = export_table(backend, table, directory, sa4_lookup)
+        manifest['tables'][table] = {'state': state, 'rows': rows, 'exported_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+        with open(os.path.join(directory, MANIFEST_FILE), 'w') as file:
+            json.dump(manifest, file, indent=2)
+        logging.info(f"Snapshot of {table} exported: {rows} rows in {time.time() - start_time:.1f} seconds")
+    return list(stale)
+
+
+def read_snapshot_table(directory, table, columns=None, sa4_codes=None):
+    """
+    The purpose of this function is to read a table from the snapshot directly, loading only the
+    requested columns and SA4 partitions from memory-mapped files
+
+    input: snapshot directory, table name, optional list of columns, optional list of SA4 codes
+    output: DataFrame
+    """
+    import pyarrow.parquet as pq
+    filters = [('sa4', 'in', [int(code) for code in sa4_codes])] if sa4_codes is not None else None
+    arrow_table = pq.read_table(os.path.join(directory, table), columns=columns, filters=filters,
+                                memory_map=True, partitioning='hive')
+    if columns is None and 'sa4' in arrow_table.column_names:
+        arrow_table = arrow_table.drop(['sa4'])
+    return arrow_table.to_pandas()
+
+
+class SnapshotBackend(DatabaseBackend):
+    """
+    The purpose of this class is to run the SQL files of the checks on the snapshot instead of the
+    database. Every table of the snapshot is a DuckDB view over its Parquet files, so queries only
+    read the columns they use.
+
+    input: snapshot directory
+    """
+
+    def __init__(self, directory, pool_size=4):
+        super().__init__(pool_size)
+        self.directory = os.path.abspath(directory)
+        self.tables = list(read_manifest(self.directory)['tables'])
+        if not self.tables:
+            raise FileNotFoundError(f"No snapshot found in {self.directory}, run: python snapshot.py refresh {directory}")
+
+    def connect(self):
+        import duckdb
+        conn = duckdb.connect()
+        for table in self.tables:
+            files = os.path.join(self.directory, table, "*", "*.parquet").replace("'", "''")
+            conn.execute(f"CREATE VIEW {table} AS SELECT {', '.join(_table_columns(table))} "
+                         f"FROM read_parquet('{files}', hive_partitioning = true)")
+        return conn
+
+    def translate(self, sql_query):
+        sql_query = strip_schema_names(sql_query)
+        # BINARY_CHECKSUM(columns) as a 32 bit DuckDB hash, so sums of checksums fit in a BIGINT
+        sql_query = re.sub(r'\bBINARY_CHECKSUM\s*\(([^()]*)\)', r'CAST(hash(\1) % 2147483647 AS BIGINT)', sql_query,
+                           flags=re.IGNORECASE)
+        # LEFT(x, n) on codes, DuckDB only takes LEFT of a string
+        return re.sub(r'\bLEFT\s*\(\s*([\w\."]+)\s*,', r'LEFT(CAST(\1 AS VARCHAR),', sql_query, flags=re.IGNORECASE)
+
+
+if __name__ == '__main__':
+    from main import connect_to_database
+
+    parser = argparse.ArgumentParser(description="Export the forecast tables into a local snapshot")
+    parser.add_argument('command', choices=['refresh', 'status'])
+    parser.add_argument('directory')
+    parser.add_argument('--force', action='store_true', help="export every table even if it did not change")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    # the snapshot is always refreshed from the database, even when PEXA_SNAPSHOT points the runs at it
+    backend = connect_to_database(use_snapshot=False)
+    try:
+        if args.command == 'refresh':
+            exported = refresh_snapshot(backend, args.directory, force=args.force)
+            print(f"Exported: {', '.join(exported) if exported else 'nothing, snapshot is up to date'}")
+        else:
+            stale = stale_tables(backend, args.directory)
+            print(f"Out of date: {', '.join(stale) if stale else 'nothing'}")
+    finally:
+        backend.close()
@@ -0,0 +1,226 @@
+"""
+This file contains the parameter sweep mode, which evaluates the spike, shape, household ratio and
+ML checks for a grid of parameter values in one run, without the parameter window.
+Everything that does not depend on the parameters is computed once: the data is fetched once,
+the growth rate matrix and the quartiles of every region are kept for the spike check, the sign
+encoding of the shape check is kept per sensitivity, the household ratio of every region and year
+is computed once from the forecast matrices (see ratios.py), and the ML model is fitted once (the
+contamination only moves the score threshold). Every grid point then only applies its thresholds.
+
+usage: python sweep.py --sensitivity 0.001 0.005 0.01 --multiplier 3 5 7
+       python sweep.py --ratio-upper 4 5 6 --ratio-lower 0.5 1 --contamination 0.001 0.003 0.01
+"""
+import argparse
+import itertools
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from main import connect_to_database
+from parameters import DEFAULT_PARAMETERS, read_parameters
+
+
+# check key -> parameters the check depends on
+SWEEP_CHECKS = {
+    'spike': ['sensitivity', 'multiplier'],
+    'shape': ['sensitivity'],
+    'household_ratio': ['ratio_upper', 'ratio_lower'],
+    'ml': ['contamination'],
+}
+SWEEP_PARAMETERS = ['ratio_upper', 'ratio_lower', 'multiplier', 'sensitivity', 'contamination']
+
+
+class ParameterSweep:
+    """
+    The purpose of this class is to keep the data and statistics of the swept checks that do not
+    depend on the parameters, so every grid point only applies its thresholds.
+
+    input: DataSession, SA4 code of the household ratio check (None for every SA4)
+    """
+
+    def __init__(self, session, sa4_code=None):
+        self.session = session
+        self.sa4_code = sa4_code
+        self.shapes = {}
+        self.growth = None
+        self.household = None
+        self.ml = None
+
+    def prepare(self, grid):
+        """
+        The purpose of this function is to fetch the data and compute the statistics the checks of
+        the grid need
+
+        input: dictionary of check key -> list of parameter dictionaries
+        """
+        from checks import erp_growth_rates, forecast_matrix
+        from ratios import RATIOS, align, metrics_of, ratio_values
+
+        if 'spike' in grid or 'shape' in grid:
+            rate_of_change = erp_growth_rates(self.session)
+            # the spike check does not test the first growth rate (see spike_check)
+            values = rate_of_change.iloc[1:].to_numpy(dtype='float64')
+            quartiles = np.percentile(values, [25, 75], axis=0) if len(values) else np.full((2, values.shape[1]), np.nan)
+            self.growth = {'rates': rate_of_change, 'values': values, 'q1': quartiles[0], 'q3': quartiles[1]}
+
+        if 'household_ratio' in grid:
+            # the household size of every region and year, every grid point only applies its bounds
+            ratio = RATIOS['household_size']
+            matrices = {metric: forecast_matrix(self.session, metric) for metric in metrics_of(['household_size'])}
+            codes, _, aligned = align(matrices, index=self.session.hierarchy_index(), sa4_code=self.sa4_code)
+            self.household = {'codes': codes, 'ratios': ratio_values(ratio, aligned)}
+
+        if 'ml' in grid:
+            self.ml = self.ml_scores(min(point['contamination'] for point in grid['ml']))
+
+    def ml_scores(self, contamination):
+        """
+        The purpose of this function is to score every region once. An IsolationForest flags the
+        regions whose score is below the contamination percentile of the scores it was fitted on,
+        so one fit gives the flags of every contamination.
+
+        output: list of (region codes, scores, mask of regions with a negative ERP) per region type
+        """
+        from anomaly_model import FEATURES, data_vintage, fitted_model, region_features
+
+        erp = self.session.fetch("ERP_ML.sql")
+        hierarchy = self.session.fetch("Area_hierarchy.sql")
+        if erp.empty:
+            return []
+        features = region_features(erp, hierarchy)
+        negative = erp.loc[erp['Total'] < 0, 'ASGSCode'].unique()
+        vintage = data_vintage(erp)
+        scores = []
+        for region_type in ['FA', 'SA2']:
+            type_features = features[features['RegionType'] == region_type]
+            if type_features.empty:
+                continue
+            model = fitted_model(type_features, region_type, vintage, contamination, model_dir=None)
+            scores.append((type_features.index.to_numpy(), model.score_samples(type_features[FEATURES].to_numpy()),
+                           type_features.index.isin(negative)))
+        return scores
+
+    def spike_regions(self, sensitivity, multiplier):
+        from checks import spike_outliers
+
+        growth = self.growth
+        flagged = spike_outliers(growth['values'], growth['q1'], growth['q3'], sensitivity, multiplier).any(axis=0)
+        return set(growth['rates'].columns[flagged])
+
+    def shape_regions(self, sensitivity):
+        from checks import classify_trend_shapes
+
+        if sensitivity not in self.shapes:
+            shapes = classify_trend_shapes(self.growth['rates'], sensitivity)
+            self.shapes[sensitivity] = set(shapes.index[shapes['pattern'].notna()])
+        return self.shapes[sensitivity]
+
+    def household_regions(self, ratio_upper, ratio_lower):
+        ratios = self.household['ratios']
+        return set(self.household['codes'][((ratios >= ratio_upper) | (ratios <= ratio_lower)).any(axis=0)])
+
+    def ml_regions(self, contamination):
+        regions = set()
+        for codes, scores, negative in self.ml:
+            threshold = np.percentile(scores, 100 * contamination)
+            regions.update(codes[(scores < threshold) | negative])
+        return regions
+
+    def regions(self, check, point):
+        """
+        output: set of the region codes a check flags with the parameters of a grid point
+        """
+        if check == 'spike':
+            return self.spike_regions(point['sensitivity'], point['multiplier'])
+        if check == 'shape':
+            return self.shape_regions(point['sensitivity'])
+        if check == 'household_ratio':
+            return self.household_regions(point['ratio_upper'], point['ratio_lower'])
+        return self.ml_regions(point['contamination'])
+
+
+def parameter_grid(values):
+    """
+    output: list of parameter dictionaries, one per combination of the values
+    """
+    return [dict(zip(values, combination)) for combination in itertools.product(*values.values())]
+
+
+def run_sweep(session, values, checks=None, sa4_code=None):
+    """
+    The purpose of this function is to evaluate the checks for every combination of parameter values
+
+    input: DataSession, dictionary of parameter -> list of values, list of check keys (default:
+           every check of SWEEP_CHECKS), SA4 code of the household ratio check
+    output: DataFrame with one row per grid point (the parameters, the number of regions flagged by
+            each check and by any of them), DataFrame of the flagged regions (Check | parameters | Code)
+    """
+    checks = list(SWEEP_CHECKS) if checks is None else checks
+    unknown = [check for check in checks if check not in SWEEP_CHECKS]
+    if unknown:
+        raise ValueError(f"Checks that cannot be swept: {', '.join(unknown)} (known: {', '.join(SWEEP_CHECKS)})")
+
+    # each check is only evaluated once per combination of the parameters it depends on
+    check_grid = {check: parameter_grid({name: values[name] for name in SWEEP_CHECKS[check]}) for check in checks}
+    sweep = ParameterSweep(session, sa4_code)
+    sweep.prepare(check_grid)
+
+    flagged = {}
+    region_rows = []
+    for check, points in check_grid.items():
+        for point in points:
+            regions = sweep.regions(check, point)
+            flagged[check, tuple(point.values())] = regions
+            region_rows.extend({'Check': check, **point, 'Code': code} for code in sorted(regions))
+        logging.info(f"Swept {check} over {len(points)} parameter combinations")
+
+    summary_rows = []
+    for point in parameter_grid(values):
+        row = dict(point)
+        union = set()
+        for check in checks:
+            regions = flagged[check, tuple(point[name] for name in SWEEP_CHECKS[check])]
+            row[check] = len(regions)
+            union |= regions
+        row['any'] = len(union)
+        summary_rows.append(row)
+    region_df = pd.DataFrame(region_rows, columns=['Check'] + list(values) + ['Code'])
+    return pd.DataFrame(summary_rows), region_df
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the spike, shape, household ratio and ML checks over a grid of parameters")
+    parser.add_argument('--params', default='parameters.txt', help="parameter file giving the values not swept (default: parameters.txt)")
+    parser.add_argument('--checks', nargs='+', default=None, help="checks to sweep (default: " + ", ".join(SWEEP_CHECKS) + ")")
+    parser.add_argument('--summary', default='sweep_summary.csv', help="flag counts per grid point (default: sweep_summary.csv)")
+    parser.add_argument('--regions', default='sweep_regions.csv', help="flagged regions per check and parameters (default: sweep_regions.csv)")
+    for name in SWEEP_PARAMETERS:
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, type=float, nargs='+', default=None,
+                            help=f"values of {name} (default: the value of the parameter file)")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    logging.basicConfig(filename='app.log', filemode='w', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    start_time = time.time()
+
+    from checks import execute_sql_query
+    from data_session import DataSession
+
+    parameters = read_parameters(args.params)
+    values = {name: getattr(args, name) or [parameters.get(name, DEFAULT_PARAMETERS[name])] for name in SWEEP_PARAMETERS}
+    conn = connect_to_database()
+    session = DataSession(conn, execute_sql_query)
+    try:
+        summary_df, region_df = run_sweep(session, values, args.checks, parameters.get('sa4_code'))
+    finally:
+        conn.close()
+    summary_df.to_csv(args.summary, index=False)
+    region_df.to_csv(args.regions, index=False)
+    print(summary_df.to_string(index=False))
+    print(f"{len(summary_df)} parameter combinations written to {args.summary}, flagged regions to {args.regions}")
+    print(f"Running time: {time.time() - start_time:.6f} seconds")
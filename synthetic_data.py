@@ -0,0 +1,248 @@
+"""
+This file contains the synthetic forecasts database generator.
+It builds a local SQLite copy of the forecasts.dbo tables (AreasAsgs, Births, Deaths, ERP and
+Households) for an FA -> SA2 -> SA3 -> SA4 hierarchy of any size, from one SA4 up to national
+scale, with smooth ERP series by sex and age and known anomalies injected into them. The injected
+anomalies are stored in the SyntheticAnomalies table so a run of the checks can be scored against
+them (see benchmarks/check_benchmark.py).
+
+usage: python synthetic_data.py synthetic.db --sa4 4
+       PEXA_DATABASE=synthetic.db python main.py
+"""
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from db_backend import SQLiteBackend
+
+
+SEXES = np.array([1, 2])
+AGES = np.arange(18)
+# mother's age groups (15-19 .. 45-49) and their yearly births per woman
+FERTILITY = {3: 0.01, 4: 0.05, 5: 0.1, 6: 0.12, 7: 0.07, 8: 0.02, 9: 0.005}
+HOUSEHOLD_KEY = 19
+PEOPLE_PER_HOUSEHOLD = 2.5
+SA4_PER_STATE = 20
+
+# region codes: state (1 digit) > SA4 (3) > SA3 (5) > SA2 (9), each starting with its parent, and FAs
+# of 8 digits starting with the state digit, which like the ASGS FAs do not start with their SA2 code
+ANOMALY_COLUMNS = ['Code', 'Check', 'Year', 'Description']
+
+
+def sa4_codes(n_sa4):
+    """
+    output: numpy array of the codes of the first n_sa4 SA4s, SA4_PER_STATE per state
+    """
+    index = np.arange(n_sa4)
+    return (1 + index // SA4_PER_STATE) * 100 + index % SA4_PER_STATE + 1
+
+
+def first_fa_code(sa4):
+    """
+    output: code of the first FA of an SA4, its FAs are numbered from there (at most 10000 per SA4)
+    """
+    return (sa4 // 100) * 10 ** 7 + 10 ** 6 + (sa4 % 100) * 10 ** 4
+
+
+def build_areas(sa4, sa3_per_sa4, sa2_per_sa3, fa_per_sa2):
+    """
+    The purpose of this function is to build the codes of every region below one SA4.
+    The hierarchy is regular, so the regions of a level are a reshape of the level below.
+
+    output: dictionary of region type -> numpy array of codes, shaped (SA3, SA2, FA) for the FAs,
+            (SA3, SA2) for the SA2s and (SA3,) for the SA3s
+    """
+    sa3 = sa4 * 100 + np.arange(1, sa3_per_sa4 + 1)
+    sa2 = sa3[:, None] * 10000 + np.arange(1, sa2_per_sa3 + 1)[None, :]
+    fa = first_fa_code(sa4) + np.arange(sa2.size * fa_per_sa2).reshape(sa2.shape + (fa_per_sa2,))
+    return {'SA4': np.array([sa4]), 'SA3': sa3, 'SA2': sa2, 'FA': fa}
+
+
+def areas_table(areas):
+    parents = {'SA3': areas['SA4'][0], 'SA2': areas['SA3'][:, None], 'FA': areas['SA2'][:, :, None]}
+    frames = [pd.DataFrame({'ASGSCode': areas['SA4'], 'RegionType': 'SA4', 'Parent': areas['SA4'] // 100})]
+    for region_type, parent in parents.items():
+        codes = areas[region_type]
+        frames.append(pd.DataFrame({'ASGSCode': codes.ravel(), 'RegionType': region_type,
+                                    'Parent': np.broadcast_to(parent, codes.shape).ravel()}))
+    areas_df = pd.concat(frames, ignore_index=True)
+    areas_df['ASGS'] = 2021
+    areas_df['Name'] = areas_df['RegionType'] + " " + areas_df['ASGSCode'].astype(str)
+    return areas_df[['ASGSCode', 'ASGS', 'RegionType', 'Parent', 'Name']]
+
+
+def long_table(codes, values, key_names, key_values, code_column, value_column='Number'):
+    """
+    The purpose of this function is to flatten a (region, key1, key2, ...) array into table rows
+
+    input: codes of the regions (first axis), array of values, names and values of the other axes,
+           name of the code column, name of the value column
+    output: DataFrame with one row per cell
+    """
+    grids = np.meshgrid(codes, *key_values, indexing='ij')
+    table = {code_column: grids[0].ravel()}
+    for name, grid in zip(key_names, grids[1:]):
+        table[name] = grid.ravel()
+    table[value_column] = values.ravel()
+    return pd.DataFrame(table)
+
+
+def with_rollups(fa_values):
+    """
+    The purpose of this function is to add up FA values into their SA2, SA3 and SA4
+
+    input: array shaped (SA3, SA2, FA, ...)
+    output: dictionary of region type -> array with the region axes flattened into the first axis
+    """
+    sa2_values = fa_values.sum(axis=2)
+    sa3_values = sa2_values.sum(axis=1)
+    rest = fa_values.shape[3:]
+    return {'FA': fa_values.reshape((-1,) + rest), 'SA2': sa2_values.reshape((-1,) + rest),
+            'SA3': sa3_values, 'SA4': sa3_values.sum(axis=0, keepdims=True)}
+
+
+def generate_sa4(sa4, years, rng, sa3_per_sa4=3, sa2_per_sa3=8, fa_per_sa2=4, anomalies=True):
+    """
+    The purpose of this function is to generate the tables of one SA4 and inject its anomalies
+
+    input: SA4 code, numpy array of years, numpy random generator, size of the hierarchy,
+           True to inject one anomaly of every kind
+    output: dictionary of table name -> DataFrame, DataFrame of the injected anomalies
+    """
+    areas = build_areas(sa4, sa3_per_sa4, sa2_per_sa3, fa_per_sa2)
+    codes = {region_type: areas[region_type].ravel() for region_type in areas}
+    n_fa, n_years = codes['FA'].size, len(years)
+    fa_shape = areas['FA'].shape
+
+    # smooth growth well above the shape check sensitivity so clean regions are never flagged
+    base = rng.uniform(2000, 8000, n_fa)
+    growth = np.clip(rng.normal(0.012, 0.004, n_fa), 0.007, 0.03)[:, None] + rng.normal(0, 0.0003, (n_fa, n_years))
+    growth[:, 0] = 0
+    totals = base[:, None] * np.cumprod(1 + growth, axis=1)
+    profile = rng.dirichlet(np.full(len(SEXES) * len(AGES), 20)).reshape(len(SEXES), len(AGES))
+    household_divisor = np.full((n_fa, n_years), PEOPLE_PER_HOUSEHOLD)
+
+    injected = []
+    if anomalies:
+        spike_fa, shape_fa, household_fa, negative_fa, deaths_fa = rng.choice(n_fa, 5, replace=False)
+        spike_year, turn_year = rng.integers(5, n_years - 5, 2)
+        totals[spike_fa, spike_year] *= 1.3
+        injected.append((codes['FA'][spike_fa], 'spike', years[spike_year], "ERP raised by 30% in one year"))
+        totals[shape_fa, turn_year:] = totals[shape_fa, turn_year] * 0.985 ** np.arange(n_years - turn_year)
+        injected.append((codes['FA'][shape_fa], 'shape', years[turn_year], "ERP growth turns negative"))
+        household_divisor[household_fa, turn_year:] = PEOPLE_PER_HOUSEHOLD * 3
+        injected.append((codes['FA'][household_fa], 'household_ratio', years[turn_year], "households divided by 3"))
+
+    erp = np.rint(totals[:, None, None, :] * profile[None, :, :, None])
+    households = np.rint(erp.sum(axis=(1, 2)) / household_divisor)
+    female = erp[:, 1]
+    births = np.zeros((n_fa, len(SEXES), len(AGES), n_years))
+    for age, rate in FERTILITY.items():
+        births[:, :, age] = np.rint(female[:, None, age] * rate / 2)
+    mortality = np.geomspace(0.0005, 0.15, len(AGES))
+    deaths = np.rint(erp * mortality[None, None, :, None])
+
+    rolled = {name: with_rollups(values.reshape(fa_shape + values.shape[1:]))
+              for name, values in [('ERP', erp), ('Births', births), ('Deaths', deaths), ('Households', households)]}
+
+    if anomalies:
+        # injected after the rollup, so the parents no longer add up
+        rolled['Births']['FA'][negative_fa, 0, 5, turn_year] = -50
+        injected.append((codes['FA'][negative_fa], 'negative', years[turn_year], "negative births"))
+        # the FAs of an SA2 are consecutive in the flattened arrays, and so are the SA2s of an SA3
+        injected.append((codes['SA2'][negative_fa // fa_per_sa2], 'births', years[turn_year],
+                         "births of one FA set to -50 after the rollup"))
+        rolled['Deaths']['FA'][deaths_fa, 0, 10, spike_year] += 40
+        injected.append((codes['SA2'][deaths_fa // fa_per_sa2], 'deaths', years[spike_year],
+                         "deaths of one FA raised by 40 after the rollup"))
+        population_sa2 = rng.integers(codes['SA2'].size)
+        rolled['ERP']['SA2'][population_sa2, 1, 0, turn_year] += 100
+        injected.append((codes['SA2'][population_sa2], 'population', years[turn_year], "ERP of one SA2 raised by 100 after the rollup"))
+        injected.append((codes['SA3'][population_sa2 // sa2_per_sa3], 'population', years[turn_year],
+                         "ERP of one of its SA2s raised by 100 after the rollup"))
+
+    tables = {'AreasAsgs': areas_table(areas)}
+    keys = {'ERP': (['SexKey', 'AgeKey', 'ERPYear'], [SEXES, AGES, years], 'ASGS_2016'),
+            'Births': (['SexKey', 'AgeKey', 'Year'], [SEXES, AGES, years], 'ASGSCode'),
+            'Deaths': (['SexKey', 'AgeKey', 'Year'], [SEXES, AGES, years], 'ASGSCode'),
+            'Households': (['ERPYear'], [years], 'ASGSCode')}
+    for name, (key_names, key_values, code_column) in keys.items():
+        tables[name] = pd.concat([long_table(codes[region_type], rolled[name][region_type], key_names, key_values, code_column)
+                                  for region_type in ['FA', 'SA2', 'SA3', 'SA4']], ignore_index=True)
+        tables[name]['Number'] = tables[name]['Number'].astype('int64')
+    # only mothers of child-bearing age have births
+    tables['Births'] = tables['Births'][tables['Births']['AgeKey'].isin(list(FERTILITY))].reset_index(drop=True)
+    tables['Households']['HhKey'] = HOUSEHOLD_KEY
+    return tables, pd.DataFrame(injected, columns=ANOMALY_COLUMNS)
+
+
+def generate_database(path, n_sa4=1, first_year=2021, n_years=26, seed=0, anomalies=True, **sizes):
+    """
+    The purpose of this function is to build a synthetic forecasts database in an SQLite file,
+    one SA4 at a time so national scale never needs the whole country in memory
+
+    input: path of the SQLite file (replaced if it exists), number of SA4s, first forecast year,
+           number of years, random seed, True to inject anomalies, sa3_per_sa4 / sa2_per_sa3 /
+           fa_per_sa2 to change the size of each SA4
+    output: DataFrame of the injected anomalies (Code | Check | Year | Description), where Check
+            is the registry key of the check expected to flag Code
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    backend = SQLiteBackend(path)
+    backend.create_schema()
+    rng = np.random.default_rng(seed)
+    years = np.arange(first_year, first_year + n_years)
+    injected = []
+    try:
+        states = np.unique(sa4_codes(n_sa4) // 100)
+        backend.load_table('AreasAsgs', pd.DataFrame({'ASGSCode': states, 'ASGS': 2021, 'RegionType': 'STE',
+                                                      'Parent': pd.array([None] * len(states), dtype='Int64'),
+                                                      'Name': [f"STE {state}" for state in states]}))
+        for sa4 in sa4_codes(n_sa4):
+            tables, sa4_anomalies = generate_sa4(int(sa4), years, rng, anomalies=anomalies, **sizes)
+            for table, df in tables.items():
+                backend.load_table(table, df)
+            injected.append(sa4_anomalies)
+            logging.info(f"Synthetic SA4 {sa4} generated")
+
+        anomaly_df = pd.concat(injected, ignore_index=True)
+        with backend.connection() as conn:
+            conn.execute("CREATE TABLE SyntheticAnomalies (Code INTEGER, \"Check\" TEXT, Year INTEGER, Description TEXT)")
+            conn.executemany("INSERT INTO SyntheticAnomalies VALUES (?, ?, ?, ?)",
+                             anomaly_df.astype(object).itertuples(index=False, name=None))
+            for table, column in [('AreasAsgs', 'ASGSCode'), ('ERP', 'ASGS_2016'), ('Births', 'ASGSCode'),
+                                  ('Deaths', 'ASGSCode'), ('Households', 'ASGSCode')]:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ({column})")
+            conn.commit()
+    finally:
+        backend.close()
+    return anomaly_df
+
+
+def read_anomalies(path):
+    """
+    output: the anomalies injected into a synthetic database
+    """
+    backend = SQLiteBackend(path)
+    try:
+        return backend.read_query('SELECT Code, "Check", Year, Description FROM SyntheticAnomalies')
+    finally:
+        backend.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build a synthetic forecasts database with injected anomalies")
+    parser.add_argument('path', help="SQLite file to create")
+    parser.add_argument('--sa4', type=int, default=1, help="number of SA4s (107 is national scale)")
+    parser.add_argument('--years', type=int, default=26, help="number of forecast years")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--clean', action='store_true', help="do not inject anomalies")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    anomaly_df = generate_database(args.path, args.sa4, n_years=args.years, seed=args.seed, anomalies=not args.clean)
+    print(f"{args.path}: {args.sa4} SA4s, {len(anomaly_df)} injected anomalies")
@@ -0,0 +1,153 @@
+"""
+Tests of the incremental mode against a full run on the same data, on a synthetic database whose
+data is edited between runs, including checks that fail in one of the runs.
+"""
+import shutil
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import checks
+from data_session import DataSession
+from db_backend import SQLiteBackend
+from incremental import load_state, run_incremental
+from metrics import RunMetrics
+from parameters import DEFAULT_PARAMETERS
+from registry import CHECKS, build_tasks
+from scheduler import run_checks
+from synthetic_data import generate_database
+
+PARAMETERS = dict(DEFAULT_PARAMETERS, sa4_code=None)
+SELECTED = ['household_ratio', 'births', 'deaths', 'households', 'population', 'negative', 'spike', 'shape',
+            'pattern', 'ratios']
+SIZES = {'sa3_per_sa4': 2, 'sa2_per_sa3': 3, 'fa_per_sa2': 3}
+
+
+@pytest.fixture(scope='module')
+def source_db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("incremental") / "source.db")
+    generate_database(path, 3, seed=2, **SIZES)
+    return path
+
+
+@pytest.fixture
+def db(source_db, tmp_path):
+    path = str(tmp_path / "synthetic.db")
+    shutil.copy(source_db, path)
+    return path
+
+
+def new_session(path, metrics=None):
+    session = DataSession(SQLiteBackend(path), checks.execute_sql_query, metrics=metrics)
+    session.index_dir = None
+    return session
+
+
+def failing_check(*args, **kwargs):
+    return None
+
+
+def tasks_of(fail=()):
+    tasks = build_tasks(PARAMETERS, SELECTED)
+    for task in tasks:
+        if task.name in fail:
+            task.func = failing_check
+    return tasks
+
+
+def incremental_run(path, state_dir, fail=(), metrics=None):
+    session = new_session(path, metrics)
+    try:
+        return run_incremental(tasks_of(fail), session, str(state_dir), max_connections=1, max_processes=1)
+    finally:
+        session.conn.close()
+
+
+def full_run(path):
+    session = new_session(path)
+    try:
+        return run_checks(tasks_of(), session, max_connections=1, max_processes=1)
+    finally:
+        session.conn.close()
+
+
+def assert_same_results(results, expected):
+    assert results.keys() == expected.keys()
+    for name, output in expected.items():
+        assert output is not None and results[name] is not None, name
+        ordered = [frame.astype({'Code': 'int64'}).sort_values(list(frame.columns[:3]), ignore_index=True)
+                   for frame in (results[name], output)]
+        pd.testing.assert_frame_equal(ordered[0], ordered[1], check_dtype=False, obj=name)
+
+
+def first_fa(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT MIN(ASGSCode) FROM AreasAsgs WHERE RegionType = 'FA'").fetchone()[0]
+
+
+def edit_fa(path, code):
+    """
+    The purpose of this function is to change the data of one FA: one more birth in one year (so
+    its SA2 no longer adds up) and an ERP spike
+    """
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE Births SET Number = Number + 1 WHERE ASGSCode = ? AND Year = 2030 AND AgeKey = 5 "
+                     "AND SexKey = 1", (code,))
+        conn.execute("UPDATE ERP SET Number = Number * 1.5 WHERE ASGS_2016 = ? AND ERPYear = 2035", (code,))
+        conn.commit()
+
+
+def test_unchanged_data_keeps_the_full_results(db, tmp_path):
+    first = incremental_run(db, tmp_path / "state")
+    assert_same_results(first, full_run(db))
+    assert_same_results(incremental_run(db, tmp_path / "state"), first)
+
+
+def test_edit_matches_full_run(db, tmp_path):
+    incremental_run(db, tmp_path / "state")
+    edit_fa(db, first_fa(db))
+    metrics = RunMetrics(None)
+    results = incremental_run(db, tmp_path / "state", metrics=metrics)
+    assert_same_results(results, full_run(db))
+
+    # the re-checked regions are read on their own, not with every region
+    totals = [record['rows'] for record in metrics.records if record['name'] == "Region_totals.sql"]
+    all_totals = len(new_session(db).fetch("Region_totals.sql"))
+    assert totals and max(totals) < all_totals / 4
+
+
+def test_births_age_move_is_rechecked(db, tmp_path):
+    incremental_run(db, tmp_path / "state")
+    code = first_fa(db)
+    # births moved between two age groups of the mother, the total of the region stays the same
+    with sqlite3.connect(db) as conn:
+        conn.execute("UPDATE Births SET Number = Number - 5 WHERE ASGSCode = ? AND Year = 2030 AND AgeKey = 5 "
+                     "AND SexKey = 1", (code,))
+        conn.execute("UPDATE Births SET Number = Number + 5 WHERE ASGSCode = ? AND Year = 2030 AND AgeKey = 6 "
+                     "AND SexKey = 1", (code,))
+        conn.commit()
+    metrics = RunMetrics(None)
+    incremental_run(db, tmp_path / "state", metrics=metrics)
+    assert any(record['name'] == "Region_totals.sql" for record in metrics.records)
+
+
+def test_failed_recheck_keeps_previous_output(db, tmp_path):
+    before = incremental_run(db, tmp_path / "state")
+    births = CHECKS['births'].name
+    edit_fa(db, first_fa(db))
+
+    failed = incremental_run(db, tmp_path / "state", fail=[births])
+    pd.testing.assert_frame_equal(failed[births], before[births])
+    assert load_state(str(tmp_path / "state"))['results'][births] is not None
+
+    # the regions the failed check missed are re-checked by the next run
+    assert_same_results(incremental_run(db, tmp_path / "state"), full_run(db))
+
+
+def test_check_failed_last_time_is_run_in_full(db, tmp_path):
+    births = CHECKS['births'].name
+    first = incremental_run(db, tmp_path / "state", fail=[births])
+    assert first[births] is None
+    edit_fa(db, first_fa(db))
+    assert_same_results(incremental_run(db, tmp_path / "state"), full_run(db))
@@ -0,0 +1,96 @@
+"""
+Tests of the partitioned mode of the ERP checks against a full in-memory run, on a synthetic
+database whose FA codes (8 digits) do not start with the code of their SA2, SA4 or state.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import checks
+import partitioned
+from data_session import DataSession
+from db_backend import SQLiteBackend
+from region_scope import RegionScope
+from synthetic_data import generate_database
+
+# two states (SA4_PER_STATE SA4s in the first one), small SA4s so the database builds quickly
+N_SA4 = 22
+SIZES = {'sa3_per_sa4': 2, 'sa2_per_sa3': 2, 'fa_per_sa2': 3}
+
+
+@pytest.fixture(scope='module')
+def backend(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("partitioned") / "synthetic.db")
+    generate_database(path, N_SA4, seed=1, **SIZES)
+    backend = SQLiteBackend(path)
+    yield backend
+    backend.close()
+
+
+def new_session(backend, scope=None):
+    session = DataSession(backend, checks.execute_sql_query, RegionScope(scope) if scope else None)
+    # the index of the synthetic database is not saved over the one of the repository
+    session.index_dir = None
+    return session
+
+
+def full_and_partitioned(backend, check, level, scope=None, codes=None):
+    full = getattr(checks, check['full'])(new_session(backend, scope), codes=codes, **check['kwargs'])
+    split = getattr(partitioned, check['partitioned'])(new_session(backend, scope), level=level, codes=codes,
+                                                     **check['kwargs'])
+    return full.reset_index(drop=True), split.reset_index(drop=True)
+
+
+CHECKS = {
+    'spike': {'full': 'spike_check', 'partitioned': 'spike_check', 'kwargs': {'sensitivity': 0.005, 'multiplier': 5}},
+    'shape': {'full': 'trend_shape_check', 'partitioned': 'trend_shape_check', 'kwargs': {'sensitivity': 0.005}},
+    'pattern': {'full': 'pattern_check', 'partitioned': 'pattern_check', 'kwargs': {}},
+}
+
+
+def test_fa_codes_are_not_nested(backend):
+    index = new_session(backend).hierarchy_index()
+    fa = index.codes[index.region_types(index.codes) == 'FA']
+    sa4 = index.ancestors_at(fa, 'SA4').to_numpy(dtype='int64')
+    assert len(fa) and all(len(str(code)) == 8 for code in fa)
+    # a code prefix puts most FAs under the wrong SA4 (or none)
+    nested = sum(str(code).startswith(str(parent)) for code, parent in zip(fa, sa4))
+    assert nested < len(fa) / 10
+
+
+@pytest.mark.parametrize("level", partitioned.PARTITION_LEVELS)
+def test_every_region_is_in_one_partition(backend, level):
+    index = new_session(backend).hierarchy_index()
+    members = np.concatenate([codes for _, codes in partitioned.partition_scopes(index, level)])
+    below = index.codes[pd.notna(index.ancestors_at(index.codes, level))]
+    assert len(members) == len(np.unique(members))
+    assert set(members) == set(below)
+
+
+@pytest.mark.parametrize("level", partitioned.PARTITION_LEVELS)
+@pytest.mark.parametrize("check", list(CHECKS))
+def test_partitioned_matches_full_run(backend, check, level):
+    full, split = full_and_partitioned(backend, CHECKS[check], level)
+    assert not full.empty
+    pd.testing.assert_frame_equal(split, full, check_dtype=False)
+
+
+@pytest.mark.parametrize("check", list(CHECKS))
+def test_scope_narrower_than_partition(backend, check):
+    full, split = full_and_partitioned(backend, CHECKS[check], 'STE', scope=[102, 201])
+    pd.testing.assert_frame_equal(split, full, check_dtype=False)
+
+
+def test_codes_limit_the_partitions(backend):
+    index = new_session(backend).hierarchy_index()
+    codes = np.concatenate([index.descendants_of(103, 'FA'), index.descendants_of(201, 'SA2')])
+    full, split = full_and_partitioned(backend, CHECKS['spike'], 'SA4', codes=codes)
+    assert set(index.ancestors_at(split['Code'], 'SA4')) <= {103, 201}
+    pd.testing.assert_frame_equal(split, full, check_dtype=False)
+
+
+def test_ml_partitioned_matches_full_run(backend):
+    full = checks.perform_ml_anomaly_detection(new_session(backend), 0.05, model_dir=None, n_jobs=1)
+    split = partitioned.ml_anomaly_detection(new_session(backend), 0.05, level='SA4', model_dir=None, n_jobs=1)
+    assert not full.empty
+    pd.testing.assert_frame_equal(split.reset_index(drop=True), full.reset_index(drop=True), check_dtype=False)
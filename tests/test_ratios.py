@@ -0,0 +1,175 @@
+"""
+Tests of the ratio engine against ratios computed region by region and year by year from the
+tables of a synthetic database, and of the household ratio check of an SA4 (which only reads the
+rows of the SA4) against a full run.
+"""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import checks
+from data_session import DataSession
+from db_backend import SQLiteBackend
+from metrics import RunMetrics
+from parameters import DEFAULT_PARAMETERS
+from ratios import RATIO_CHECKS, RATIOS, describe, evaluate_ratios, metrics_of
+from registry import CHECKS, build_tasks
+from scheduler import run_checks
+from synthetic_data import generate_database, read_anomalies
+
+N_SA4 = 3
+SIZES = {'sa3_per_sa4': 2, 'sa2_per_sa3': 3, 'fa_per_sa2': 3}
+REGIONS = "SELECT ASGSCode FROM AreasAsgs WHERE RegionType IN ('FA', 'SA2')"
+YEARLY_TOTALS = {
+    'ERP': f"SELECT ASGS_2016, ERPYear, SUM(Number) FROM ERP WHERE ASGS_2016 IN ({REGIONS}) GROUP BY 1, 2",
+    'Births': f"SELECT ASGSCode, Year, SUM(Number) FROM Births WHERE ASGSCode IN ({REGIONS}) GROUP BY 1, 2",
+    'Deaths': f"SELECT ASGSCode, Year, SUM(Number) FROM Deaths WHERE ASGSCode IN ({REGIONS}) GROUP BY 1, 2",
+    'Households': f"SELECT ASGSCode, ERPYear, SUM(Number) FROM Households WHERE HhKey = 19 "
+                  f"AND ASGSCode IN ({REGIONS}) GROUP BY 1, 2",
+}
+
+
+@pytest.fixture(scope='module')
+def path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("ratios") / "synthetic.db")
+    generate_database(path, N_SA4, seed=6, **SIZES)
+    return path
+
+
+@pytest.fixture(scope='module')
+def backend(path):
+    backend = SQLiteBackend(path)
+    yield backend
+    backend.close()
+
+
+def new_session(backend, metrics=None):
+    session = DataSession(backend, checks.execute_sql_query, metrics=metrics)
+    session.index_dir = None
+    return session
+
+
+def yearly_totals(path):
+    with sqlite3.connect(path) as conn:
+        return {metric: {(code, year): total for code, year, total in conn.execute(sql)}
+                for metric, sql in YEARLY_TOTALS.items()}
+
+
+def naive_value(ratio, totals, code, year, years):
+    """
+    output: value of a ratio for one region and year, None where it has no value
+    """
+    def value(metric):
+        current = totals[metric][(code, year)]
+        if not ratio.growth:
+            return current
+        previous = totals[metric][(code, year - 1)] if year - 1 in years else 0
+        return current / previous if previous != 0 else None
+
+    numerator, denominator = value(ratio.numerator), value(ratio.denominator)
+    if numerator is None or denominator is None or denominator == 0:
+        return None
+    return numerator / denominator
+
+
+def naive_ratios(totals, ratios, bounds=None, codes=None):
+    """
+    The purpose of this function is to check ratios one region and year at a time, on the regions
+    and years every metric of the ratios has
+
+    output: DataFrame of [Ratio, Code, Year, Abnormal Years, Peak, Excess]
+    """
+    bounds = bounds or {}
+    metrics = metrics_of(ratios)
+    keys = set.intersection(*(set(totals[metric]) for metric in metrics))
+    common_codes = set.intersection(*({code for code, _ in totals[metric]} for metric in metrics))
+    common_years = set.intersection(*({year for _, year in totals[metric]} for metric in metrics))
+    if codes is not None:
+        common_codes &= set(codes)
+    rows = []
+    for key in ratios:
+        ratio = RATIOS[key]
+        upper, lower = bounds.get(key, (ratio.upper, ratio.lower))
+        for code in sorted(common_codes):
+            abnormal = []
+            for year in sorted(common_years):
+                value = naive_value(ratio, totals, code, year, common_years) if (code, year) in keys else None
+                if value is None or lower < value < upper:
+                    continue
+                excess = value / upper if value >= upper else lower / value if value > 0 else np.inf
+                abnormal.append((year, value, excess))
+            if abnormal:
+                year, value, excess = max(abnormal, key=lambda flag: flag[2])
+                rows.append((key, code, abnormal[0][0], len(abnormal), value, excess))
+    return pd.DataFrame(rows, columns=['Ratio', 'Code', 'Year', 'Abnormal Years', 'Peak', 'Excess'])
+
+
+def matrices_of(backend, ratios):
+    session = new_session(backend)
+    return {metric: session.forecast_matrix(metric) for metric in metrics_of(ratios)}, session.hierarchy_index()
+
+
+@pytest.mark.parametrize("ratios, bounds", [
+    (['household_size'], None),
+    (['household_size'], {'household_size': (2.7, 2.4)}),
+    (RATIO_CHECKS, None),
+    (list(RATIOS), {'birth_rate': (0.012, 0.011), 'household_growth': (1.01, 0.995)}),
+])
+def test_ratios_match_naive_computation(backend, path, ratios, bounds):
+    matrices, index = matrices_of(backend, ratios)
+    flags = evaluate_ratios(matrices, ratios, bounds, index=index)
+    expected = naive_ratios(yearly_totals(path), ratios, bounds)
+    assert not expected.empty
+    pd.testing.assert_frame_equal(flags, expected, check_dtype=False)
+
+
+def test_injected_household_anomaly_is_flagged(backend, path):
+    matrices, index = matrices_of(backend, ['household_size'])
+    flags = evaluate_ratios(matrices, ['household_size'], index=index)
+    anomalies = read_anomalies(path)
+    injected = set(anomalies[anomalies['Check'] == 'household_ratio']['Code'])
+    assert len(injected) == N_SA4 and injected <= set(flags['Code'])
+
+
+def test_codes_and_sa4_limit_the_ratios(backend, path):
+    matrices, index = matrices_of(backend, list(RATIOS))
+    bounds = {'household_size': (2.7, 2.4)}
+    full = evaluate_ratios(matrices, list(RATIOS), bounds, index=index)
+    codes = list(full['Code'].unique()[::3])
+    pd.testing.assert_frame_equal(evaluate_ratios(matrices, list(RATIOS), bounds, codes, index),
+                                  naive_ratios(yearly_totals(path), list(RATIOS), bounds, codes), check_dtype=False)
+
+    sa4 = int(index.codes[index.region_types(index.codes) == 'SA4'][-1])
+    in_sa4 = evaluate_ratios(matrices, list(RATIOS), bounds, index=index, sa4_code=sa4)
+    assert not in_sa4.empty
+    pd.testing.assert_frame_equal(in_sa4, full[index.within(full['Code'], [sa4])].reset_index(drop=True),
+                                  check_dtype=False)
+
+
+def test_describe(backend):
+    matrices, index = matrices_of(backend, list(RATIOS))
+    flags = evaluate_ratios(matrices, index=index, bounds={'household_size': (2.7, 2.4)})
+    descriptions = describe(flags)
+    assert len(descriptions) == len(flags) > 0
+    for flag, description in zip(flags.to_dict('records'), descriptions):
+        ratio = RATIOS[flag['Ratio']]
+        assert description == (f"Found abnormal {ratio.label}, Earliest abnormal year is: {flag['Year']}, abnormal in "
+                               f"{flag['Abnormal Years']} years, peak ratio {round(float(flag['Peak']), ratio.digits)}")
+
+
+def test_sa4_household_check_matches_full_run(backend):
+    parameters = dict(DEFAULT_PARAMETERS, ratio_upper=2.7, ratio_lower=2.4)
+    full = checks.household_check(new_session(backend), 2.7, 2.4)
+    index = new_session(backend).hierarchy_index()
+    for sa4 in index.codes[index.region_types(index.codes) == 'SA4']:
+        metrics = RunMetrics(None)
+        results = run_checks(build_tasks(dict(parameters, sa4_code=int(sa4)), ['household_ratio', 'ratios']),
+                             new_session(backend, metrics), max_connections=2, max_processes=1)
+        in_sa4 = full[index.within(full['Code'], [int(sa4)])].reset_index(drop=True)
+        pd.testing.assert_frame_equal(results[CHECKS['household_ratio'].name], in_sa4, check_dtype=False)
+
+        # the SA4 matrices only hold the rows of the SA4, and are shared by the two checks
+        erp = [record['rows'] for record in metrics.records if record['name'] == "ERP_table(FA&SA2).sql"]
+        assert len(erp) == 1 and erp[0] < len(new_session(backend).fetch("ERP_table(FA&SA2).sql")) / 2
@@ -0,0 +1,119 @@
+"""
+Tests of the rollup engine of the region level sum checks against sums computed row by row from the
+tables of a synthetic database, and of the rollup shared by the four checks against a run of each
+check on its own.
+"""
+import sqlite3
+from collections import defaultdict
+
+import pandas as pd
+import pytest
+
+import checks
+from data_session import DataSession
+from db_backend import SQLiteBackend
+from metrics import RunMetrics
+from parameters import DEFAULT_PARAMETERS
+from registry import CHECKS, build_tasks
+from scheduler import run_checks
+from synthetic_data import generate_database, read_anomalies
+
+N_SA4 = 4
+SIZES = {'sa3_per_sa4': 2, 'sa2_per_sa3': 3, 'fa_per_sa2': 3}
+SUM_CHECKS = {'births': 'Births', 'deaths': 'Deaths', 'households': 'Households', 'population': 'Population'}
+
+TOTALS = {
+    'Births': "SELECT ASGSCode, SUM(Number) FROM Births GROUP BY ASGSCode",
+    'Deaths': "SELECT ASGSCode, SUM(Number) FROM Deaths GROUP BY ASGSCode",
+    'Households': "SELECT ASGSCode, SUM(Number) FROM Households WHERE HhKey = 19 GROUP BY ASGSCode",
+    'Population': "SELECT ASGS_2016, SUM(Number) FROM ERP GROUP BY ASGS_2016",
+}
+
+
+@pytest.fixture(scope='module')
+def path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("rollup") / "synthetic.db")
+    generate_database(path, N_SA4, seed=4, **SIZES)
+    return path
+
+
+@pytest.fixture(scope='module')
+def backend(path):
+    backend = SQLiteBackend(path)
+    yield backend
+    backend.close()
+
+
+def new_session(backend, metrics=None):
+    session = DataSession(backend, checks.execute_sql_query, metrics=metrics)
+    session.index_dir = None
+    return session
+
+
+def naive_rollup(path, tolerance=1):
+    """
+    The purpose of this function is to compare every parent with the sum of its children one link
+    at a time, without the rollup engine
+
+    output: DataFrame of [Metric, Code, Total, Children Total, Difference] of the mismatches
+    """
+    with sqlite3.connect(path) as conn:
+        totals = {(metric, code): total for metric, sql in TOTALS.items() for code, total in conn.execute(sql)}
+        types = dict(conn.execute("SELECT ASGSCode, RegionType FROM AreasAsgs"))
+        links = set(conn.execute("SELECT ASGSCode, Parent FROM AreasAsgs WHERE Parent IS NOT NULL"))
+    children = defaultdict(float)
+    for child, parent in links:
+        if (types[child], types[parent]) in checks.ROLLUP_LEVELS:
+            for metric in TOTALS:
+                if (metric, child) in totals:
+                    children[(metric, parent)] += totals[(metric, child)]
+    rows = [(metric, parent, totals[(metric, parent)], children_total, totals[(metric, parent)] - children_total)
+            for (metric, parent), children_total in children.items()
+            if (metric, parent) in totals and abs(totals[(metric, parent)] - children_total) > tolerance]
+    return pd.DataFrame(rows, columns=['Metric', 'Code', 'Total', 'Children Total', 'Difference']) \
+        .sort_values(['Metric', 'Code']).reset_index(drop=True)
+
+
+def sum_tasks(sa4_code=None):
+    return build_tasks(dict(DEFAULT_PARAMETERS, sa4_code=sa4_code), list(SUM_CHECKS))
+
+
+def test_rollup_matches_naive_sums(backend, path):
+    rollup = checks.rollup_sum_check(new_session(backend))
+    expected = naive_rollup(path)
+    assert not expected.empty
+    pd.testing.assert_frame_equal(rollup[expected.columns].astype({'Metric': str}), expected, check_dtype=False)
+
+    # every injected rollup anomaly is found at its region
+    anomalies = read_anomalies(path)
+    injected = anomalies[anomalies['Check'].isin(SUM_CHECKS)]
+    found = set(zip(rollup['Metric'], rollup['Code']))
+    assert all((SUM_CHECKS[check], code) in found for check, code in zip(injected['Check'], injected['Code']))
+
+
+def test_sum_checks_share_one_rollup(backend):
+    metrics = RunMetrics(None)
+    results = run_checks(sum_tasks(), new_session(backend, metrics), max_connections=2, max_processes=1)
+    assert sum(record['name'] == "Region_totals.sql" for record in metrics.records) == 1
+    for key, metric in SUM_CHECKS.items():
+        alone = checks.region_level_sum_check(new_session(backend), metric)
+        pd.testing.assert_frame_equal(results[CHECKS[key].name], alone, check_dtype=False)
+
+
+def test_sa4_rollup_matches_full_run(backend):
+    full = checks.rollup_sum_check(new_session(backend))
+    index = new_session(backend).hierarchy_index()
+    session = new_session(backend)
+    for sa4 in index.codes[index.region_types(index.codes) == 'SA4']:
+        results = run_checks(sum_tasks(int(sa4)), session, max_connections=2, max_processes=1)
+        for key, metric in SUM_CHECKS.items():
+            in_sa4 = full[(full['Metric'] == metric) & index.within(full['Code'], [int(sa4)])]
+            assert list(results[CHECKS[key].name]['Code']) == list(in_sa4['Code'])
+
+
+def test_codes_limit_the_rollup(backend, path):
+    expected = naive_rollup(path)
+    codes = list(expected['Code'].unique()[::2])
+    births = checks.region_level_sum_check(new_session(backend), 'Births', codes=codes)
+    in_codes = set(expected[(expected['Metric'] == 'Births') & expected['Code'].isin(codes)]['Code'])
+    assert in_codes and set(births['Code']) == in_codes
@@ -0,0 +1,110 @@
+"""
+Tests of the rule engine of the negative and sanity checks against a row by row scan of the same
+query, and of the rules pushed down into the query (the /* filter */ marker) against a run that
+fetches every row.
+"""
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import checks
+from data_session import DataSession, read_sql_file
+from db_backend import SQLiteBackend
+from metrics import RunMetrics
+from rules import NEGATIVE_SANITY_TABLE
+from synthetic_data import generate_database, read_anomalies
+
+SIZES = {'sa3_per_sa4': 2, 'sa2_per_sa3': 2, 'fa_per_sa2': 3}
+
+
+@pytest.fixture(scope='module')
+def path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("rules") / "synthetic.db")
+    generate_database(path, 3, seed=5, **SIZES)
+    # a births row of an unknown sex has no Sex in the query (a missing value), and deaths of an SA2
+    # below -10 besides the injected negative births
+    with sqlite3.connect(path) as conn:
+        fa, sa2 = conn.execute("SELECT MAX(ASGSCode), MAX(Parent) FROM AreasAsgs WHERE RegionType = 'FA'").fetchone()
+        conn.execute("INSERT INTO Births (ASGSCode, SexKey, AgeKey, Year, Number) VALUES (?, 3, 5, 2030, 0)", (fa,))
+        conn.execute("INSERT INTO Deaths (ASGSCode, SexKey, AgeKey, Year, Number) VALUES (?, 1, 5, 2030, -12)", (sa2,))
+        conn.commit()
+    return path
+
+
+@pytest.fixture(scope='module')
+def backend(path):
+    backend = SQLiteBackend(path)
+    yield backend
+    backend.close()
+
+
+def new_session(backend, metrics=None):
+    session = DataSession(backend, checks.execute_sql_query, metrics=metrics)
+    session.index_dir = None
+    return session
+
+
+def fetch_all(backend):
+    return backend.read_query(read_sql_file(NEGATIVE_SANITY_TABLE))
+
+
+def naive_negative(df):
+    """
+    output: set of (Code, Region Type, Description) of the rows below -10, one row at a time
+    """
+    flags = set()
+    for row in df.itertuples(index=False):
+        if row.RegionType.strip() in ('FA', 'SA2') and row.DataType in ('Births', 'Deaths', 'ERP') and row.Total < -10:
+            flags.add((row.ASGSCode, row.RegionType.strip(), f"Negative {row.DataType} Values Found"))
+    return flags
+
+
+def flag_set(output):
+    return set(zip(output['Code'], output['Region Type'], output['Description']))
+
+
+def test_negative_rules_match_naive_scan(backend, path):
+    output = checks.perform_negative_check(new_session(backend))
+    expected = naive_negative(fetch_all(backend))
+    assert expected and flag_set(output) == expected
+
+    anomalies = read_anomalies(path)
+    assert set(anomalies[anomalies['Check'] == 'negative']['Code']) <= set(output['Code'])
+
+
+def test_pushdown_matches_full_fetch(backend):
+    full_metrics, pushed_metrics = RunMetrics(None), RunMetrics(None)
+    full = checks.perform_negative_check(new_session(backend, full_metrics))
+    pushed = checks.perform_negative_check(new_session(backend, pushed_metrics), pushdown=True)
+    pd.testing.assert_frame_equal(pushed, full, check_dtype=False)
+
+    # only the rows failing a rule are fetched
+    rows = [[record['rows'] for record in metrics.records if record['name'] == NEGATIVE_SANITY_TABLE]
+            for metrics in (full_metrics, pushed_metrics)]
+    assert rows[1][0] < rows[0][0] / 10
+
+
+def test_pushdown_with_codes(backend):
+    full = checks.perform_negative_check(new_session(backend))
+    codes = list(full['Code'][::2])
+    pushed = checks.perform_negative_check(new_session(backend), codes=codes, pushdown=True)
+    assert not pushed.empty and flag_set(pushed) == flag_set(full[full['Code'].isin(codes)])
+
+
+def test_sanity_rules_match_naive_scan(backend):
+    output = checks.perform_sanity_check(new_session(backend))
+    df = fetch_all(backend)
+    missing = {('All', region_type.strip(), 'Missing Values Detected')
+               for region_type in df[df.isnull().any(axis=1)]['RegionType']}
+    duplicated = {(code, region_type.strip(), 'Duplicate Records Found')
+                  for code, region_type in df[df.duplicated()][['ASGSCode', 'RegionType']].itertuples(index=False)}
+    assert missing and flag_set(output) == missing | duplicated
+
+
+def test_rules_share_one_fetch(backend):
+    metrics = RunMetrics(None)
+    session = new_session(backend, metrics)
+    checks.perform_negative_check(session)
+    checks.perform_sanity_check(session)
+    assert sum(record['name'] == NEGATIVE_SANITY_TABLE for record in metrics.records) == 1
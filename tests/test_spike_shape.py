@@ -0,0 +1,122 @@
+"""
+Regression tests of the vectorized spike and trend shape checks against the per-region loops of
+the legacy implementation (checks.py before the vectorization), on random ERP series with missing
+years and on short series.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from checks import classify_trend_shapes, detect_spikes
+
+
+def legacy_check_outliers(data_list, sensitivity, multiplier):
+    Q1 = np.percentile(data_list, 25)
+    Q3 = np.percentile(data_list, 75)
+    IQR = Q3 - Q1
+    lower_bound = Q1 - multiplier * IQR
+    upper_bound = Q3 + multiplier * IQR
+    for data in data_list:
+        if abs(data) > sensitivity:
+            if data > upper_bound or data < lower_bound: return True
+    return False
+
+
+def legacy_encode_change(data_list, sensitivity):
+    output_string = ""
+    for data in data_list:
+        if data > sensitivity: output_string += "+"
+        elif data < -1*sensitivity: output_string += "-"
+        else: output_string += "0"
+    return output_string
+
+
+def legacy_find_abnormal_shape_encode(encode_string):
+    if re.search(r'\+0-', encode_string) or re.search(r'-0\+', encode_string):
+        return True, "small bell curve detect"
+    elif re.search(r'\+0+-', encode_string) or re.search(r'-0+\+', encode_string):
+        return True, "Bell curve detect"
+    elif re.search(r'\+-\+', encode_string) or re.search(r'-\+-', encode_string):
+        return True, "wave detect"
+    elif re.search(r'\+-', encode_string) or re.search(r'-\+', encode_string):
+        return True, "straight change of sign detect"
+    else: return False, "no message"
+
+
+def random_rates(rng, n_years, n_regions, missing=0.0):
+    """
+    output: year x region DataFrame of growth rates as the checks compute them (pct_change of the
+            ERP, without the first year), with some missing ERP years
+    """
+    growth = rng.normal(0.01, 0.01, (n_years, n_regions))
+    # a few spikes, drops and flat years
+    growth[rng.random(growth.shape) < 0.05] *= rng.choice([-30, 30])
+    growth[rng.random(growth.shape) < 0.1] = 0
+    erp = 1000 * np.cumprod(1 + growth, axis=0)
+    erp[rng.random(erp.shape) < missing] = np.nan
+    wide = pd.DataFrame(erp, index=pd.Index(2020 + np.arange(n_years), name='Year'),
+                        columns=pd.Index(10101000 + np.arange(n_regions), name='Code'))
+    return wide.pct_change(fill_method=None).iloc[1:]
+
+
+def legacy_spikes(rate_of_change, sensitivity, multiplier):
+    return {region for region in rate_of_change.columns
+            if legacy_check_outliers(rate_of_change[region][1:], sensitivity, multiplier)}
+
+
+def legacy_shapes(rate_of_change, sensitivity):
+    shapes = {}
+    for region in rate_of_change.columns:
+        is_abnormal, message = legacy_find_abnormal_shape_encode(
+            legacy_encode_change(rate_of_change[region].values, sensitivity))
+        if is_abnormal:
+            shapes[region] = message
+    return shapes
+
+
+@pytest.mark.parametrize("seed", range(100))
+@pytest.mark.parametrize("missing", [0.0, 0.05])
+def test_spikes_match_legacy(seed, missing):
+    rng = np.random.default_rng(seed)
+    rate_of_change = random_rates(rng, int(rng.integers(4, 30)), 20, missing)
+    sensitivity, multiplier = rng.choice([0.001, 0.005, 0.01]), rng.choice([1, 3, 5])
+    spikes = detect_spikes(rate_of_change.iloc[1:], sensitivity, multiplier)
+    assert set(spikes.index[spikes['flagged']]) == legacy_spikes(rate_of_change, sensitivity, multiplier)
+
+
+@pytest.mark.parametrize("seed", range(100))
+@pytest.mark.parametrize("missing", [0.0, 0.05])
+def test_shapes_match_legacy(seed, missing):
+    rng = np.random.default_rng(seed)
+    rate_of_change = random_rates(rng, int(rng.integers(2, 30)), 20, missing)
+    sensitivity = rng.choice([0.001, 0.005, 0.01])
+    shapes = classify_trend_shapes(rate_of_change, sensitivity)
+    assert shapes['pattern'].dropna().to_dict() == legacy_shapes(rate_of_change, sensitivity)
+
+
+@pytest.mark.parametrize("n_years", [1, 2, 3])
+def test_short_series(n_years):
+    rng = np.random.default_rng(n_years)
+    rate_of_change = random_rates(rng, n_years + 1, 5)
+    shapes = classify_trend_shapes(rate_of_change, 0.005)
+    assert shapes['pattern'].dropna().to_dict() == legacy_shapes(rate_of_change, 0.005)
+
+    spikes = detect_spikes(rate_of_change.iloc[1:], 0.005, 5)
+    if n_years < 2:
+        # the legacy loop could not take the quartiles of an empty series, nothing is flagged
+        assert not spikes['flagged'].any()
+    else:
+        assert set(spikes.index[spikes['flagged']]) == legacy_spikes(rate_of_change, 0.005, 5)
+
+
+def test_all_missing_region_is_not_flagged():
+    rate_of_change = random_rates(np.random.default_rng(0), 10, 3)
+    rate_of_change.iloc[:, 1] = np.nan
+    spikes = detect_spikes(rate_of_change.iloc[1:], 0.005, 1)
+    shapes = classify_trend_shapes(rate_of_change, 0.005)
+    region = rate_of_change.columns[1]
+    assert not spikes.loc[region, 'flagged'] and np.isnan(spikes.loc[region, 'worst_growth'])
+    assert shapes.loc[region, 'pattern'] is None
+    assert region not in legacy_spikes(rate_of_change, 0.005, 1) | set(legacy_shapes(rate_of_change, 0.005))